@@ -1,8 +1,30 @@
+import logging
 from pathlib import Path
-from pymodaq.utils.logger import set_logger  # to be imported by other modules.
-
-from .utils import Config
-config = Config()
 
 with open(str(Path(__file__).parent.joinpath('resources/VERSION')), 'r') as fvers:
     __version__ = fvers.read().strip()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger of the same name as pymodaq's set_logger(name) but without importing pymodaq
+
+    Hardware modules use it so that they can be imported (and used headless) without loading pymodaq and Qt. When
+    pymodaq is running, its handlers and level on the "pymodaq" base logger apply to it through propagation.
+    """
+    return logging.getLogger(f'pymodaq.{name}')
+
+
+def __getattr__(name):
+    """Load the attributes relying on pymodaq on first access only
+
+    PyMoDAQ imports every installed plugin package when building the dashboard, so importing this package should
+    not load pymodaq (set_logger) nor parse the TOML configuration (config) until they are actually used.
+    """
+    if name == 'set_logger':
+        from pymodaq.utils.logger import set_logger  # to be imported by other modules.
+        return set_logger
+    if name == 'config':
+        from .utils import Config
+        globals()['config'] = Config()
+        return globals()['config']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Headless logger of Cellkraft generators: polls one or more generators at a fixed rate and writes their snapshots to
+rotating CSV files, without Qt nor the PyMoDAQ dashboard
+
+    cellkraft-logger host1 host2:5020 --interval 1 --directory ~/cellkraft_logs --max-mb 50 --max-hours 24
+
+SIGTERM and SIGINT stop the polling and close the files cleanly, SIGHUP (where available) starts new files.
+
+With --alarms rules.toml, each generator is watched by an AlarmEngine, the rules being [[alarm]] tables of
+AlarmEngine.add_rule arguments, e.g.
+
+    [[alarm]]
+    name = "tube over temperature"
+    channel = "Tube"
+    kind = "high"
+    limit = 250
+    hysteresis = 5
+    latching = true
+    interlock = true  # stop the generator
+
+With --calibration corrections.toml, the readbacks of every generator are corrected (see Calibration) in the CSV
+files. The raw logs (--raw) hold the registers as read, the correction being applied when reading them
+(Calibration.correct).
+"""
+from pathlib import Path
+import datetime
+import signal
+import threading
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, SNAPSHOT_CHANNELS
+from pymodaq_plugins_cellkraft.hardware.cellkraft.alarms import AlarmEngine
+from pymodaq_plugins_cellkraft.hardware.cellkraft.calibration import Calibration
+from pymodaq_plugins_cellkraft.hardware.cellkraft.derived import DERIVED_CHANNELS
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogWriter
+
+
+class RotatingCsvWriter:
+    """Snapshots appended to CSV files, a new file being started when the current one gets too big or too old
+
+    Files are named {prefix}_{date-time of their first snapshot}.csv and flushed every flush_interval seconds, so
+    that at most that much data is lost on a power cut.
+
+    :param directory: where the files are written
+    :param prefix: start of the file names
+    :param columns: snapshot keys written, after the timestamp
+    :param max_bytes: size of a file before rotation, 0 for no limit
+    :param max_age: seconds covered by a file before rotation, 0 for no limit
+    :param flush_interval: seconds between two flushes to disk
+    """
+    extension = 'csv'
+
+    def __init__(self, directory, prefix: str, columns, max_bytes: int = 50_000_000, max_age: float = 86400.,
+                 flush_interval: float = 5.):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.columns = list(columns)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.path: Path = None
+        self.rows = 0  # rows written since the creation
+        self._file = None
+        self._opened = 0.
+        self._flushed = 0.
+        self._lock = threading.Lock()
+
+    def _open(self, timestamp: float):
+        stamp = datetime.datetime.fromtimestamp(timestamp).strftime('%Y%m%d-%H%M%S')
+        path = self.directory.joinpath(f'{self.prefix}_{stamp}.{self.extension}')
+        index = 1
+        while path.exists():
+            path = self.directory.joinpath(f'{self.prefix}_{stamp}_{index}.{self.extension}')
+            index += 1
+        self.path = path
+        self._file = self._create(path)
+        self._opened = self._flushed = time.monotonic()
+        logger.info(f'writing {path}')
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _create(self, path: Path):
+        file = open(path, 'w', newline='')
+        file.write(','.join(['timestamp'] + self.columns) + '\n')
+        return file
+
+    def _append(self, line):
+        self._file.write(line)
+
+    def _format(self, snapshot: dict):
+        return ','.join([f'{snapshot["timestamp"]:.3f}'] + [f'{snapshot.get(column, "")}'
+                                                             for column in self.columns]) + '\n'
+
+    def write(self, snapshot: dict):
+        """Append a snapshot (dict with a "timestamp" key and the columns), rotating the file if needed"""
+        line = self._format(snapshot)
+        with self._lock:
+            now = time.monotonic()
+            if self._file is not None and ((self.max_bytes and self._file.tell() >= self.max_bytes) or
+                                           (self.max_age and now - self._opened >= self.max_age)):
+                self._close()
+            if self._file is None:
+                self._open(snapshot["timestamp"])
+            self._append(line)
+            self.rows += 1
+            if now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+
+    def rotate(self):
+        """Close the current file, the next snapshot starting a new one"""
+        with self._lock:
+            self._close()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class RotatingRawWriter(RotatingCsvWriter):
+    """Snapshots appended to raw register logs (see RawLogWriter), rotated as the CSV files
+
+    A flush writes the pending snapshots as a block: the longer flush_interval, the better the compression.
+
+    :param scalings: divisor of each column giving its physical value from its register
+    :param block_size: maximum snapshots per block
+    :param driver: CellKraftE1500Drivers whose snapshots are written: their registers are then taken as read
+        (last_raw_snapshot), before the calibration of the driver, instead of being quantized back from the values
+    """
+    extension = 'ckr'
+
+    def __init__(self, directory, prefix: str, columns, scalings, block_size: int = 4096, driver=None, **options):
+        super().__init__(directory, prefix, columns, **options)
+        self.scalings = scalings
+        self.block_size = block_size
+        self.driver = driver
+
+    def _create(self, path: Path):
+        return RawLogWriter(path, self.columns, self.scalings, self.block_size)
+
+    def _format(self, snapshot: dict):
+        last = getattr(self.driver, 'last_raw_snapshot', None)
+        if last is not None and last[0] == snapshot["timestamp"]:
+            return last
+        return snapshot
+
+    def _append(self, line):
+        if isinstance(line, dict):
+            self._file.write(line)
+        else:
+            self._file.write_raw(*line)
+
+
+def parse_host(address: str, port: int = 502):
+    """(host, port) from "host" or "host:port" """
+    host, _, given = address.rpartition(':') if address.count(':') == 1 else (address, '', '')
+    return host, int(given) if given else port
+
+
+class CellkraftLogger:
+    """Poll generators and write their snapshots to rotating CSV files, one series of files per generator
+
+    Each generator is polled by the SnapshotStream of its driver, the snapshot channels being read in a single
+    batch of requests (pipelined if pipeline_window > 1). The files hold the snapshot channels followed by the
+    DERIVED_CHANNELS (dew point, absolute humidity, water dosed since the start). With raw, the snapshot channels
+    are written as raw register logs instead, several times smaller (the derived channels can be recomputed). They
+    hold the registers as read, so the calibration only applies to the CSV files.
+
+    :param hosts: "host" or "host:port" of each generator
+    :param directory: where the files are written
+    :param interval: seconds between two snapshots
+    :param port: Modbus TCP port of the hosts given without one
+    :param pipeline_window: requests in flight in a snapshot
+    :param heartbeat_interval: see SyncModBusInstrument, 0 to disable
+    :param alarms: rules of the AlarmEngine of each generator, dicts of AlarmEngine.add_rule arguments
+    :param raw: write RotatingRawWriter logs (.ckr) instead of CSV files
+    :param calibration: corrections of the readbacks of the generators, see CellKraftE1500Drivers.set_calibration
+    :param writer_options: keyword arguments of RotatingCsvWriter (max_bytes, max_age, flush_interval)
+    """
+    def __init__(self, hosts, directory, interval: float = 1., port: int = 502, pipeline_window: int = 1,
+                 heartbeat_interval: float = 0., alarms=(), raw: bool = False, calibration: Calibration = None,
+                 **writer_options):
+        self.interval = interval
+        self.drivers = []
+        self.writers = []
+        self.alarms = []
+        for address in hosts:
+            host, host_port = parse_host(address, port)
+            driver = CellKraftE1500Drivers(host, port=host_port, pipeline_window=pipeline_window,
+                                           heartbeat_interval=heartbeat_interval, calibration=calibration)
+            prefix = f'{host}' if host_port == 502 else f'{host}_{host_port}'
+            self.drivers.append(driver)
+            channels = [reference.__name__ for reference in SNAPSHOT_CHANNELS]
+            if raw:
+                self.writers.append(RotatingRawWriter(directory, prefix.replace('/', '_'), channels,
+                                                      driver.read_scalings, driver=driver, **writer_options))
+            else:
+                self.writers.append(RotatingCsvWriter(directory, prefix.replace('/', '_'),
+                                                      channels + list(DERIVED_CHANNELS), **writer_options))
+            self.alarms.append(AlarmEngine.from_rules(channels, alarms, driver))
+
+    def start(self):
+        for driver, writer, alarms in zip(self.drivers, self.writers, self.alarms):
+            driver.init_hardware()
+            if not driver.init:
+                logger.warning(f'{driver.host} not reachable yet, retrying at each snapshot')
+            stream = driver.start_stream(self.interval, capacity=1000)
+            alarms.attach(stream)
+            stream.subscribe(writer.write)
+
+    def rotate(self):
+        for writer in self.writers:
+            writer.rotate()
+
+    def stop(self):
+        """Stop polling, then close the files and the connections"""
+        for driver in self.drivers:
+            driver.stop_stream()
+        for writer in self.writers:
+            writer.close()
+        for driver in self.drivers:
+            driver.close()
+
+    def run(self, stop_event: threading.Event):
+        """Log until stop_event is set"""
+        self.start()
+        try:
+            stop_event.wait()
+        finally:
+            self.stop()
+            logger.info(f'stopped, {sum(writer.rows for writer in self.writers)} snapshots written')
+
+
+def load_alarms(path) -> list:
+    """Rules of the [[alarm]] tables of a toml file, none if path is None"""
+    if path is None:
+        return []
+    import toml  # a dependency of pymodaq
+    return toml.load(path).get('alarm', [])
+
+
+def main(args=None):
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description='Log Cellkraft generators to rotating CSV files, without GUI')
+    parser.add_argument('hosts', nargs='+', help='generators, as host or host:port')
+    parser.add_argument('--interval', type=float, default=1., help='seconds between two snapshots')
+    parser.add_argument('--directory', default=str(Path.home().joinpath('cellkraft_logs')), help='output directory')
+    parser.add_argument('--port', type=int, default=502, help='Modbus TCP port of the hosts given without one')
+    parser.add_argument('--window', type=int, default=1, help='pipelined requests in a snapshot')
+    parser.add_argument('--heartbeat', type=float, default=0., help='idle seconds before a keep-alive read')
+    parser.add_argument('--max-mb', type=float, default=50., help='size of a file before rotation, 0: no limit')
+    parser.add_argument('--max-hours', type=float, default=24., help='hours per file before rotation, 0: no limit')
+    parser.add_argument('--flush', type=float, default=5., help='seconds between two flushes to disk')
+    parser.add_argument('--raw', action='store_true', help='write compact raw register logs (.ckr) instead of CSV')
+    parser.add_argument('--alarms', help='toml file of [[alarm]] rules, see AlarmEngine.add_rule')
+    parser.add_argument('--calibration', help='toml file of readback corrections, see Calibration')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    cellkraft_logger = CellkraftLogger(args.hosts, args.directory, interval=args.interval, port=args.port,
+                                       pipeline_window=args.window, heartbeat_interval=args.heartbeat,
+                                       max_bytes=int(args.max_mb * 1e6), max_age=args.max_hours * 3600.,
+                                       flush_interval=args.flush, alarms=load_alarms(args.alarms), raw=args.raw,
+                                       calibration=Calibration.load(args.calibration) if args.calibration else None)
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        logger.info(f'{signal.Signals(signum).name} received, stopping')
+        stop_event.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: cellkraft_logger.rotate())
+    cellkraft_logger.run(stop_event)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,130 @@
+from pathlib import Path
 from typing import Union, List, Dict
 
 from pymodaq.control_modules.move_utility_classes import DAQ_Move_base, comon_parameters_fun, main, DataActuatorType,\
     DataActuator  # common set of parameters for all actuators
 from pymodaq.utils.daq_utils import ThreadCommand # object used to send info back to the main thread
 from pymodaq.utils.parameter import Parameter
-from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Eseries_Config
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, DEVICES, Air, Steam, Flow, \
+    Tube
+from pymodaq_plugins_cellkraft.hardware.cellkraft.calibration import Calibration
+from pymodaq_plugins_cellkraft.hardware.cellkraft.remote import RemoteDriver
+from pymodaq_plugins_cellkraft.hardware.cellkraft.settling import SettlingPredictor
+from pymodaq_plugins_cellkraft.hardware.tracing import tracer, traced
+from pymodaq_plugins_cellkraft.hardware.transports import TRANSPORTS
+
+# axis name: (setpoint register name in CellKraftE1500Drivers.registers, channel read back as the actuator value)
+AXES = {'RH': ('RH', Air),
+        'Steam T': ('SP_SteamT', Steam),
+        'Flow': ('SP_Flow', Flow),
+        'Tube T': ('SP_Tube_Temp', Tube),
+        }
 
-#class PythonWrapperOfYourInstrument:
-#    pass
 
 class DAQ_Move_CellkraftE1500(DAQ_Move_base):
-    """ Instrument plugin class for an actuator.
-    
+    """ Instrument plugin class for the setpoints of a Cellkraft E-series steam generator.
+
     This object inherits all functionalities to communicate with PyMoDAQ’s DAQ_Move module through inheritance via
     DAQ_Move_base. It makes a bridge between the DAQ_Move module and the Python wrapper of a particular instrument.
 
-    TODO Complete the docstring of your plugin with:
-        * The set of controllers and actuators that should be compatible with this instrument plugin.
-        * With which instrument and controller it has been tested.
-        * The version of PyMoDAQ during the test.
-        * The version of the operating system.
-        * Installation instructions: what manufacturer’s drivers should be installed to make it run?
+    Each axis is a setpoint of the generator (RH, steam temperature, flow, tube temperature), the actuator value
+    being the corresponding process value read back from the generator. Setpoints are quantized to the register
+    resolution and a write is only sent when the quantized value changes, so that PID loops or fast scans do not
+    flood the controller.
+
+    With "Settling prediction" on, a move is only considered done once a first-order fit of the readback predicts
+    it settled within the band (see SettlingPredictor), instead of relying on a fixed wait time in the scan.
+
+    With a "Heartbeat" interval set, the generator is read whenever the connection has been idle that long, so that a
+    session dropped by a firewall between scan phases is reopened in the background.
+
+    With "Out of process" on, the driver runs in a worker process polling the generator (see RemoteDriver): the
+    actuator values are read from the snapshot it publishes in shared memory, so a stalled connection never blocks
+    the dashboard, and a crashed worker is restarted by initializing the actuator again.
+
+    With a "Calibration file" set, the values read back are corrected against reference instruments (toml file of
+    per-channel tables or polynomials, see Calibration), the correction being applied through a lookup table over
+    the raw registers.
+
+    With "Recording" on, the Modbus traffic is saved to a file that can be replayed offline by selecting the replay
+    transport, Host being the file.
+
+    With "Profiling" on, the plugin methods, the driver and the Modbus requests are recorded as spans of the package
+    tracer, saved as a Chrome trace json file (to be opened in https://ui.perfetto.dev) when it is turned off or the
+    plugin is closed.
+
+    Tested with a Cellkraft E1500 over Modbus TCP.
 
     Attributes:
     -----------
     controller: object
         The particular object that allow the communication with the hardware, in general a python wrapper around the
          hardware library.
-         
-    # TODO add your particular attributes here if any
 
     """
-    is_multiaxes = False  # TODO for your plugin set to True if this plugin is controlled for a multiaxis controller
-    _axis_names: Union[List[str], Dict[str, int]] = ['Axis1', 'Axis2']  # TODO for your plugin: complete the list
-    _controller_units: Union[str, List[str]] = 'mm'  # TODO for your plugin: put the correct unit here, it could be
-    # TODO  a single str (the same one is applied to all axes) or a list of str (as much as the number of axes)
-    _epsilon: Union[float, List[float]] = 0.1  # TODO replace this by a value that is correct depending on your controller
-    # TODO it could be a single float of a list of float (as much as the number of axes)
+    is_multiaxes = True
+    _axis_names: Union[List[str], Dict[str, int]] = list(AXES.keys())
+    _controller_units: Union[str, List[str]] = ['%', '°C', 'g/min', '°C']
+    _epsilons: Union[float, List[float]] = [1., 1., 0.5, 1.]
     data_actuator_type = DataActuatorType.DataActuator  # wether you use the new data style for actuator otherwise set this
     # as  DataActuatorType.float  (or entirely remove the line)
 
-    params = [  {'title': 'Device:', 'name': 'device', 'type': 'str', 'value': 'Cellkraft E1500 Series', 'readonly': True},
-                {'title': 'Host:', 'name': 'host', 'type': 'str', 'value': 'cet-cc01-gen01.insa-lyon.fr'},
+    params = [  {'title': 'Device:', 'name': 'device', 'type': 'list', 'limits': list(DEVICES.keys()),
+                 'value': 'Cellkraft E1500 Series'},
+                {'title': 'Host:', 'name': 'host', 'type': 'str', 'value': 'cet-cc01-gen01.insa-lyon.fr',
+                 'tip': 'hostname or ip address, serial port (COM3, /dev/ttyUSB0...) for Modbus RTU or recording file '
+                        'for replay'},
+                {'title': 'Transport:', 'name': 'transport', 'type': 'list', 'limits': list(TRANSPORTS.keys()),
+                 'value': 'tcp'},
+                {'title': 'Port:', 'name': 'port', 'type': 'int', 'value': 502},
+                {'title': 'Baudrate:', 'name': 'baudrate', 'type': 'int', 'value': 19200,
+                 'tip': 'serial line speed for the rtu and rtu_over_tcp transports'},
+                {'title': 'Pipeline window:', 'name': 'pipeline_window', 'type': 'int', 'value': 1, 'min': 1,
+                 'max': 16, 'tip': 'Modbus requests in flight when reading all channels, 1 for strict serial mode'},
+                {'title': 'Heartbeat (s):', 'name': 'heartbeat', 'type': 'float', 'value': 0., 'min': 0.,
+                 'tip': 'read the generator after this idle time to keep the connection open (reconnecting in the '
+                        'background if it was dropped), 0 to disable'},
+                {'title': 'Out of process:', 'name': 'out_of_process', 'type': 'bool', 'value': False,
+                 'tip': 'run the driver in a worker process, the values being read from shared memory (applied at '
+                        'initialization)'},
+                {'title': 'Calibration file:', 'name': 'calibration_file', 'type': 'browsepath', 'filetype': True,
+                 'value': '', 'tip': 'toml file of the readback corrections (see Calibration), empty for none'},
                 {'title': 'Comments:', 'name': 'comment', 'type': 'text', 'value': ''},
-                ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names, epsilon=_epsilon)
-    # _epsilon is the initial default value for the epsilon parameter allowing pymodaq to know if the controller reached
-    # the target value. It is the developer responsibility to put here a meaningful value
+                {'title': 'Settling prediction:', 'name': 'settling', 'type': 'group', 'children': [
+                    {'title': 'Use prediction:', 'name': 'use_prediction', 'type': 'bool', 'value': False},
+                    {'title': 'Band:', 'name': 'band', 'type': 'float', 'value': 0.5, 'min': 0.,
+                     'tip': 'half-width of the band around the final value considered as settled'},
+                    {'title': 'Window (samples):', 'name': 'window', 'type': 'int', 'value': 60, 'min': 8},
+                    {'title': 'Lookahead (s):', 'name': 'lookahead', 'type': 'float', 'value': 600., 'min': 0.,
+                     'tip': 'accept the point once its final value is predicted and the readback is predicted to '
+                            'enter the band within this time (0 to wait for the readback to be in the band)'},
+                    {'title': 'Final value:', 'name': 'final_value', 'type': 'float', 'value': 0., 'readonly': True},
+                ]},
+                {'title': 'Recording:', 'name': 'recording', 'type': 'group', 'children': [
+                    {'title': 'Record traffic:', 'name': 'record', 'type': 'bool', 'value': False,
+                     'tip': 'record the Modbus requests and answers, to be replayed with the replay transport'},
+                    {'title': 'Recording file:', 'name': 'record_file', 'type': 'browsepath', 'filetype': True,
+                     'value': str(Path.home().joinpath('cellkraft_session.ckmr'))},
+                ]},
+                {'title': 'Profiling:', 'name': 'profiling', 'type': 'group', 'children': [
+                    {'title': 'Enabled:', 'name': 'enabled', 'type': 'bool', 'value': False},
+                    {'title': 'Trace file:', 'name': 'trace_file', 'type': 'browsepath', 'filetype': True,
+                     'value': str(Path.home().joinpath('cellkraft_trace.json'))},
+                ]},
+                ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names)
 
     def ini_attributes(self):
-        #  TODO declare the type of the wrapper (and assign it to self.controller) you're going to use for easy
-        #  autocompletion
         self.controller: CellKraftE1500Drivers = None
+        self.predictor = SettlingPredictor(band=self.settings['settling', 'band'],
+                                           window=self.settings['settling', 'window'],
+                                           lookahead=self.settings['settling', 'lookahead'])
 
-        #TODO declare here attributes you want/need to init with a default value
-        pass
+    @property
+    def register_name(self) -> str:
+        """Name of the driver setpoint register driven by the current axis"""
+        return AXES[self.axis_name][0]
 
+    @traced()
     def get_actuator_value(self):
         """Get the current value from the hardware with scaling conversion.
 
@@ -62,31 +132,34 @@ class DAQ_Move_CellkraftE1500(DAQ_Move_base):
         -------
         float: The position obtained after scaling conversion.
         """
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        pos = DataActuator(data=self.controller.your_method_to_get_the_actuator_value())  # when writing your own plugin replace this line
+        pos = DataActuator(data=self.controller.read_channel(AXES[self.axis_name][1]), units=self.axis_unit)
         pos = self.get_position_with_scaling(pos)
         return pos
 
     def user_condition_to_reach_target(self) -> bool:
-        """ Implement a condition for exiting the polling mechanism and specifying that the
-        target value has been reached
+        """ On top of epsilon, wait for the settling predictor if activated
 
        Returns
         -------
         bool: if True, PyMoDAQ considers the target value has been reached
         """
-        # TODO either delete this method if the usual polling is fine with you, but if need you can
-        #  add here some other condition to be fullfilled either a completely new one or
-        #  using or/and operations between the epsilon_bool and some other custom booleans
-        #  for a usage example see DAQ_Move_brushlessMotor from the Thorlabs plugin
-        return True
+        if not self.settings['settling', 'use_prediction']:
+            return True
+        if self.predictor.final_value is not None:
+            self.settings.child('settling', 'final_value').setValue(self.predictor.final_value)
+        return self.predictor.settled
 
     def close(self):
         """Terminate the communication protocol"""
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        #  self.controller.your_method_to_terminate_the_communication()  # when writing your own plugin replace this line
+        if self.settings['profiling', 'enabled']:
+            tracer.stop()
+        if self.is_master:
+            self.controller.close()
+
+    def load_calibration(self):
+        """Calibration of the calibration file setting, None if not set"""
+        path = self.settings['calibration_file']
+        return Calibration.load(path) if path else None
 
     def commit_settings(self, param: Parameter):
         """Apply the consequences of a change of value in the detector settings
@@ -96,17 +169,34 @@ class DAQ_Move_CellkraftE1500(DAQ_Move_base):
         param: Parameter
             A given parameter (within detector_settings) whose value has been changed by the user
         """
-        ## TODO for your custom plugin
-        if param.name() == 'axis':
-            self.axis_unit = self.controller.your_method_to_get_correct_axis_unit()
-            # do this only if you can and if the units are not known beforehand, for instance
-            # if the motors connected to the controller are of different type (mm, µm, nm, , etc...)
-            # see BrushlessDCMotor from the thorlabs plugin for an exemple
-
-        elif param.name() == "a_parameter_you've_added_in_self.params":
-           self.controller.your_method_to_apply_this_param_change()
-        else:
-            pass
+        if param.name() == 'enabled':
+            if param.value():
+                tracer.start(self.settings['profiling', 'trace_file'])
+                self.emit_status(ThreadCommand('Update_Status', ['Profiling started']))
+            else:
+                tracer.stop()
+                self.emit_status(ThreadCommand('Update_Status', [f'Profiling trace saved in {tracer.path}']))
+        elif param.name() == 'record':
+            if param.value():
+                self.controller.instr.start_recording(self.settings['recording', 'record_file'])
+                self.emit_status(ThreadCommand('Update_Status', ['Recording started']))
+            else:
+                self.controller.instr.stop_recording()
+                self.emit_status(ThreadCommand('Update_Status', [
+                    f"Recording saved in {self.settings['recording', 'record_file']}"]))
+        elif param.name() == 'calibration_file':
+            self.controller.set_calibration(self.load_calibration())
+        elif param.name() == 'heartbeat':
+            self.controller.instr.start_heartbeat(param.value())
+        elif param.name() == 'trace_file':
+            tracer.path = Path(param.value())
+        elif param.name() == 'band':
+            self.predictor.band = param.value()
+        elif param.name() == 'lookahead':
+            self.predictor.lookahead = param.value()
+        elif param.name() == 'window':
+            self.predictor = SettlingPredictor(band=self.settings['settling', 'band'], window=param.value(),
+                                               lookahead=self.settings['settling', 'lookahead'])
 
     def ini_stage(self, controller=None):
         """Actuator communication initialization
@@ -122,18 +212,23 @@ class DAQ_Move_CellkraftE1500(DAQ_Move_base):
         initialized: bool
             False if initialization failed otherwise True
         """
-        #raise NotImplemented  # TODO when writing your own plugin remove this line and modify the ones below
         self.ini_stage_init(slave_controller=controller)  # will be useful when controller is slave
 
         if self.is_master:  # is needed when controller is master
-            self.controller = CellKraftE1500Drivers(self.settings['host']) #  arguments for instantiation!)
-            # todo: enter here whatever is needed for your controller initialization and eventual
-            #  opening of the communication channel
-
-        info = "Whatever info you want to log"
-        initialized = self.controller.init_hardware()  # todo
+            options = dict(baudrate=self.settings['baudrate']) if 'rtu' in self.settings['transport'] else {}
+            driver = RemoteDriver if self.settings['out_of_process'] else CellKraftE1500Drivers
+            self.controller = driver(self.settings['host'], port=self.settings['port'],
+                                     pipeline_window=self.settings['pipeline_window'],
+                                     transport=self.settings['transport'], model=DEVICES[self.settings['device']],
+                                     heartbeat_interval=self.settings['heartbeat'],
+                                     calibration=self.load_calibration(), **options)
+            self.controller.init_hardware()
+
+        info = f"{self.settings['device']} on {self.settings['host']}"
+        initialized = self.controller.init
         return info, initialized
 
+    @traced()
     def move_abs(self, value: DataActuator):
         """ Move the actuator to the absolute target defined by value
 
@@ -145,11 +240,11 @@ class DAQ_Move_CellkraftE1500(DAQ_Move_base):
         value = self.check_bound(value)  #if user checked bounds, the defined bounds are applied here
         self.target_value = value
         value = self.set_position_with_scaling(value)  # apply scaling if the user specified one
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_set_an_absolute_value(value.value())  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        self.reset_predictor(value.value())
+        if self.controller.set_setpoint(self.register_name, value.value()):
+            self.emit_status(ThreadCommand('Update_Status', [f'{self.axis_name} setpoint: {value.value()}']))
 
+    @traced()
     def move_rel(self, value: DataActuator):
         """ Move the actuator to the relative target actuator value defined by value
 
@@ -161,26 +256,29 @@ class DAQ_Move_CellkraftE1500(DAQ_Move_base):
         self.target_value = value + self.current_position
         value = self.set_position_relative_with_scaling(value)
 
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_set_a_relative_value(value.value())  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        setpoint = self.controller.get_setpoint(self.register_name)
+        if setpoint is None:
+            setpoint = self.current_position.value()
+        self.reset_predictor(setpoint + value.value())
+        if self.controller.set_setpoint(self.register_name, setpoint + value.value()):
+            self.emit_status(ThreadCommand('Update_Status', [f'{self.axis_name} setpoint: {setpoint + value.value()}']))
 
-    def move_home(self):
-        """Call the reference method of the controller"""
+    def reset_predictor(self, target: float):
+        """Restart the settling prediction on the channel of the current axis"""
+        self.predictor.reset(target)
+        for channel in [channel for channel, predictor in self.controller.settling.items() if predictor is self.predictor]:
+            self.controller.settling.pop(channel)
+        self.controller.watch_settling(AXES[self.axis_name][1].__name__, self.predictor)
 
-        ## TODO for your custom plugin
-        raise NotImplemented  # when writing your own plugin remove this line
-        self.controller.your_method_to_get_to_a_known_reference()  # when writing your own plugin replace this line
-        self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+    def move_home(self):
+        """No reference position on a steam generator: only reports the current value"""
+        self.emit_status(ThreadCommand('Update_Status', ['No home position for a Cellkraft generator']))
+        self.move_done()
 
     def stop_motion(self):
-      """Stop the actuator and emits move_done signal"""
-
-      ## TODO for your custom plugin
-      raise NotImplemented  # when writing your own plugin remove this line
-      self.controller.your_method_to_stop_positioning()  # when writing your own plugin replace this line
-      self.emit_status(ThreadCommand('Update_Status', ['Some info you want to log']))
+        """Stop the polling, the generator keeps its current setpoints (use the driver stop to turn the flow down)"""
+        self.move_done()
+        self.emit_status(ThreadCommand('Update_Status', ['Polling stopped, setpoints unchanged']))
 
 
 if __name__ == '__main__':
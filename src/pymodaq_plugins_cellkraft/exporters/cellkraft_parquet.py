@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Parquet exporter of Cellkraft time series, only registered if pyarrow is installed (see cellkraft_tables)
+"""
+import pyarrow  # noqa: F401, not registered by pymodaq without it
+
+from pymodaq.utils.h5modules.backends import Node
+from pymodaq.utils.h5modules.exporter import ExporterFactory, H5Exporter
+
+from pymodaq_plugins_cellkraft.exporters.cellkraft_tables import TimeSeries, export_series
+
+
+@ExporterFactory.register_exporter()
+class CellkraftParquetExporter(H5Exporter):
+    """Exporter of the 0D time series of a node as a Parquet table, one row group per chunk"""
+
+    FORMAT_DESCRIPTION = "Time series table (Parquet)"
+    FORMAT_EXTENSION = "parquet"
+
+    def export_data(self, node: Node, filename: str) -> None:
+        export_series(TimeSeries.from_h5(node), filename)
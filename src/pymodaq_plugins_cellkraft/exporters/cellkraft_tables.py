@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked export of Cellkraft time series (PyMoDAQ h5 files saved by the DAQ_Logger or a continuous saving, raw
+register logs) to CSV or Parquet, for pandas and spreadsheet tools
+
+Datasets are read, filtered and written chunk by chunk, so the memory used does not depend on the file size:
+
+    cellkraft-export scan.h5 scan.parquet --node /RawData/Cellkraft --channels Steam Air --start 2024-05-01T08:00
+    cellkraft-export gen01_20240501-080000.ckr gen01.csv.gz
+
+The format is given by the extension of the output: .csv, .csv.gz (chunks compressed in parallel, as gzip members)
+or .parquet (one row group per chunk, needs pyarrow).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import datetime
+import gzip
+import io
+import os
+
+import numpy as np
+
+from pymodaq.utils.h5modules.backends import Node
+from pymodaq.utils.h5modules.exporter import ExporterFactory, H5Exporter
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogReader
+
+CHUNK_ROWS = 65536
+
+
+class TimeSeries:
+    """Columns of a dataset and an iterator over its chunks
+
+    :param columns: names of the value columns
+    :param chunks: function returning an iterator of (times, values) ndarrays of shape (n,) and (n, columns)
+    """
+    def __init__(self, columns, chunks):
+        self.columns = list(columns)
+        self.chunks = chunks
+
+    @classmethod
+    def from_rawlog(cls, path):
+        """Time series of a raw register log, in physical units (see RawLogReader)"""
+        reader = RawLogReader(path)
+        return cls(reader.channels, reader.iter_blocks)
+
+    @classmethod
+    def from_h5(cls, node: Node, chunk_rows: int = CHUNK_ROWS):
+        """Time series of the 0D enlargeable data below a node of a PyMoDAQ h5 file, against its time axis
+
+        The columns are named after the labels of the data, the times being those of the nearest "time" navigation
+        axis (the row indexes if there is none).
+        """
+        arrays = _data_arrays(node)
+        if not arrays:
+            raise ValueError(f'no 0D enlargeable data below {node.path}')
+        labels = [_attribute(array, 'label') or array.name for array in arrays]
+        columns = [label if labels.count(label) == 1 else f'{array.parent_node.name}/{label}'
+                   for label, array in zip(labels, arrays)]
+        time_axis = _time_axis(node)
+        rows = min(len(array) for array in arrays)
+
+        def chunks():
+            for start in range(0, rows, chunk_rows):
+                stop = min(start + chunk_rows, rows)
+                times = time_axis[start:stop] if time_axis is not None else np.arange(start, stop, dtype=float)
+                yield times, np.column_stack([np.reshape(array[start:stop], (stop - start, -1))[:, 0]
+                                              for array in arrays])
+        return cls(columns, chunks)
+
+    def select(self, channels=None, start: float = None, stop: float = None):
+        """Iterator over the chunks restricted to some channels (all if None) and times in [start, stop]"""
+        indexes = list(range(len(self.columns))) if channels is None else [self.columns.index(channel)
+                                                                             for channel in channels]
+        for times, values in self.chunks():
+            if len(times) == 0 or (start is not None and times[-1] < start) or (stop is not None and
+                                                                                  times[0] > stop):
+                continue
+            mask = np.ones(len(times), dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if stop is not None:
+                mask &= times <= stop
+            yield times[mask], values[mask][:, indexes]
+
+
+def _attribute(node: Node, name: str):
+    return node.attrs[name] if name in node.attrs.attrs_name else None
+
+
+def _data_arrays(node: Node) -> list:
+    if 'ARRAY' in node.attrs['CLASS']:
+        return [node] if _attribute(node, 'data_type') == 'data_enlargeable' and \
+                         _attribute(node, 'data_dimension') == 'Data0D' else []
+    return [array for child in node.children().values() for array in _data_arrays(child)]
+
+
+def _time_axis(node: Node):
+    """The "time" navigation axis of the node or of its nearest ancestor having one, None if there is none"""
+    while node is not None:
+        if 'GROUP' in node.attrs['CLASS'] and 'NavAxes' in node.children():
+            for axis in node.children()['NavAxes'].children().values():
+                if _attribute(axis, 'label') == 'time':
+                    return axis
+        node = node.parent_node
+    return None
+
+
+def _csv_text(times: np.ndarray, values: np.ndarray) -> bytes:
+    text = io.StringIO()
+    np.savetxt(text, np.column_stack((times, values)), fmt=['%.3f'] + ['%.6g'] * values.shape[1], delimiter=',')
+    return text.getvalue().encode()
+
+
+def _gzip_text(times: np.ndarray, values: np.ndarray) -> bytes:
+    return gzip.compress(_csv_text(times, values), compresslevel=6)
+
+
+def export_series(series: TimeSeries, filename, channels=None, start: float = None, stop: float = None,
+                  workers: int = None) -> int:
+    """Write a time series to a .csv, .csv.gz or .parquet file, chunk by chunk
+
+    The CSV chunks are formatted and compressed by a pool of threads (zlib releasing the GIL), at most twice as many
+    chunks as threads being in memory at once; the Parquet compression is done by pyarrow.
+
+    :param series: TimeSeries to export
+    :param filename: output file, its extension giving the format
+    :param channels: columns exported, all if None
+    :param start: first time exported (s since the epoch, or row index if there is no time axis)
+    :param stop: last time exported
+    :param workers: threads formatting and compressing the CSV chunks, os.cpu_count() if None
+    :return: number of rows written
+    """
+    filename = Path(filename)
+    columns = ['timestamp'] + (series.columns if channels is None else list(channels))
+    chunks = series.select(channels, start, stop)
+    rows = 0
+    if filename.suffix == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(column, pa.float64()) for column in columns])
+        with pq.ParquetWriter(filename, schema, compression='zstd') as writer:
+            for times, values in chunks:
+                writer.write_table(pa.Table.from_arrays([pa.array(times)] + [pa.array(column)
+                                                                               for column in values.T],
+                                                        schema=schema))
+                rows += len(times)
+        return rows
+    if filename.suffixes[-2:] == ['.csv', '.gz']:
+        encode, header = _gzip_text, gzip.compress((','.join(columns) + '\n').encode())
+    elif filename.suffix == '.csv':
+        encode, header = _csv_text, (','.join(columns) + '\n').encode()
+    else:
+        raise ValueError(f'unknown export format {filename.name}, use .csv, .csv.gz or .parquet')
+    workers = workers or os.cpu_count() or 1
+    with open(filename, 'wb') as file, ThreadPoolExecutor(workers) as pool:
+        file.write(header)
+        pending = []
+        for times, values in chunks:
+            pending.append(pool.submit(encode, times, values))
+            rows += len(times)
+            if len(pending) >= 2 * workers:
+                file.write(pending.pop(0).result())
+        for future in pending:
+            file.write(future.result())
+    return rows
+
+
+@ExporterFactory.register_exporter()
+class CellkraftCsvExporter(H5Exporter):
+    """Exporter of the 0D time series of a node as a single CSV table, written chunk by chunk"""
+
+    FORMAT_DESCRIPTION = "Time series table (chunked)"
+    FORMAT_EXTENSION = "csv"
+
+    def export_data(self, node: Node, filename: str) -> None:
+        export_series(TimeSeries.from_h5(node), filename)
+
+
+def parse_time(text: str):
+    """Seconds since the epoch from a number or an ISO 8601 date-time (local time if naive), None if text is None"""
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def main(args=None):
+    import argparse
+    import logging
+    from pymodaq.utils.h5modules.backends import H5Backend
+
+    parser = argparse.ArgumentParser(description='Export Cellkraft time series (PyMoDAQ h5 file or raw register '
+                                                 'log) to CSV or Parquet, chunk by chunk')
+    parser.add_argument('source', help='.h5 or .ckr file')
+    parser.add_argument('destination', help='.csv, .csv.gz or .parquet file')
+    parser.add_argument('--node', default='/RawData', help='h5 node holding the time series')
+    parser.add_argument('--channels', nargs='+', help='columns exported, all by default')
+    parser.add_argument('--start', help='first time exported, ISO date-time or seconds since the epoch')
+    parser.add_argument('--stop', help='last time exported, ISO date-time or seconds since the epoch')
+    parser.add_argument('--chunk', type=int, default=CHUNK_ROWS, help='rows per chunk (h5 files)')
+    parser.add_argument('--workers', type=int, help='compression threads, all the cores by default')
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    options = dict(channels=args.channels, start=parse_time(args.start), stop=parse_time(args.stop),
+                   workers=args.workers)
+    if Path(args.source).suffix == '.h5':
+        h5file = H5Backend('tables')
+        h5file.open_file(args.source, 'r')
+        try:
+            rows = export_series(TimeSeries.from_h5(h5file.get_node(args.node), args.chunk), args.destination,
+                                 **options)
+        finally:
+            h5file.close_file()
+    else:
+        rows = export_series(TimeSeries.from_rawlog(args.source), args.destination, **options)
+    logger.info(f'{rows} rows written to {args.destination}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Dashboard extension monitoring a Cellkraft E-series steam generator: live plots of the process values, setpoint
+controls and connection statistics
+"""
+from qtpy import QtCore
+import pyqtgraph as pg
+
+from pymodaq.utils import gui_utils as gutils
+from pymodaq.utils.config import ConfigError
+from pymodaq.utils.logger import set_logger, get_module_name
+
+from pymodaq_plugins_cellkraft.utils import Config as PluginConfig
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, DEVICES, get_validators
+from pymodaq_plugins_cellkraft.hardware.cellkraft.stream import minmax_decimate
+from pymodaq_plugins_cellkraft.hardware.cellkraft.validators import ModeValidator
+
+logger = set_logger(get_module_name(__file__))
+
+plugin_config = PluginConfig()
+
+EXTENSION_NAME = 'Cellkraft monitor'  # the name that will be displayed in the extension list in the dashboard
+CLASS_NAME = 'CellkraftMonitor'
+
+# plot title: channels of the snapshots drawn in it
+PLOTS = {'Temperatures (°C)': ('Steam', 'Tube', 'DewPoint'),
+         'Relative humidity (%)': ('Air',),
+         'Absolute humidity (g/m3)': ('AbsHumidity',),
+         'Flow (g/min), pump (%)': ('Flow', 'Pump'),
+         'Water dosed (g)': ('Water',),
+         'Pressure (bar)': ('Pressure',),
+         }
+COLORS = ('#e6550d', '#3182bd', '#31a354')
+
+
+def setpoint_params(model: int = 1500) -> list:
+    """Parameters of the setpoints of a model, bounded by their validators"""
+    params = []
+    for name, validator in get_validators(model).items():
+        if isinstance(validator, ModeValidator):
+            params.append({'title': f'{name}:', 'name': name, 'type': 'list',
+                           'limits': [mode for mode in validator.table if isinstance(mode, str)], 'value': 'auto'})
+        else:
+            params.append({'title': f'{name}:', 'name': name, 'type': 'int', 'value': validator.minimum,
+                           'min': validator.minimum, 'max': validator.maximum, 'step': validator.step})
+    return params
+
+
+class CellkraftMonitor(gutils.CustomApp):
+    """Live view of a Cellkraft generator, for days long monitoring
+
+    The generator is polled by the SnapshotStream of the driver (the one of a Cellkraft actuator of the dashboard if
+    any, so that its requests are shared, else a driver created from the Connection settings), the plots being
+    redrawn from its history by a timer: the rendering cost is set by the refresh period and the number of points
+    per curve (min/max decimation), not by the poll rate, and the memory by the history capacity. The dew point,
+    absolute humidity and water dosed are the derived channels computed by the stream on each snapshot.
+    """
+    params = [
+        {'title': 'Connection:', 'name': 'connection', 'type': 'group', 'children': [
+            {'title': 'Device:', 'name': 'device', 'type': 'list', 'limits': list(DEVICES.keys()),
+             'value': 'Cellkraft E1500 Series'},
+            {'title': 'Host:', 'name': 'host', 'type': 'str', 'value': 'cet-cc01-gen01.insa-lyon.fr',
+             'tip': 'used if no Cellkraft actuator of the dashboard is initialized'},
+            {'title': 'Port:', 'name': 'port', 'type': 'int', 'value': 502},
+            {'title': 'Poll interval (s):', 'name': 'poll_interval', 'type': 'float', 'value': 1., 'min': 0.05},
+            {'title': 'History (snapshots):', 'name': 'capacity', 'type': 'int', 'value': 100_000, 'min': 1000,
+             'tip': 'snapshots kept in memory, applied when connecting'},
+        ]},
+        {'title': 'Display:', 'name': 'display', 'type': 'group', 'children': [
+            {'title': 'Time span (min):', 'name': 'span', 'type': 'float', 'value': 60., 'min': 0.1},
+            {'title': 'Refresh period (ms):', 'name': 'refresh', 'type': 'int', 'value': 1000, 'min': 100},
+            {'title': 'Points per curve:', 'name': 'points', 'type': 'int', 'value': 1000, 'min': 100,
+             'tip': 'curves are decimated keeping the min and max of each bin'},
+        ]},
+        {'title': 'Setpoints:', 'name': 'setpoints', 'type': 'group', 'children': setpoint_params() + [
+            {'title': 'Apply:', 'name': 'apply', 'type': 'action'},
+        ]},
+        {'title': 'Statistics:', 'name': 'stats', 'type': 'group', 'children': [
+            {'title': 'Connected:', 'name': 'connected', 'type': 'led', 'value': False, 'readonly': True},
+            {'title': 'Poll rate (Hz):', 'name': 'poll_rate', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Failed snapshots:', 'name': 'failures', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Requests:', 'name': 'requests', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Errors:', 'name': 'errors', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Timeouts:', 'name': 'timeouts', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Reconnects:', 'name': 'reconnects', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Latency p99 (ms):', 'name': 'p99', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Reset water dosed:', 'name': 'reset_water', 'type': 'action'},
+        ]},
+    ]
+
+    def __init__(self, parent: gutils.DockArea, dashboard):
+        super().__init__(parent, dashboard)
+        self.driver: CellKraftE1500Drivers = None
+        self.own_driver = False
+        self.own_stream = False
+        self.curves = {}
+        self.pending = []  # (register name, Future) of the setpoint writes sent
+        self.edited = set()  # names of the setpoints changed by the user since the last Apply
+        self._rendered = -1  # history count at the last redraw
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(self.settings['display', 'refresh'])
+        self.setup_ui()
+
+    def setup_docks(self):
+        self.docks['plots'] = gutils.Dock('Process values')
+        self.dockarea.addDock(self.docks['plots'])
+        self.docks['settings'] = gutils.Dock('Settings')
+        self.dockarea.addDock(self.docks['settings'], 'left', self.docks['plots'])
+        self.docks['settings'].addWidget(self.settings_tree)
+
+        layout = pg.GraphicsLayoutWidget()
+        self.docks['plots'].addWidget(layout)
+        first = None
+        for row, (title, channels) in enumerate(PLOTS.items()):
+            plot = layout.addPlot(row=row, col=0, title=title, axisItems={'bottom': pg.DateAxisItem()})
+            plot.addLegend(offset=(5, 5))
+            plot.showGrid(x=True, y=True, alpha=0.3)
+            if first is None:
+                first = plot
+            else:
+                plot.setXLink(first)
+            for channel, color in zip(channels, COLORS):
+                self.curves[channel] = plot.plot(pen=pg.mkPen(color), name=channel)
+
+    def setup_actions(self):
+        self.add_action('connect', 'Connect', 'ini', 'Connect to the generator and start polling', checkable=True)
+        self.add_action('quit', 'Quit', 'close2', 'Stop polling and close the monitor')
+
+    def connect_things(self):
+        self.connect_action('connect', self.connect_generator)
+        self.connect_action('quit', self.quit)
+        self.settings.child('setpoints', 'apply').sigActivated.connect(self.apply_setpoints)
+        self.settings.child('stats', 'reset_water').sigActivated.connect(self.reset_water)
+        self.timer.timeout.connect(self.refresh)
+
+    def value_changed(self, param):
+        if param.name() == 'refresh':
+            self.timer.setInterval(param.value())
+        elif param.name() == 'poll_interval' and self.driver is not None and self.driver.stream is not None:
+            self.driver.stream.interval = param.value()
+        elif param.name() in ('span', 'points'):
+            self._rendered = -1
+        elif param.parent() is self.settings.child('setpoints'):
+            self.edited.add(param.name())
+
+    def shared_driver(self):
+        """Driver of an initialized Cellkraft actuator of the dashboard, None if there is none"""
+        if self.modules_manager is None:
+            return None
+        for actuator in self.modules_manager.actuators:
+            if isinstance(getattr(actuator, 'controller', None), CellKraftE1500Drivers):
+                return actuator.controller
+        return None
+
+    def connect_generator(self, connect: bool = True):
+        if not connect:
+            self.disconnect_generator()
+            return
+        self.driver = self.shared_driver()
+        self.own_driver = self.driver is None
+        if self.own_driver:
+            self.driver = CellKraftE1500Drivers(self.settings['connection', 'host'],
+                                                port=self.settings['connection', 'port'],
+                                                model=DEVICES[self.settings['connection', 'device']])
+            self.driver.init_hardware()
+            if not self.driver.init:
+                logger.warning(f"cannot connect to {self.settings['connection', 'host']}")
+        self.own_stream = self.driver.stream is None
+        self.driver.start_stream(self.settings['connection', 'poll_interval'],
+                                 capacity=self.settings['connection', 'capacity'])
+        self.fill_setpoints()
+        self._rendered = -1
+        self.timer.start()
+
+    def disconnect_generator(self):
+        self.timer.stop()
+        if self.driver is not None and self.own_driver:
+            self.driver.close()
+        elif self.driver is not None and self.own_stream:
+            self.driver.stop_stream()
+        self.driver = None
+
+    def fill_setpoints(self):
+        """Show the setpoints last written by the driver (by an actuator sharing it), the others keep their value"""
+        validators = get_validators(self.driver.model)
+        for name, validator in validators.items():
+            value = self.driver.get_setpoint(name)
+            if value is None:
+                continue
+            if isinstance(validator, ModeValidator):
+                value = next((mode for mode, raw in validator.table.items()
+                              if isinstance(mode, str) and raw == value * validator.scaling), None)
+                if value is None:
+                    continue
+            self.settings.child('setpoints', name).setValue(value)
+            self.edited.discard(name)
+
+    def apply_setpoints(self):
+        """Send the setpoints changed by the user through the stream, leaving the others to their running value"""
+        if self.driver is None or self.driver.stream is None:
+            return
+        for name in sorted(self.edited):
+            self.pending.append((name, self.driver.stream.submit(self.driver.set_setpoint, name,
+                                                                 self.settings['setpoints', name])))
+        self.edited.clear()
+
+    def reset_water(self):
+        """Restart the integral of the water dosed, in the poller thread"""
+        if self.driver is not None and self.driver.stream is not None:
+            self.driver.stream.submit(self.driver.stream.derived.reset)
+
+    def quit(self):
+        self.disconnect_generator()
+        if self.mainwindow is not None:
+            self.mainwindow.close()
+
+    def refresh(self):
+        """Redraw the curves and the statistics, skipped while the window is minimized or nothing changed"""
+        if self.driver is None or self.driver.stream is None:
+            return
+        for name, future in [item for item in self.pending if item[1].done()]:
+            self.pending.remove((name, future))
+            if future.exception() is not None:
+                logger.warning(f'setpoint {name} not written: {future.exception()}')
+        if self.mainwindow is not None and self.mainwindow.isMinimized():
+            return
+        self.update_stats()
+        history = self.driver.stream.history
+        if history.count == self._rendered:
+            return
+        self._rendered = history.count
+        times, values = history.latest(self.settings['display', 'span'] * 60)
+        bins = self.settings['display', 'points'] // 2
+        for index, channel in enumerate(history.channels):
+            if channel in self.curves:
+                self.curves[channel].setData(*minmax_decimate(times, values[:, index], bins))
+
+    def update_stats(self):
+        stats = self.driver.get_stats()
+        totals = stats['function_codes'].values()
+        latencies = [entry['latency_ms']['p99'] for entry in totals if entry['calls']]
+        values = dict(connected=bool(self.driver.instr.connected), poll_rate=self.driver.poll_rate,
+                      failures=self.driver.stream.failures, requests=sum(entry['calls'] for entry in totals),
+                      errors=sum(entry['errors'] for entry in totals),
+                      timeouts=sum(entry['timeouts'] for entry in totals), reconnects=stats['reconnects'],
+                      p99=max(latencies, default=0.))
+        for name, value in values.items():
+            self.settings.child('stats', name).setValue(value)
+
+
+def main():
+    from pymodaq.utils.gui_utils.utils import mkQApp
+    from pymodaq.utils.gui_utils.loader_utils import load_dashboard_with_preset
+    from pymodaq.utils.messenger import messagebox
+
+    app = mkQApp(EXTENSION_NAME)
+    try:
+        preset_file_name = plugin_config('presets', f'preset_for_{CLASS_NAME.lower()}')
+        load_dashboard_with_preset(preset_file_name, EXTENSION_NAME)
+        app.exec()
+
+    except ConfigError as e:
+        messagebox(f'No entry with name f"preset_for_{CLASS_NAME.lower()}" has been configured'
+                   f'in the plugin config file. The toml entry should be:\n'
+                   f'[presets]'
+                   f"preset_for_{CLASS_NAME.lower()} = {'a name for an existing preset'}"
+                   )
+
+
+if __name__ == '__main__':
+    main()
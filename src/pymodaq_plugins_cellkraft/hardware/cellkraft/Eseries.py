@@ -1,8 +1,21 @@
-from pymodaq.utils.logger import set_logger, get_module_name
-logger = set_logger(get_module_name(__file__))
+from pathlib import Path
 
-from pymodaq_plugins_cellkraft.hardware.tcpmodbus import SyncModBusInstrument
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+import time
+from collections import deque
 from enum import IntEnum
+from functools import lru_cache
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft.hardware.tcpmodbus import SyncModBusInstrument
+from pymodaq_plugins_cellkraft.hardware.transports import READ_INPUT_REGISTERS, WRITE_REGISTER, WRITE_REGISTERS
+from pymodaq_plugins_cellkraft.hardware.tracing import traced
+from pymodaq_plugins_cellkraft.hardware.cellkraft.calibration import Calibration
+from pymodaq_plugins_cellkraft.hardware.cellkraft.settling import SettlingPredictor
+from pymodaq_plugins_cellkraft.hardware.cellkraft.validators import compile_validator
     # WRITE
     #
     # pump control : register 9107 value [0 auto 1 manual 2 prime] default 1
@@ -113,6 +126,66 @@ Eseries_Config = {
             }
         }
 
+# device name (Device setting of the plugins): model key in Eseries_Config
+DEVICES = {f"Cellkraft E{model} Series": model for model in Eseries_Config}
+
+# setpoint register name in CellKraftE1500Drivers.registers: (channel, write scaling)
+SETPOINTS = {"PumpSetMode": (Pump, 1),
+             "SP_SteamT": (Steam, 1),
+             "RH": (Air, Air.scaling),
+             "SP_Flow": (Flow, Flow.scaling),
+             "SP_Tube_Temp": (Tube, 1),
+             }
+
+
+def compile_validators(config: dict, model: int = 1500):
+    """Validators of the setpoint registers of a model from the authorized values in config
+
+    Ranges and evenly spaced lists become interval checks on precomputed raw bounds, channels holding a mode (whose
+    enum has mode_xxx members, such as Pump) a lookup table accepting the mode names as well.
+
+    :param config: configuration dict such as Eseries_Config
+    :param model: model key in config
+    :return: dict {register name: IntervalValidator or ModeValidator}
+    """
+    validators = {}
+    for name, (reference, scaling) in SETPOINTS.items():
+        channel = config[model][reference.__name__]
+        modes = {member[len("mode_"):]: value.value for member, value in reference.__members__.items()
+                 if member.startswith("mode_")}
+        validators[name] = compile_validator(name, channel["authorized_write_value"], scaling, names=modes or None,
+                                             default=reference.default_mode.value if modes else None)
+    return validators
+
+
+@lru_cache(maxsize=None)
+def get_validators(model: int = 1500):
+    """Validators of the setpoint registers of a model of Eseries_Config, compiled once per model"""
+    return compile_validators(Eseries_Config, model)
+
+
+# channels returned by CellKraftE1500Drivers.get_snapshot, in this order
+SNAPSHOT_CHANNELS = (Steam, Air, Flow, Pressure, Tube, Pump)
+
+# max number of registers in a single write_registers request (Modbus spec)
+MAX_WRITE_REGISTERS = 123
+
+
+def contiguous_blocks(orders: dict):
+    """Group register writes into runs of consecutive addresses
+
+    :param orders: {address: raw value}
+    :return: list of (first address, [raw values]) sorted by address
+    """
+    blocks = []
+    for address in sorted(orders):
+        if blocks and address == blocks[-1][0] + len(blocks[-1][1]) and len(blocks[-1][1]) < MAX_WRITE_REGISTERS:
+            blocks[-1][1].append(orders[address])
+        else:
+            blocks.append((address, [orders[address]]))
+    return blocks
+
+
 def registerfactory(reference, mode):
     """This will create all the function from dict[ref]
 
@@ -132,22 +205,47 @@ class CellKraftE1500Drivers:
     Relies on a custom tcpmodules based on pymodbus (source : https://github.com/pymodbus-dev/pymodbus
     documentation : https://pymodbus.readthedocs.io/en/latest/)
     """
-    def __init__(self, host, config = None):
+    def __init__(self, host, config = None, port: int = 502, pipeline_window: int = 1, transport: str = 'tcp',
+                 model: int = 1500, heartbeat_interval: float = 0., calibration: Calibration = None,
+                 **transport_options):
         """Initialize the Steam Generator driver
 
-        :param host: hostname or ip adress
+        :param host: hostname or ip adress (serial device for the 'rtu' transport)
+        :param config: configuration dict, Eseries_Config if None
+        :param model: model key in the configuration (see DEVICES)
+        :param port: Modbus TCP port
+        :param pipeline_window: max number of requests in flight in the snapshots and write_setpoints (1: serial)
+        :param transport: 'tcp', 'rtu' or 'rtu_over_tcp', see SyncModBusInstrument
+        :param heartbeat_interval: idle seconds before the steam temperature is read to keep the connection alive,
+         0 to disable (see SyncModBusInstrument)
+        :param calibration: corrections of the readbacks, see set_calibration
+        :param transport_options: keyword arguments of the transport (unit, timeout, baudrate, parity...)
         """
-        self.instr = SyncModBusInstrument(host)
+        self.instr = SyncModBusInstrument(host, port=port, pipeline_window=pipeline_window, transport=transport,
+                                          heartbeat_interval=heartbeat_interval,
+                                          heartbeat_register=Steam.read_address.value, **transport_options)
         self.host = host
         self.registers = {}
         self.init = False
+        self.last_written = {}  # {address: raw value} of the last successful writes, used for write suppression
+        self.settling = {}  # {channel name: SettlingPredictor} fed with every readback of the channel
+        self.suppressed_writes = 0  # set_setpoint calls not sent as the register already held the value
+        self.last_values = {}  # {channel name: (timestamp, value)} of the latest readbacks
+        self.last_raw_snapshot = None  # (timestamp, read_raw_snapshot ndarray) of the latest snapshot, undecoded
+        self.snapshot_times = deque(maxlen=20)  # timestamps of the latest snapshots, for the poll rate
+        self.metrics_server = None
+        self.stream = None
 
         if config is None:
             self.config = Eseries_Config
         else:
             self.config = config
+        self.model = model
+        self.validators = get_validators(model) if self.config is Eseries_Config else \
+            compile_validators(self.config, model)
 
         self.ini_register(self.config)
+        self.set_calibration(calibration)
 
     def ini_register(self, config_dict=None):
         """
@@ -163,72 +261,94 @@ class CellKraftE1500Drivers:
 
         self.registers["PumpSetMode"] = {
             "method": self.PumpSetMode,
-            "reference": config_dict[1500]["Pump"]["reference"],
-            "register": config_dict[1500]["Pump"]["reference"].write_address.value,
+            "reference": config_dict[self.model]["Pump"]["reference"],
+            "register": config_dict[self.model]["Pump"]["reference"].write_address.value,
             "mode": "write"
         }
         self.registers["SP_SteamT"] = {
             "method": self.SP_SteamT,
-            "reference": config_dict[1500]["Steam"]["reference"],
-            "register": config_dict[1500]["Steam"]["reference"].write_address.value,
+            "reference": config_dict[self.model]["Steam"]["reference"],
+            "register": config_dict[self.model]["Steam"]["reference"].write_address.value,
             "mode": "write"
         }
         self.registers["RH"] = {
             "method": self.RH,
-            "reference": config_dict[1500]["Air"]["reference"],
-            "register": config_dict[1500]["Air"]["reference"].write_address.value,
+            "reference": config_dict[self.model]["Air"]["reference"],
+            "register": config_dict[self.model]["Air"]["reference"].write_address.value,
             "mode": "write",
-            "scaling": config_dict[1500]["Air"]["reference"].scaling.value
+            "scaling": config_dict[self.model]["Air"]["reference"].scaling.value
         }
         self.registers["SP_Flow"] = {
             "method": self.SP_Flow,
-            "reference": config_dict[1500]["Flow"]["reference"],
-            "register": config_dict[1500]["Flow"]["reference"].write_address.value,
+            "reference": config_dict[self.model]["Flow"]["reference"],
+            "register": config_dict[self.model]["Flow"]["reference"].write_address.value,
             "mode": "write",
-            "scaling": config_dict[1500]["Flow"]["reference"].scaling.value
+            "scaling": config_dict[self.model]["Flow"]["reference"].scaling.value
         }
         self.registers["SP_Tube_Temp"] = {
             "method": self.SP_Tube_Temp,
-            "reference": config_dict[1500]["Tube"]["reference"],
-            "register": config_dict[1500]["Tube"]["reference"].write_address.value,
+            "reference": config_dict[self.model]["Tube"]["reference"],
+            "register": config_dict[self.model]["Tube"]["reference"].write_address.value,
             "mode": "write"
         }
         self.registers["Get_Steam_T"] = {
             "method": self.Get_Steam_T,
-            "reference": config_dict[1500]["Steam"]["reference"],
-            "register": config_dict[1500]["Steam"]["reference"].read_address.value,
+            "reference": config_dict[self.model]["Steam"]["reference"],
+            "register": config_dict[self.model]["Steam"]["reference"].read_address.value,
             "mode": "read",
-            "scaling": config_dict[1500]["Steam"]["reference"].read_scaling.value
+            "scaling": config_dict[self.model]["Steam"]["reference"].read_scaling.value
         }
         self.registers["Get_Air_H"] = {
             "method": self.Get_Air_H,
-            "reference": config_dict[1500]["Air"]["reference"],
-            "register": config_dict[1500]["Air"]["reference"].read_address.value,
+            "reference": config_dict[self.model]["Air"]["reference"],
+            "register": config_dict[self.model]["Air"]["reference"].read_address.value,
             "mode": "read",
-            "scaling": config_dict[1500]["Air"]["reference"].read_scaling.value
+            "scaling": config_dict[self.model]["Air"]["reference"].read_scaling.value
         }
         self.registers["Get_Flow"] = {
             "method": self.Get_Flow,
-            "reference": config_dict[1500]["Flow"]["reference"],
-            "register": config_dict[1500]["Flow"]["reference"].read_scaling.value,
+            "reference": config_dict[self.model]["Flow"]["reference"],
+            "register": config_dict[self.model]["Flow"]["reference"].read_address.value,
             "mode": "read",
-            "scaling": config_dict[1500]["Flow"]["reference"].read_scaling.value
+            "scaling": config_dict[self.model]["Flow"]["reference"].read_scaling.value
         }
         self.registers["Get_Pressure"] = {
             "method": self.Get_Pressure,
-            "reference": config_dict[1500]["Pressure"]["reference"],
-            "register": config_dict[1500]["Pressure"]["reference"].read_scaling.value,
+            "reference": config_dict[self.model]["Pressure"]["reference"],
+            "register": config_dict[self.model]["Pressure"]["reference"].read_address.value,
             "mode": "read",
-            "scaling": config_dict[1500]["Pressure"]["reference"].read_scaling.value
+            "scaling": config_dict[self.model]["Pressure"]["reference"].read_scaling.value
         }
         self.registers["Get_Tube_T"] = {
             "method": self.Get_Tube_T,
-            "reference": config_dict[1500]["Tube"]["reference"],
-            "register": config_dict[1500]["Tube"]["reference"].read_scaling.value,
+            "reference": config_dict[self.model]["Tube"]["reference"],
+            "register": config_dict[self.model]["Tube"]["reference"].read_address.value,
             "mode": "read",
-            "scaling": config_dict[1500]["Tube"]["reference"].read_scaling.value
+            "scaling": config_dict[self.model]["Tube"]["reference"].read_scaling.value
         }
 
+        self.snapshot_channels = SNAPSHOT_CHANNELS
+        self.read_scalings = np.array([getattr(ref, "read_scaling", 1) for ref in self.snapshot_channels],
+                                      dtype=float)
+        self.instr.stats.register_names = self.register_names()
+
+    def set_calibration(self, calibration: Calibration = None):
+        """Correct the readbacks (snapshots and read_channel) with a Calibration, None to remove it
+
+        The calibration is compiled into a lookup table of the corrected value of every raw register value, so that
+        decoding a snapshot stays a single NumPy operation.
+        """
+        self.calibration = calibration
+        self.read_lut = None if calibration is None else calibration.compile(
+            [reference.__name__ for reference in self.snapshot_channels], self.read_scalings)
+        self._lut_columns = np.arange(len(self.snapshot_channels))
+
+    def register_names(self):
+        """{address: name} of the registers, the setpoints by their register name and the readbacks by channel"""
+        names = {entry["register"]: name for name, entry in self.registers.items() if entry["mode"] == "write"}
+        names.update({reference.read_address.value: reference.__name__ for reference in self.snapshot_channels})
+        return names
+
     def init_hardware(self):
         """Connect and initialize the Steam Generator
 
@@ -236,19 +356,242 @@ class CellKraftE1500Drivers:
         self.init = self.instr.ini_hw()
 
     def stop(self):
-        """Stop procedure
+        """Stop procedure: flow setpoint to 0, always sent (and recorded for the write suppression of set_setpoint)
 
         :return:
         """
-        self.SP_Flow(0)
+        self.set_setpoint("SP_Flow", 0, force=True)
 
     def close(self):
         """Close connection
 
         :return:
         """
+        self.stop_stream()
+        self.stop_metrics_server()
         self.instr.close()
 
+    @property
+    def poll_rate(self) -> float:
+        """Rate of the latest get_snapshot calls in Hz (0 if less than two)"""
+        times = list(self.snapshot_times)
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def start_metrics_server(self, port: int = 9464, host: str = "127.0.0.1"):
+        """Serve the statistics and latest values in the Prometheus text format (see MetricsServer)
+
+        :return: the MetricsServer
+        """
+        from pymodaq_plugins_cellkraft.hardware.metrics import MetricsServer
+        self.stop_metrics_server()
+        self.metrics_server = MetricsServer(self, port=port, host=host)
+        self.metrics_server.start()
+        return self.metrics_server
+
+    def stop_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def start_stream(self, interval: float = 1., capacity: int = 100_000):
+        """Poll the snapshots in a background thread shared by all their consumers (see SnapshotStream)
+
+        :param interval: seconds between two snapshots, applied to the running stream if any
+        :param capacity: snapshots kept in the history of a new stream
+        :return: the SnapshotStream
+        """
+        from pymodaq_plugins_cellkraft.hardware.cellkraft.stream import SnapshotStream
+        if self.stream is None:
+            self.stream = SnapshotStream(self, interval=interval, capacity=capacity)
+        self.stream.interval = interval
+        self.stream.start()
+        return self.stream
+
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+
+    def get_stats(self):
+        """Statistics of the requests sent to the generator since the last reset_stats
+
+        :return: dict with the keys "since", "function_codes" and "registers" (see ModbusStats.as_dict, latencies in
+         ms), "suppressed_writes", "heartbeats" and "reconnects" (see SyncModBusInstrument)
+        """
+        stats = self.instr.stats.as_dict()
+        stats["suppressed_writes"] = self.suppressed_writes
+        stats["heartbeats"] = self.instr.heartbeats
+        stats["reconnects"] = self.instr.reconnects
+        return stats
+
+    def reset_stats(self):
+        self.instr.stats.reset()
+        self.suppressed_writes = 0
+
+    def log_stats(self):
+        """Dump the statistics in the log now, on top of the periodic dump (see SyncModBusInstrument)"""
+        self.instr.stats.log()
+        logger.info(f"{self.host} suppressed writes: {self.suppressed_writes}")
+
+    def validate_setpoints(self, setpoints: dict):
+        """Check a whole set of setpoints before anything is sent to the generator
+
+        :param setpoints: {register name: value} with names among the "write" entries of self.registers
+        :return: dict {address: raw value} ready to be written
+        """
+        orders = {}
+        for name, value in setpoints.items():
+            if name not in self.validators:
+                raise KeyError(f"{name} is not a writable register of {self.__class__.__name__}")
+            orders[self.registers[name]["register"]] = self.validators[name].check(value)
+        return orders
+
+    @traced()
+    def write_setpoints(self, setpoints: dict):
+        """Apply a full operating point in one go
+
+        All values are validated first so that nothing is written if one of them is wrong. Registers with
+        consecutive addresses are grouped in a single write_registers request, the others are sent back to back (in
+        a single pipelined batch if the instrument allows it).
+
+        :param setpoints: {register name: value}, e.g. {"SP_SteamT": 120, "RH": 50, "SP_Flow": 10}
+        :return: dict, snapshot of the process values read once all the writes are done
+        """
+        orders = self.validate_setpoints(setpoints)
+        blocks = contiguous_blocks(orders)
+        results = self.instr.execute_batch([(WRITE_REGISTERS, address, values) if len(values) > 1 else
+                                            (WRITE_REGISTER, address, values[0]) for address, values in blocks])
+        errors = []
+        for (address, values), result in zip(blocks, results):
+            if isinstance(result, Exception) or (result is not None and result.isError()):
+                errors.append(f"error while writing {values} at register {address}: {result}")
+            else:
+                self.last_written.update(zip(range(address, address + len(values)), values))
+        if errors:
+            raise IOError("\n".join(errors))
+        return self.get_snapshot()
+
+    @traced()
+    def set_setpoint(self, name: str, value: float, force: bool = False):
+        """Write a single setpoint quantized to the register resolution, skipping redundant writes
+
+        Meant for closed loops (PID, scans) calling it at a high rate: nothing is sent if the register already holds
+        the quantized value written last time.
+
+        :param name: a "write" entry of self.registers, e.g. "RH" or "SP_SteamT"
+        :param value: setpoint in physical units, clipped to the authorized range
+        :param force: write even if the value did not change
+        :return: bool, True if a request has been sent to the generator
+        """
+        if name not in self.validators:
+            raise KeyError(f"{name} is not a writable register of {self.__class__.__name__}")
+        raw = self.validators[name].quantize(value)
+        address = self.registers[name]["register"]
+        if not force and self.last_written.get(address) == raw:
+            self.suppressed_writes += 1
+            return False
+        result = self.instr.write(address, raw)
+        if isinstance(result, Exception) or (result is not None and result.isError()):
+            raise IOError(f"error while writing {raw} at register {address}: {result}")
+        self.last_written[address] = raw
+        return True
+
+    def forget_setpoint(self, name: str):
+        """Drop the last value written to a setpoint register, so that the next set_setpoint is sent whatever its value
+
+        Called by the direct register writers (SP_Flow, RH...), which bypass the write suppression.
+        """
+        self.last_written.pop(self.registers[name]["register"], None)
+
+    def get_setpoint(self, name: str):
+        """Last value written to a setpoint register, in physical units (None if never written in this session)"""
+        raw = self.last_written.get(self.registers[name]["register"])
+        return None if raw is None else raw / self.registers[name].get("scaling", 1)
+
+    @traced()
+    def read_channel(self, reference):
+        """Read the process value of a single channel
+
+        :param reference: one of SNAPSHOT_CHANNELS (Steam, Air, ...) or its name
+        :return: float in physical units
+        """
+        if isinstance(reference, str):
+            reference = self.snapshot_channels[[ref.__name__ for ref in self.snapshot_channels].index(reference)]
+        ReadResult = self.instr.read(reference.read_address.value)
+        if isinstance(ReadResult, Exception):
+            raise ReadResult
+        elif ReadResult.isError():
+            raise IOError(f"error while reading {reference.__name__}: {ReadResult}")
+        if self.read_lut is not None and reference in self.snapshot_channels:
+            value = float(self.read_lut[ReadResult.registers[0], self.snapshot_channels.index(reference)])
+        else:
+            value = ReadResult.registers[0] / getattr(reference, "read_scaling", 1)
+        timestamp = time.time()
+        self.last_values[reference.__name__] = (timestamp, value)
+        if reference.__name__ in self.settling:
+            self.settling[reference.__name__].update(timestamp, value)
+        return value
+
+    @traced()
+    def read_raw_snapshot(self):
+        """Read the raw register of every channel in SNAPSHOT_CHANNELS
+
+        :return: ndarray of uint16, one raw register value per channel
+        """
+        raw = np.zeros(len(self.snapshot_channels), dtype=np.uint16)
+        results = self.instr.execute_batch([(READ_INPUT_REGISTERS, reference.read_address.value, 1)
+                                            for reference in self.snapshot_channels])
+        for ind, (reference, ReadResult) in enumerate(zip(self.snapshot_channels, results)):
+            if isinstance(ReadResult, Exception):
+                raise ReadResult
+            elif ReadResult.isError():
+                raise IOError(f"error while reading {reference.__name__}: {ReadResult}")
+            raw[ind] = ReadResult.registers[0]
+        return raw
+
+    @traced()
+    def decode_snapshot(self, raw):
+        """Convert raw registers into physical values, calibrated if a calibration is set
+
+        :param raw: ndarray as returned by read_raw_snapshot
+        :return: ndarray of float
+        """
+        if self.read_lut is None:
+            return raw / self.read_scalings
+        return self.read_lut[raw, self._lut_columns]
+
+    @traced()
+    def get_snapshot(self):
+        """Read all the process values
+
+        :return: dict with a "timestamp" key and one key per channel name (Steam, Air, Flow, Pressure, Tube, Pump)
+        """
+        raw = self.read_raw_snapshot()
+        snapshot = dict(zip([reference.__name__ for reference in self.snapshot_channels],
+                            self.decode_snapshot(raw).tolist()))
+        snapshot["timestamp"] = time.time()
+        self.last_raw_snapshot = (snapshot["timestamp"], raw)
+        self.snapshot_times.append(snapshot["timestamp"])
+        for reference in self.snapshot_channels:
+            self.last_values[reference.__name__] = (snapshot["timestamp"], snapshot[reference.__name__])
+        for name, predictor in self.settling.items():
+            predictor.update(snapshot["timestamp"], snapshot[name])
+        return snapshot
+
+    def watch_settling(self, channel: str, predictor: SettlingPredictor = None):
+        """Feed a SettlingPredictor with the readbacks of a channel (from read_channel and get_snapshot)
+
+        :param channel: channel name, e.g. "Steam" or "Tube"
+        :param predictor: the predictor to feed, a default one is created if None
+        :return: the predictor
+        """
+        if predictor is None:
+            predictor = SettlingPredictor()
+        self.settling[channel] = predictor
+        return predictor
+
     @registerfactory("Pump", "write")
     def PumpSetMode(self, value: str = "auto"):
         """Writing the pump mode
@@ -267,6 +610,7 @@ class CellKraftE1500Drivers:
             case _:
                 order = Pump.default_mode.value
         try:
+            self.forget_setpoint("PumpSetMode")
             self.instr.write(self.registers["PumpSetMode"]["register"],
                              order)
         except Exception as e:
@@ -283,6 +627,7 @@ class CellKraftE1500Drivers:
         if isinstance(temperature, int):
             try:
 
+                self.forget_setpoint("SP_SteamT")
                 self.instr.write(self.registers["SP_SteamT"]["register"],
                                  temperature)
             except Exception as e:
@@ -299,6 +644,7 @@ class CellKraftE1500Drivers:
 
         if isinstance(relativehumidity, int):
             try:
+                self.forget_setpoint("RH")
                 self.instr.write(self.registers["RH"]["register"],
                                  relativehumidity*self.registers["RH"]["scaling"])
             except Exception as e:
@@ -316,6 +662,7 @@ class CellKraftE1500Drivers:
         if isinstance(flow, int):
             try:
 
+                self.forget_setpoint("SP_Flow")
                 self.instr.write(self.registers["SP_Flow"]["register"],
                                  flow*self.registers["SP_Flow"]["scaling"])
             except Exception as e:
@@ -333,6 +680,7 @@ class CellKraftE1500Drivers:
 
         if isinstance(temperature, int):
             try:
+                self.forget_setpoint("SP_Tube_Temp")
                 self.instr.write(self.registers["SP_Tube_Temp"]["register"],
                                  temperature)
             except Exception as e:
@@ -0,0 +1,200 @@
+from pathlib import Path
+from collections import deque
+import threading
+import time
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+# kind: direction of the excess over the limit, see AlarmEngine
+KINDS = {'high': 1., 'low': -1., 'rate': 1., 'stuck': 1.}
+RATE, STUCK = 2, 3  # indices of the kinds whose measure is not the value itself
+
+
+class AlarmEngine:
+    """Alarms and interlocks evaluated on each snapshot, all the rules at once
+
+    The rules are stored as NumPy arrays (channel index, kind, limit, hysteresis...) and evaluate computes them in a
+    single vectorized pass, so a snapshot costs a few array operations whatever the number of rules. Kinds of rule:
+
+    * "high" / "low": the value goes above / below limit
+    * "rate": the value changes faster than limit units per second (either way)
+    * "stuck": the value stays within tolerance of the same value for limit seconds (stalled flow, frozen sensor)
+
+    An alarm raised clears once the measure is back by more than hysteresis on the safe side of the limit, unless
+    the rule is latching: the alarm then stays active until acknowledged. The driver stop (flow set to 0) is called
+    when an interlock rule raises its alarm, and called again on each following snapshot until it succeeds (a stop
+    failing on the very communication trouble that raised the alarm is not lost). Subscribe evaluate to a SnapshotStream (see attach) to run the rules in
+    the poller thread.
+
+    :param channels: channel names, keys of the snapshots
+    :param driver: CellKraftE1500Drivers stopped by the interlocks, None to only report the alarms
+    :param history: number of events (raised, cleared, acknowledged) kept in self.events
+    """
+    def __init__(self, channels, driver=None, history: int = 1000):
+        self.channels = list(channels)
+        self.driver = driver
+        self.names = []
+        self.events = deque(maxlen=history)  # (timestamp, rule name, "raised" / "cleared" / "acknowledged")
+        self.stops = 0  # driver stops done by the interlocks
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.channel = np.zeros(0, dtype=np.intp)
+        self.kind = np.zeros(0, dtype=np.intp)
+        self.sign = np.zeros(0)
+        self.limit = np.zeros(0)
+        self.hysteresis = np.zeros(0)
+        self.tolerance = np.zeros(0)
+        self.latching = np.zeros(0, dtype=bool)
+        self.interlock = np.zeros(0, dtype=bool)
+        self.active = np.zeros(0, dtype=bool)  # condition on, hysteresis included
+        self.latched = np.zeros(0, dtype=bool)  # raised by a latching rule and not acknowledged
+        self.stop_pending = np.zeros(0, dtype=bool)  # interlock raised, the driver stop not done yet
+        self.anchor = np.zeros(0)  # value and time from which the stuck rules measure
+        self.anchor_time = np.zeros(0)
+        self._previous: np.ndarray = None  # values and time of the previous snapshot, for the rates
+        self._previous_time = 0.
+
+    @classmethod
+    def from_rules(cls, channels, rules, driver=None):
+        """Engine with rules given as dicts of add_rule keyword arguments (e.g. read from a toml file)"""
+        engine = cls(channels, driver)
+        for rule in rules:
+            engine.add_rule(**rule)
+        return engine
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_rule(self, name: str, channel: str, kind: str, limit: float, hysteresis: float = 0.,
+                 tolerance: float = 0., latching: bool = False, interlock: bool = False) -> int:
+        """Add a rule
+
+        :param name: unique name of the alarm
+        :param channel: channel watched, e.g. "Tube"
+        :param kind: "high", "low", "rate" or "stuck"
+        :param limit: value, rate in units per second or duration in seconds for "stuck"
+        :param hysteresis: margin past the limit before the alarm clears
+        :param tolerance: "stuck" only, variation ignored when checking that the value moves
+        :param latching: keep the alarm active until acknowledged
+        :param interlock: stop the generator when the alarm is raised
+        :return: index of the rule
+        """
+        if kind not in KINDS:
+            raise ValueError(f'unknown kind of rule {kind}, available: {list(KINDS)}')
+        if channel not in self.channels:
+            raise ValueError(f'unknown channel {channel}, available: {self.channels}')
+        if name in self.names:
+            raise ValueError(f'an alarm named {name} already exists')
+        row = dict(channel=self.channels.index(channel), kind=list(KINDS).index(kind), sign=KINDS[kind],
+                   limit=limit, hysteresis=hysteresis, tolerance=tolerance, latching=latching, interlock=interlock,
+                   active=False, latched=False, stop_pending=False, anchor=np.nan, anchor_time=np.nan)
+        with self._lock:
+            for attribute, value in row.items():
+                array = getattr(self, attribute)
+                setattr(self, attribute, np.append(array, np.array(value, dtype=array.dtype)))
+            self.names.append(name)
+        return len(self.names) - 1
+
+    def subscribe(self, callback):
+        """Call callback(timestamp, names raised, names cleared) after each evaluation changing the alarms"""
+        self._callbacks.append(callback)
+
+    def attach(self, stream):
+        """Evaluate the rules on each snapshot of a SnapshotStream"""
+        stream.subscribe(self.evaluate)
+
+    def detach(self, stream):
+        stream.unsubscribe(self.evaluate)
+
+    def measures(self, values: np.ndarray, timestamp: float) -> np.ndarray:
+        """Quantity compared to the limit of each rule, updating the rates and stuck durations"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if self._previous is None:
+                rates = np.full(len(values), np.nan)
+            else:
+                rates = np.abs(values - self._previous) / (timestamp - self._previous_time)
+        self._previous, self._previous_time = values, timestamp
+        watched = values[self.channel]
+        moved = ~(np.abs(watched - self.anchor) <= self.tolerance)  # NaN anchor: first value
+        self.anchor = np.where(moved, watched, self.anchor)
+        self.anchor_time = np.where(moved, timestamp, self.anchor_time)
+        return np.select([self.kind == RATE, self.kind == STUCK], [rates[self.channel], timestamp - self.anchor_time],
+                         watched)
+
+    def evaluate(self, snapshot: dict):
+        """Evaluate all the rules on a snapshot (dict with a "timestamp" key and one key per channel)
+
+        :return: names of the alarms raised by this snapshot
+        """
+        timestamp = snapshot["timestamp"]
+        values = np.array([snapshot.get(channel, np.nan) for channel in self.channels], dtype=float)
+        with self._lock:
+            excess = self.sign * (self.measures(values, timestamp) - self.limit)  # > 0: over the limit
+            was_on = self.active | self.latched
+            self.active = (excess > 0) | (self.active & ~(excess < -self.hysteresis))
+            self.latched |= self.active & self.latching
+            now_on = self.active | self.latched
+            raised = np.flatnonzero(now_on & ~was_on)
+            cleared = np.flatnonzero(was_on & ~now_on)
+            self.stop_pending[raised] |= self.interlock[raised]
+            pending = np.flatnonzero(self.stop_pending)
+            raised = [self.names[index] for index in raised]
+            cleared = [self.names[index] for index in cleared]
+        if raised or cleared:
+            self._report(timestamp, raised, cleared)
+        if len(pending):
+            self._stop([self.names[index] for index in pending], pending)
+        return raised
+
+    def _stop(self, names: list, pending: np.ndarray):
+        """Stop the driver for the interlocks names (indices pending), kept pending if the stop fails"""
+        host = getattr(self.driver, "host", "")
+        logger.warning(f'interlock {names}: stopping {host}')
+        if self.driver is not None:
+            try:
+                self.driver.stop()
+            except Exception as e:
+                logger.error(f'interlock {names}: stopping {host} failed, retried on the next snapshot: {e!r}')
+                return
+        with self._lock:
+            self.stop_pending[pending] = False
+        self.stops += 1
+
+    def _report(self, timestamp: float, raised: list, cleared: list):
+        for name in raised:
+            self.events.append((timestamp, name, 'raised'))
+            logger.warning(f'alarm raised: {name}')
+        for name in cleared:
+            self.events.append((timestamp, name, 'cleared'))
+            logger.info(f'alarm cleared: {name}')
+        for callback in list(self._callbacks):
+            try:
+                callback(timestamp, raised, cleared)
+            except Exception as e:
+                logger.exception(f'alarm subscriber {callback} failed: {e!r}')
+
+    def acknowledge(self, name: str = None):
+        """Release latched alarms (all of them if name is None), those whose condition is over clearing
+
+        :return: names of the alarms cleared
+        """
+        with self._lock:
+            selected = np.ones(len(self.names), dtype=bool) if name is None else \
+                np.array([rule == name for rule in self.names], dtype=bool)
+            released = selected & self.latched
+            self.latched &= ~selected
+            acknowledged = [self.names[index] for index in np.flatnonzero(released)]
+            cleared = [self.names[index] for index in np.flatnonzero(released & ~self.active)]
+        timestamp = time.time()
+        self.events.extend((timestamp, rule, 'acknowledged') for rule in acknowledged)
+        if cleared:
+            self._report(timestamp, [], cleared)
+        return cleared
+
+    @property
+    def alarms(self) -> list:
+        """Names of the alarms currently on (condition active or latched)"""
+        return [self.names[index] for index in np.flatnonzero(self.active | self.latched)]
@@ -0,0 +1,119 @@
+"""
+Calibration of the generator readbacks against reference instruments (e.g. a reference hygrometer for Air)
+
+A correction gives the reference value as a function of the value read (register / read_scaling), either as points
+of a piecewise linear curve (linearly extrapolated beyond the first and last ones) or as polynomial coefficients.
+The corrections are compiled into a lookup table holding the corrected value of every possible register value
+(LUT_SIZE of them, 16 bits registers), so that a snapshot is decoded by a single indexing of the table whatever the
+correction (see CellKraftE1500Drivers.set_calibration).
+
+Calibration file (toml), one table per corrected channel:
+
+    [Air]
+    readings = [10.0, 50.0, 90.0]  # values read from the generator
+    references = [10.4, 51.2, 92.5]  # values of the reference instrument
+
+    [Steam]
+    coefficients = [0.3, 1.002]  # reference = 0.3 + 1.002 * reading (increasing powers)
+"""
+from pathlib import Path
+
+import numpy as np
+from numpy.polynomial import polynomial
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+LUT_SIZE = 2 ** 16  # values of a 16 bits register
+
+
+class Calibration:
+    """Corrections of some channels, compiled into a lookup table over the raw registers
+
+    :param corrections: {channel name: dict(readings=[...], references=[...]) or dict(coefficients=[...])}
+    """
+    def __init__(self, corrections: dict = None):
+        self.corrections = {}
+        for channel, correction in (corrections or {}).items():
+            self.add(channel, **correction)
+
+    def add(self, channel: str, readings=None, references=None, coefficients=None):
+        """Set the correction of a channel, from points (readings, references) or polynomial coefficients"""
+        if coefficients is not None:
+            self.corrections[channel] = dict(coefficients=[float(value) for value in coefficients])
+            return
+        readings = np.asarray(readings, dtype=float)
+        references = np.asarray(references, dtype=float)
+        if readings.ndim != 1 or readings.shape != references.shape or len(readings) < 2:
+            raise ValueError(f'{channel}: readings and references must be two lists of the same length, at least 2')
+        order = np.argsort(readings)
+        if np.any(np.diff(readings[order]) <= 0):
+            raise ValueError(f'{channel}: the readings of a calibration table must be all different')
+        self.corrections[channel] = dict(readings=readings[order].tolist(), references=references[order].tolist())
+
+    @classmethod
+    def fit(cls, readings: dict, references: dict, degree: int = 1):
+        """Polynomial corrections fitted (least squares) on paired data
+
+        :param readings: {channel name: values read from the generator}
+        :param references: {channel name: values of the reference instrument at the same times}
+        :param degree: degree of the polynomials, 1 for a gain and an offset
+        """
+        calibration = cls()
+        for channel, values in readings.items():
+            values = np.asarray(values, dtype=float)
+            expected = np.asarray(references[channel], dtype=float)
+            valid = np.isfinite(values) & np.isfinite(expected)
+            if valid.sum() <= degree:
+                raise ValueError(f'{channel}: {valid.sum()} valid pairs, not enough for a degree {degree} fit')
+            calibration.add(channel, coefficients=polynomial.polyfit(values[valid], expected[valid], degree))
+            residuals = calibration.correct(channel, values[valid]) - expected[valid]
+            logger.info(f'{channel} calibration fitted, residual rms: {np.sqrt(np.mean(residuals ** 2)):.4g}')
+        return calibration
+
+    @classmethod
+    def load(cls, path):
+        """Calibration of a toml file, see the module documentation"""
+        import toml  # a dependency of pymodaq
+        return cls(toml.load(path))
+
+    def save(self, path):
+        import toml
+        with open(path, 'w') as file:
+            toml.dump(self.corrections, file)
+
+    def correct(self, channel: str, readings):
+        """Corrected values of readings of a channel (unchanged if the channel has no correction)
+
+        :param readings: a value or an array of values read
+        :return: float for a single value, ndarray of the shape of readings otherwise
+        """
+        scalar = np.ndim(readings) == 0
+        readings = np.atleast_1d(np.asarray(readings, dtype=float))
+        correction = self.corrections.get(channel)
+        if correction is None:
+            values = readings
+        elif 'coefficients' in correction:
+            values = polynomial.polyval(readings, correction['coefficients'])
+        else:
+            x, y = np.array(correction['readings']), np.array(correction['references'])
+            values = np.interp(readings, x, y)
+            below, above = readings < x[0], readings > x[-1]
+            values[below] = y[0] + (readings[below] - x[0]) * (y[1] - y[0]) / (x[1] - x[0])
+            values[above] = y[-1] + (readings[above] - x[-1]) * (y[-1] - y[-2]) / (x[-1] - x[-2])
+        return float(values[0]) if scalar else values
+
+    def compile(self, channels, scalings) -> np.ndarray:
+        """Lookup table of the corrected values: table[raw register value, channel index]
+
+        :param channels: channel names, columns of the table
+        :param scalings: read scaling of each channel
+        :return: float64 ndarray of shape (LUT_SIZE, channels)
+        """
+        unknown = set(self.corrections) - set(channels)
+        if unknown:
+            logger.warning(f'calibration of unknown channels ignored: {sorted(unknown)}')
+        table = np.arange(LUT_SIZE, dtype=float)[:, np.newaxis] / np.asarray(scalings, dtype=float)
+        for index, channel in enumerate(channels):
+            table[:, index] = self.correct(channel, table[:, index])
+        return table
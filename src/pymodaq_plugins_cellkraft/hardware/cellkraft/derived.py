@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+
+DERIVED_CHANNELS = ('DewPoint', 'AbsHumidity', 'Water')  # °C, g/m3, g
+# saturation line of IAPWS-IF97 (region 4), valid from 0 °C to the critical point, so for steam above 100 °C too
+N = (None, 0.11670521452767e4, -0.72421316703206e6, -0.17073846940092e2, 0.12020824702470e5, -0.32325550322333e7,
+     0.14915108613530e2, -0.48232657361591e4, 0.40511340542057e6, -0.23855557567849, 0.65017534844798e3)
+WATER_VAPOR_CONSTANT = 461.526  # J/(kg K)
+
+
+def saturation_pressure(temperature):
+    """Saturation vapor pressure of water in Pa, temperature in °C (scalar or ndarray)"""
+    t = np.asarray(temperature, dtype=float) + 273.15
+    theta = t + N[9] / (t - N[10])
+    a = theta ** 2 + N[1] * theta + N[2]
+    b = N[3] * theta ** 2 + N[4] * theta + N[5]
+    c = N[6] * theta ** 2 + N[7] * theta + N[8]
+    return 1e6 * (2 * c / (-b + np.sqrt(b ** 2 - 4 * a * c))) ** 4
+
+
+def saturation_temperature(pressure):
+    """Boiling temperature of water in °C at a pressure in Pa (scalar or ndarray), inverse of saturation_pressure"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = (np.asarray(pressure, dtype=float) / 1e6) ** 0.25
+        e = beta ** 2 + N[3] * beta + N[6]
+        f = N[1] * beta ** 2 + N[4] * beta + N[7]
+        g = N[2] * beta ** 2 + N[5] * beta + N[8]
+        d = 2 * g / (-f - np.sqrt(f ** 2 - 4 * e * g))
+        return (N[10] + d - np.sqrt((N[10] + d) ** 2 - 4 * (N[9] + N[10] * d))) / 2 - 273.15
+
+
+def dew_point(relative_humidity, temperature):
+    """Dew point in °C from the relative humidity in % and the temperature in °C (scalars or ndarrays)"""
+    return saturation_temperature(relative_humidity / 100. * saturation_pressure(temperature))
+
+
+def absolute_humidity(relative_humidity, temperature):
+    """Water vapor density in g/m3 (ideal gas) from the relative humidity in % and the temperature in °C"""
+    vapor_pressure = relative_humidity / 100. * saturation_pressure(temperature)
+    return 1000. * vapor_pressure / (WATER_VAPOR_CONSTANT * (np.asarray(temperature, dtype=float) + 273.15))
+
+
+class DerivedChannels:
+    """Quantities derived from each snapshot as it arrives, instead of post-processing the logs
+
+    * DewPoint (°C) and AbsHumidity (g/m3) of the gas, from its relative humidity and temperature
+    * Water (g), water dosed since the start (or the last reset): the flow in g/min integrated with the trapezoidal
+      rule on the actual snapshot times, so irregular polling or missed snapshots do not bias it. An interval longer
+      than max_gap, or across an interrupt() (failed snapshot), is not integrated, the flow being unknown.
+
+    :param humidity: channel of the relative humidity in %
+    :param temperature: channel of the gas temperature in °C
+    :param flow: channel of the water flow in g/min
+    :param max_gap: longest interval in s integrated between two snapshots, None for no limit
+    """
+    def __init__(self, humidity: str = 'Air', temperature: str = 'Steam', flow: str = 'Flow',
+                 max_gap: float = None):
+        self.humidity = humidity
+        self.temperature = temperature
+        self.flow = flow
+        self.max_gap = max_gap
+        self.water = 0.
+        self._previous = None  # (timestamp, flow) of the previous snapshot
+
+    def reset(self):
+        """Restart the water integral from 0"""
+        self.water = 0.
+        self._previous = None
+
+    def interrupt(self):
+        """Do not integrate the water up to the next snapshot, the flow being unknown meanwhile (failed snapshot)"""
+        self._previous = None
+
+    def update(self, snapshot: dict) -> dict:
+        """Derived quantities of a snapshot (dict with a "timestamp" key and the channels)
+
+        :return: dict with the DERIVED_CHANNELS keys
+        """
+        timestamp, flow = snapshot["timestamp"], snapshot.get(self.flow, math.nan)
+        if self._previous is not None and not math.isnan(flow):
+            dt = timestamp - self._previous[0]
+            if dt > 0 and (self.max_gap is None or dt <= self.max_gap):
+                self.water += 0.5 * (self._previous[1] + flow) * dt / 60.
+        if not math.isnan(flow):
+            self._previous = (timestamp, flow)
+        humidity = snapshot.get(self.humidity, math.nan)
+        temperature = snapshot.get(self.temperature, math.nan)
+        return dict(DewPoint=float(dew_point(humidity, temperature)) if humidity > 0 else math.nan,
+                    AbsHumidity=float(absolute_humidity(humidity, temperature)), Water=self.water)
+
+
+def water_dosed(times: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    """Cumulative water in g from flows in g/min at times in s, trapezoidal rule (offline check of DerivedChannels)"""
+    increments = 0.5 * (flows[1:] + flows[:-1]) * np.diff(times) / 60.
+    return np.concatenate(([0.], np.cumsum(increments)))
@@ -0,0 +1,148 @@
+"""
+Downsampled time range queries over raw register logs, for plotting long runs
+
+    query = LogQuery('~/cellkraft_logs/gen01_*.ckr')
+    points = query.query(['Steam', 'Air'], start=time.time() - 7 * 86400, points=1000)
+    plt.fill_between(points.times, points.min[:, 0], points.max[:, 0]); plt.plot(points.times, points.mean[:, 0])
+
+A query answers from the summary records of the logs (min, max, sum and count of every SUMMARY_ROWS snapshots, see
+rawlog.summarize), merged into the requested number of points. Only the snapshots of the records cut by the start or
+the stop of the range are decoded from the logs, so a week of data costs about the same as an hour. When the range
+holds fewer records than points (zoomed in), the snapshots are decoded and binned instead.
+"""
+from collections import namedtuple
+from pathlib import Path
+import glob
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogReader
+
+# times (n,), then arrays of shape (n, channels): mean, minimum, maximum and number of values of each point
+Downsampled = namedtuple('Downsampled', ['times', 'mean', 'min', 'max', 'count'])
+
+
+class LogQuery:
+    """Downsampled queries over one or more raw register logs of the same channels (e.g. the files of a
+    RotatingRawWriter)
+
+    :param paths: .ckr file, directory, glob pattern or iterable of them
+    """
+    def __init__(self, paths):
+        paths = [paths] if isinstance(paths, (str, Path)) else list(paths)
+        self.paths = []
+        for path in paths:
+            path = Path(path).expanduser()
+            if path.is_dir():
+                self.paths.extend(sorted(path.glob('*.ckr')))
+            elif path.exists():
+                self.paths.append(path)
+            else:
+                self.paths.extend(Path(match) for match in sorted(glob.glob(str(path))))
+        if not self.paths:
+            raise ValueError(f'no raw log in {paths}')
+        self.channels = []
+        self.readers = []
+        self.records = []
+        self.refresh()
+
+    def refresh(self):
+        """Read again the logs and their summaries, to see the snapshots written since"""
+        logs = []
+        self.channels = RawLogReader(self.paths[0]).channels
+        for path in self.paths:
+            reader = RawLogReader(path)
+            if reader.channels != self.channels:
+                raise ValueError(f'{path} channels {reader.channels} differ from those of {self.paths[0]}')
+            records = reader.summaries()
+            if len(records):
+                logs.append((reader, records))
+        logs.sort(key=lambda log: log[1][0, 1])
+        self.readers = [reader for reader, _ in logs]
+        self.records = [records for _, records in logs]
+
+    @property
+    def start(self) -> float:
+        """Time of the first snapshot"""
+        return self.records[0][0, 1] if self.records else np.nan
+
+    @property
+    def stop(self) -> float:
+        """Time of the last snapshot"""
+        return self.records[-1][-1, 2] if self.records else np.nan
+
+    def __len__(self):
+        return int(sum(records[:, 0].sum() for records in self.records))
+
+    def query(self, channels=None, start: float = None, stop: float = None, points: int = 1000) -> Downsampled:
+        """Snapshots of a time range reduced to at most points points
+
+        The range is split in points intervals of equal duration, each point summarizing the snapshots of one of
+        them (the intervals without snapshot are skipped). The snapshots themselves are returned when there are no
+        more than points of them.
+
+        :param channels: channels returned, all if None
+        :param start: first time, the start of the logs if None
+        :param stop: last time, the end of the logs if None
+        :param points: maximum number of points returned
+        :return: Downsampled(times, mean, min, max, count), times being the middles of the intervals
+        """
+        indexes = list(range(len(self.channels))) if channels is None else [self.channels.index(channel)
+                                                                             for channel in channels]
+        start = self.start if start is None else start
+        stop = self.stop if stop is None else stop
+        summarized, edges = [], []  # summary records fully in the range, snapshots of those partly in it
+        for reader, records in zip(self.readers, self.records):
+            inside = (records[:, 1] >= start) & (records[:, 2] <= stop)
+            partly = ~inside & (records[:, 2] >= start) & (records[:, 1] <= stop)
+            summarized.append(records[inside])
+            edges.extend(self._read_records(reader, records, np.flatnonzero(partly)))
+        zoomed = sum(len(records) for records in summarized) < points
+        if zoomed:  # the snapshots themselves
+            edges = [segment for reader, records in zip(self.readers, self.records)
+                     for segment in self._read_records(reader, records, np.flatnonzero((records[:, 2] >= start) &
+                                                                                      (records[:, 1] <= stop)))]
+            summarized = []
+        elements = [self._snapshot_elements(times, values, start, stop, indexes) for times, values in edges] + \
+                   [self._record_elements(records, indexes) for records in summarized]
+        times, count, total, minimum, maximum = [np.concatenate(arrays) for arrays in zip(*elements)] if elements \
+            else [np.zeros(0)] + [np.zeros((0, len(indexes)))] * 4
+        order = np.argsort(times, kind='stable')
+        times, count, total, minimum, maximum = times[order], count[order], total[order], minimum[order], \
+            maximum[order]
+        if not zoomed or len(times) > points:
+            width = (stop - start) / points
+            bins = np.clip(((times - start) / width).astype(np.intp), 0, points - 1)
+            bins, firsts = np.unique(bins, return_index=True)
+            times = start + (bins + 0.5) * width
+            count, total = np.add.reduceat(count, firsts), np.add.reduceat(total, firsts)
+            minimum, maximum = np.fmin.reduceat(minimum, firsts), np.fmax.reduceat(maximum, firsts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, np.nan)
+        return Downsampled(times, mean, minimum, maximum, count.astype(np.int64))
+
+    @staticmethod
+    def _read_records(reader: RawLogReader, records: np.ndarray, selected: np.ndarray) -> list:
+        """Snapshots of the selected records of a log, as (times, values) for each run of consecutive records"""
+        if not len(selected):
+            return []
+        offsets = np.cumsum(records[:, 0]) - records[:, 0]
+        runs = np.split(selected, np.flatnonzero(np.diff(selected) > 1) + 1)
+        return [reader.read_rows(int(offsets[run[0]]), int(offsets[run[-1]] + records[run[-1], 0])) for run in runs]
+
+    @staticmethod
+    def _snapshot_elements(times: np.ndarray, values: np.ndarray, start: float, stop: float, indexes: list):
+        """(times, count, sum, min, max) of the snapshots in the range, each one being its own summary"""
+        inside = (times >= start) & (times <= stop)
+        values = values[inside][:, indexes]
+        missing = np.isnan(values)
+        return times[inside], (~missing).astype(float), np.where(missing, 0., values), values, values
+
+    @staticmethod
+    def _record_elements(records: np.ndarray, indexes: list):
+        """(times, count, sum, min, max) of summary records, timed by their first snapshot"""
+        channels = (records.shape[1] - 3) // 4
+        return (records[:, 1],) + tuple(records[:, 3 + field * channels:][:, indexes] for field in range(4))
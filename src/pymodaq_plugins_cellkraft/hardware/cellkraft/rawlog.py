@@ -0,0 +1,352 @@
+"""
+Compact log of the raw registers of a generator
+
+The registers are small scaled integers changing slowly (a temperature × 10 moves by a few units between two
+snapshots), so each column of a block of snapshots is stored as the zigzag/varint encoding of its deltas: most
+values take a single byte, against 8 for a float64 and about 6 for a CSV field. Encoding and decoding are vectorized
+over a whole block with NumPy.
+
+File layout: MAGIC, uint32 length of a json header (channels, scalings, time unit), then blocks of at most
+block_size snapshots: uint32 number of snapshots, uint32 size in bytes of each column (times first, then one per
+channel), then the columns, in the same order. A block is independent of the others, so a file can be read block
+by block, and a file cut by a crash is only missing its last block.
+
+The writer also fills a summary file next to the log ({log name}.sum): SUMMARY_MAGIC then float64 records of
+consecutive snapshots, summary_rows at a time (see summarize), so that long time ranges can be plotted without
+decoding the log (see logquery.py).
+"""
+from pathlib import Path
+import json
+import struct
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+MAGIC = b'CKRAWLOG'
+VERSION = 1
+TIME_UNIT = 0.001  # s, resolution of the stored timestamps
+MISSING = -2 ** 31  # raw value stored for a missing value (NaN), out of the range of 16 bits registers
+SUMMARY_MAGIC = b'CKRAWSUM'
+SUMMARY_ROWS = 256  # snapshots per summary record
+
+
+def zigzag(values: np.ndarray) -> np.ndarray:
+    """Signed to unsigned integers, small magnitudes giving small numbers: 0, -1, 1, -2... -> 0, 1, 2, 3..."""
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """LEB128 encoding of unsigned integers: 7 bits per byte, the high bit set on all the bytes but the last"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    lengths = np.ones(len(values), dtype=np.intp)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.empty(starts[-1] + lengths[-1], dtype=np.uint8)
+    for index in range(lengths.max()):
+        selected = np.flatnonzero(lengths > index)
+        chunk = (values[selected] >> np.uint64(7 * index)) & np.uint64(0x7f)
+        encoded[starts[selected] + index] = chunk.astype(np.uint8) | np.where(lengths[selected] > index + 1, 0x80,
+                                                                                 0).astype(np.uint8)
+    return encoded.tobytes()
+
+
+def varint_decode(data) -> np.ndarray:
+    """Unsigned integers (uint64 ndarray) of a LEB128 encoded buffer"""
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.uint64)
+    if encoded[-1] >= 0x80:
+        raise ValueError('truncated varint buffer')
+    ends = np.flatnonzero(encoded < 0x80)
+    if len(ends) == len(encoded):  # all the values fit in a byte, the usual case for the deltas of slow registers
+        return encoded.astype(np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1))
+    chunks = (encoded & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(chunks, starts)
+
+
+def encode_column(values: np.ndarray, order: int = 1) -> bytes:
+    """Delta (of delta for order=2), zigzag and varint encoding of an integer column"""
+    deltas = values.astype(np.int64)
+    for _ in range(order):
+        deltas = np.diff(deltas, prepend=0)
+    return varint_encode(zigzag(deltas))
+
+
+def decode_column(data, order: int = 1) -> np.ndarray:
+    """int64 column of encode_column"""
+    values = unzigzag(varint_decode(data))
+    for _ in range(order):
+        values = np.cumsum(values)
+    return values
+
+
+def encode_block(times: np.ndarray, raw: np.ndarray) -> bytes:
+    """Block of snapshots: times in TIME_UNIT and raw values of shape (snapshots, channels), integers
+
+    The times are encoded as deltas of deltas, 0 for a regular polling.
+    """
+    columns = [encode_column(times, order=2)] + [encode_column(raw[:, index]) for index in range(raw.shape[1])]
+    return struct.pack(f'<I{len(columns)}I', len(times), *[len(column) for column in columns]) + b''.join(columns)
+
+
+def physical(raw: np.ndarray, scalings: np.ndarray, missing: int = MISSING) -> np.ndarray:
+    """Physical values of raw ones, NaN where missing"""
+    values = raw / scalings
+    values[raw == missing] = np.nan
+    return values
+
+
+def summary_path(path) -> Path:
+    """Summary file of a raw log"""
+    path = Path(path)
+    return path.with_name(path.name + '.sum')
+
+
+def summarize(times: np.ndarray, values: np.ndarray, summary_rows: int = SUMMARY_ROWS) -> np.ndarray:
+    """Summary records of consecutive snapshots, summary_rows at a time (fewer for the last one)
+
+    A record holds: number of snapshots, first and last time, then for each channel the number of values (NaN
+    excluded), their sum, minimum and maximum.
+
+    :param times: timestamps in s, shape (n,)
+    :param values: physical values, NaN where missing, shape (n, channels)
+    :return: float64 ndarray of shape (records, 3 + 4 * channels)
+    """
+    starts = np.arange(0, len(times), summary_rows)
+    ends = np.append(starts[1:], len(times))
+    missing = np.isnan(values)
+    records = np.empty((len(starts), 3 + 4 * values.shape[1]))
+    if not len(starts):
+        return records
+    records[:, 0] = ends - starts
+    records[:, 1] = times[starts]
+    records[:, 2] = times[ends - 1]
+    count, total, minimum, maximum = np.split(records[:, 3:], 4, axis=1)
+    count[:] = np.add.reduceat((~missing).astype(np.int64), starts, axis=0)
+    total[:] = np.add.reduceat(np.where(missing, 0., values), starts, axis=0)
+    minimum[:] = np.fmin.reduceat(values, starts, axis=0)  # fmin and fmax ignore the NaN
+    maximum[:] = np.fmax.reduceat(values, starts, axis=0)
+    return records
+
+
+class RawLogWriter:
+    """Append snapshots to a raw register log, one block written every block_size snapshots
+
+    :param path: file created (overwritten if it exists)
+    :param channels: channel names, keys of the snapshots
+    :param scalings: divisor giving the physical value of each channel from its register
+    :param block_size: snapshots per block
+    :param summary_rows: snapshots per record of the summary file, 0 to write none
+    """
+    def __init__(self, path, channels, scalings, block_size: int = 4096, summary_rows: int = SUMMARY_ROWS):
+        self.path = Path(path)
+        self.channels = list(channels)
+        self.scalings = np.asarray(scalings, dtype=float)
+        self.block_size = block_size
+        self.rows = 0  # snapshots written since the creation
+        self._times = np.zeros(block_size, dtype=np.int64)
+        self._raw = np.zeros((block_size, len(self.channels)), dtype=np.int64)
+        self._pending = 0
+        self._file = open(self.path, 'wb')
+        header = json.dumps(dict(version=VERSION, channels=self.channels, scalings=self.scalings.tolist(),
+                                 time_unit=TIME_UNIT, missing=MISSING)).encode()
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self.summary_rows = summary_rows
+        self._summary = None
+        if summary_rows:
+            self._summary_times = np.zeros(summary_rows, dtype=np.int64)
+            self._summary_raw = np.zeros((summary_rows, len(self.channels)), dtype=np.int64)
+            self._summarized = 0
+            self._summary = open(summary_path(self.path), 'wb')
+            self._summary.write(SUMMARY_MAGIC)
+
+    @classmethod
+    def for_driver(cls, path, driver, block_size: int = 4096, summary_rows: int = SUMMARY_ROWS):
+        """Writer of the snapshot channels of a CellKraftE1500Drivers, with its read scalings"""
+        return cls(path, [reference.__name__ for reference in driver.snapshot_channels], driver.read_scalings,
+                   block_size, summary_rows)
+
+    def write_raw(self, timestamp: float, raw):
+        """Append a snapshot given as raw register values, in the order of the channels"""
+        stamp = round(timestamp / TIME_UNIT)
+        self._times[self._pending] = stamp
+        self._raw[self._pending] = raw
+        self._pending += 1
+        self.rows += 1
+        if self._pending == self.block_size:
+            self._write_block()
+        if self._summary is not None:
+            self._summary_times[self._summarized] = stamp
+            self._summary_raw[self._summarized] = raw
+            self._summarized += 1
+            if self._summarized == self.summary_rows:
+                self._write_summary()
+
+    def write(self, snapshot: dict):
+        """Append a snapshot (dict with a "timestamp" key and the channels in physical units)"""
+        values = np.array([snapshot.get(channel, np.nan) for channel in self.channels], dtype=float) * self.scalings
+        missing = np.isnan(values)
+        values[missing] = 0.
+        raw = np.rint(values).astype(np.int64)
+        raw[missing] = MISSING
+        self.write_raw(snapshot["timestamp"], raw)
+
+    def _write_block(self):
+        if self._pending:
+            self._file.write(encode_block(self._times[:self._pending], self._raw[:self._pending]))
+            self._pending = 0
+
+    def _write_summary(self):
+        if self._summarized:
+            self._summary.write(summarize(self._summary_times[:self._summarized] * TIME_UNIT,
+                                          physical(self._summary_raw[:self._summarized], self.scalings),
+                                          self.summary_rows).astype('<f8').tobytes())
+            self._summarized = 0
+
+    def tell(self) -> int:
+        """Bytes written to the file, the pending snapshots excluded"""
+        return self._file.tell()
+
+    def flush(self):
+        """Write the pending snapshots as a (short) block and flush the file"""
+        self._write_block()
+        self._file.flush()
+        if self._summary is not None:
+            self._summary.flush()
+
+    def close(self):
+        if not self._file.closed:
+            if self._summary is not None:
+                self._write_summary()
+            self.flush()
+            self._file.close()
+            if self._summary is not None:
+                self._summary.close()
+
+
+class RawLogReader:
+    """Read a raw register log, decoded block by block
+
+    :param path: file written by RawLogWriter
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a Cellkraft raw log')
+            length, = struct.unpack('<I', file.read(4))
+            header = json.loads(file.read(length))
+            self.channels = header['channels']
+            self.scalings = np.asarray(header['scalings'], dtype=float)
+            self.time_unit = header['time_unit']
+            self.missing = header['missing']
+            self.blocks = self._index(file)  # [(offset of the columns, snapshots, column sizes)]
+        self.offsets = np.cumsum([0] + [rows for _, rows, _ in self.blocks])  # first snapshot of each block
+
+    def _index(self, file) -> list:
+        blocks = []
+        header = struct.Struct(f'<I{len(self.channels) + 1}I')
+        offset = file.tell()  # just after the json header
+        size = file.seek(0, 2)
+        while offset + header.size <= size:
+            rows, *sizes = header.unpack(self._read_at(file, offset, header.size))
+            if offset + header.size + sum(sizes) > size:
+                logger.warning(f'{self.path}: last block truncated, ignored')
+                break
+            blocks.append((offset + header.size, rows, sizes))
+            offset += header.size + sum(sizes)
+        return blocks
+
+    @staticmethod
+    def _read_at(file, offset: int, size: int) -> bytes:
+        file.seek(offset)
+        return file.read(size)
+
+    def __len__(self):
+        return sum(rows for _, rows, _ in self.blocks)
+
+    def decode_block(self, index: int, data: bytes = None):
+        """Timestamps (s) and raw values (int64, shape (snapshots, channels)) of a block"""
+        offset, rows, sizes = self.blocks[index]
+        if data is None:
+            with open(self.path, 'rb') as file:
+                data = self._read_at(file, offset, sum(sizes))
+        # the columns being consecutive and of the same length, they are decoded in a single pass
+        columns = np.cumsum(unzigzag(varint_decode(data)).reshape(len(sizes), rows), axis=1)
+        return np.cumsum(columns[0]) * self.time_unit, columns[1:].T
+
+    def physical(self, raw: np.ndarray) -> np.ndarray:
+        """Physical values of raw ones, NaN where missing"""
+        return physical(raw, self.scalings, self.missing)
+
+    def iter_blocks(self, physical: bool = True):
+        """Yield (times, values) for each block, in physical units or raw"""
+        with open(self.path, 'rb') as file:
+            for index, (offset, _, sizes) in enumerate(self.blocks):
+                times, raw = self.decode_block(index, self._read_at(file, offset, sum(sizes)))
+                yield times, self.physical(raw) if physical else raw
+
+    def read(self, physical: bool = True):
+        """Whole log as (times, values) ndarrays of shape (n,) and (n, channels)"""
+        blocks = list(self.iter_blocks(physical))
+        if not blocks:
+            return np.zeros(0), np.zeros((0, len(self.channels)))
+        return np.concatenate([times for times, _ in blocks]), np.concatenate([values for _, values in blocks])
+
+    def read_rows(self, start: int, stop: int, physical: bool = True):
+        """Snapshots start to stop (excluded) as (times, values), only the blocks holding them being decoded"""
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        last = np.searchsorted(self.offsets, stop, side='left') - 1
+        blocks = [self.decode_block(index) for index in range(first, min(last + 1, len(self.blocks)))]
+        if not blocks:
+            return np.zeros(0), np.zeros((0, len(self.channels)))
+        times = np.concatenate([times for times, _ in blocks])
+        raw = np.concatenate([raw for _, raw in blocks])
+        selected = slice(start - self.offsets[first], stop - self.offsets[first])
+        return times[selected], self.physical(raw[selected]) if physical else raw[selected]
+
+    def summaries(self, summary_rows: int = SUMMARY_ROWS) -> np.ndarray:
+        """Summary records of the whole log (see summarize), read from its summary file
+
+        The snapshots the file does not cover (log written without summary, or still being written) are summarized
+        from the log. The summary file is created if there is none, for the next reads.
+        """
+        path = summary_path(self.path)
+        width = 3 + 4 * len(self.channels)
+        records = np.zeros((0, width))
+        if path.exists():
+            with open(path, 'rb') as file:
+                if file.read(len(SUMMARY_MAGIC)) == SUMMARY_MAGIC:
+                    data = file.read()
+                    records = np.frombuffer(data, dtype='<f8', count=len(data) // (8 * width) * width)
+                    records = records.reshape(-1, width)
+                else:
+                    logger.warning(f'{path} is not a summary file, ignored')
+        # the summary file may be ahead of the log, its records being written before the blocks
+        covered = np.searchsorted(np.cumsum(records[:, 0]), len(self), side='right')
+        records = records[:covered]
+        start = int(records[:, 0].sum())
+        if start < len(self):
+            records = np.concatenate((records, summarize(*self.read_rows(start, len(self)), summary_rows)))
+            if not path.exists():
+                try:
+                    with open(path, 'wb') as file:
+                        file.write(SUMMARY_MAGIC + records.astype('<f8').tobytes())
+                except OSError as e:
+                    logger.warning(f'cannot write {path}: {e!r}')
+        return records
@@ -0,0 +1,265 @@
+from pathlib import Path
+from multiprocessing import shared_memory
+import itertools
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import SNAPSHOT_CHANNELS
+from pymodaq_plugins_cellkraft.hardware.cellkraft.derived import DERIVED_CHANNELS
+from pymodaq_plugins_cellkraft.hardware.cellkraft.settling import SettlingPredictor
+
+CHANNELS = tuple(reference.__name__ for reference in SNAPSHOT_CHANNELS) + DERIVED_CHANNELS
+SEQUENCE, FAILURES, CONNECTED = range(3)  # int64 header fields, followed by the float64 timestamp and values
+
+
+class SharedSnapshot:
+    """Latest snapshot in a shared memory block, written by one process and read by others without lock
+
+    Layout: int64 sequence, failed snapshots, connected flag, then float64 timestamp and one value per channel. The
+    writer makes the sequence odd while it writes (seqlock): a reader copies the block and retries if the sequence
+    was odd or changed meanwhile, so it never sees a half-written snapshot nor blocks the writer.
+
+    :param name: name of an existing block to attach to, None to create one
+    :param channels: channel names, in the order of the values
+    """
+    def __init__(self, name: str = None, channels=CHANNELS):
+        self.channels = tuple(channels)
+        size = 8 * (3 + 1 + len(self.channels))
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.header = np.ndarray(3, dtype=np.int64, buffer=self.memory.buf)
+        self.data = np.ndarray(1 + len(self.channels), dtype=np.float64, buffer=self.memory.buf, offset=24)
+        if self.owner:
+            self.header[:] = 0
+            self.data[:] = np.nan
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    @property
+    def sequence(self) -> int:
+        """Number of snapshots published"""
+        return int(self.header[SEQUENCE]) // 2
+
+    def publish(self, snapshot: dict):
+        """Write a snapshot (dict with a "timestamp" key and one key per channel)"""
+        self.header[SEQUENCE] += 1
+        self.data[0] = snapshot["timestamp"]
+        self.data[1:] = [snapshot[channel] for channel in self.channels]
+        self.header[CONNECTED] = 1
+        self.header[SEQUENCE] += 1
+
+    def set_status(self, failures: int, connected: bool):
+        self.header[FAILURES] = failures
+        self.header[CONNECTED] = connected
+
+    def read(self):
+        """Consistent copy of the latest snapshot
+
+        :return: (sequence, ndarray [timestamp, values...])
+        """
+        while True:
+            before = self.header[SEQUENCE]
+            data = self.data.copy()
+            if before % 2 == 0 and self.header[SEQUENCE] == before:
+                return int(before) // 2, data
+
+    def close(self):
+        del self.header, self.data  # release the exported buffer before closing
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def _serve(connection, name: str, host, interval: float, driver_options: dict):
+    """Worker process: poll the generator into the shared snapshot and execute the commands of the pipe"""
+    from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers
+    shared = SharedSnapshot(name)
+    driver = CellKraftE1500Drivers(host, **driver_options)
+    driver.init_hardware()
+    stream = driver.start_stream(interval, capacity=100)
+    stream.subscribe(shared.publish)
+    connection.send((None, True, driver.init))
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):  # the parent process is gone
+            break
+        if message is None:
+            break
+        request_id, attribute, args, kwargs = message
+        try:
+            target = driver
+            for part in attribute.split('.'):
+                target = getattr(target, part)
+            result = stream.submit(target, *args, **kwargs).result() if callable(target) else target
+            reply = (request_id, True, result)
+        except Exception as e:
+            reply = (request_id, False, e)
+        shared.set_status(stream.failures, driver.instr.connected)
+        try:
+            connection.send(reply)
+        except Exception as e:  # result or exception that cannot be pickled
+            connection.send((request_id, False, IOError(f'{attribute} failed in the worker: {e!r}')))
+    driver.close()
+    shared.close()
+
+
+class _RemoteAttribute:
+    """Attribute of the driver in the worker: calling it runs the method there, attributes can be chained"""
+    def __init__(self, remote, name: str):
+        self._remote = remote
+        self._name = name
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _RemoteAttribute(self._remote, f'{self._name}.{name}')
+
+    def __call__(self, *args, **kwargs):
+        return self._remote.call(self._name, *args, **kwargs)
+
+
+class RemoteDriver:
+    """CellKraftE1500Drivers running in a separate worker process
+
+    The worker polls the generator and publishes each snapshot in a SharedSnapshot: get_snapshot and read_channel
+    read the latest one from shared memory, without any request nor lock, so a stalled Modbus call never blocks the
+    caller and a crash of the driver does not take the caller process down (init_hardware starts a new worker).
+    Other methods and attributes of the driver (set_setpoint, get_stats, instr.start_recording...) are forwarded
+    through a pipe and executed by the worker between two snapshots, waiting at most timeout seconds. The settling
+    predictors run in the caller process, fed with the snapshots read.
+
+    :param host: hostname or ip adress of the generator
+    :param interval: seconds between two snapshots of the worker
+    :param timeout: seconds to wait for the worker to start or to execute a command
+    :param driver_options: keyword arguments of CellKraftE1500Drivers (port, pipeline_window, transport...)
+    """
+    def __init__(self, host, interval: float = 0.5, timeout: float = 10., **driver_options):
+        self.host = host
+        self.interval = interval
+        self.timeout = timeout
+        self.driver_options = driver_options
+        self.init = False
+        self.settling = {}  # {channel name: SettlingPredictor}, as in CellKraftE1500Drivers
+        self.shared: SharedSnapshot = None
+        self.process = None
+        self.connection = None
+        self._context = multiprocessing.get_context('spawn')  # no fork of a Qt process
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._fed = 0  # sequence of the latest snapshot fed to the predictors
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def init_hardware(self):
+        """Start the worker (a new one if the previous one died) and wait for its connection to the generator"""
+        if self.alive:
+            return
+        self._stop_worker()
+        self.shared = SharedSnapshot()
+        self.connection, child = self._context.Pipe()
+        self.process = self._context.Process(target=_serve, args=(child, self.shared.name, self.host, self.interval,
+                                                                  self.driver_options),
+                                             daemon=True, name=f'cellkraft {self.host}')
+        self.process.start()
+        child.close()
+        if not self.connection.poll(self.timeout):
+            logger.warning(f'worker of {self.host} did not start within {self.timeout} s')
+            self.init = False
+            return
+        _, _, self.init = self.connection.recv()
+
+    def call(self, attribute: str, *args, **kwargs):
+        """Run a method of the driver in the worker (or get an attribute) and return its result
+
+        :param attribute: name of the method or attribute, dotted for those of its members (e.g. "instr.connected")
+        :raise ConnectionError: if the worker is not running
+        :raise TimeoutError: if it did not answer within self.timeout
+        """
+        with self._lock:
+            if not self.alive:
+                raise ConnectionError(f'the worker of {self.host} is not running')
+            request_id = next(self._ids)
+            self.connection.send((request_id, attribute, args, kwargs))
+            deadline = time.perf_counter() + self.timeout
+            while True:
+                if not self.connection.poll(max(deadline - time.perf_counter(), 0.)):
+                    raise TimeoutError(f'{attribute} not executed by the worker of {self.host} within '
+                                       f'{self.timeout} s')
+                reply_id, ok, result = self.connection.recv()
+                if reply_id == request_id:
+                    break  # else the late reply of a command that timed out
+        if not ok:
+            raise result
+        return result
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _RemoteAttribute(self, name)
+
+    def get_snapshot(self) -> dict:
+        """Latest snapshot published by the worker, keys of CellKraftE1500Drivers.get_snapshot and DERIVED_CHANNELS
+
+        :raise IOError: if there is none yet, if the worker died or if the snapshot is older than the polling allows
+         (worker stalled or the generator not answering)
+        """
+        if self.shared is None:
+            raise ConnectionError(f'the worker of {self.host} has not been started')
+        sequence, data = self.shared.read()
+        deadline = time.perf_counter() + self.timeout
+        while sequence == 0 and self.alive and time.perf_counter() < deadline:
+            time.sleep(min(self.interval, 0.01))
+            sequence, data = self.shared.read()
+        age = time.time() - data[0]
+        if sequence == 0 or not self.alive or age > max(3 * self.interval, self.timeout):
+            raise IOError(f'no recent snapshot from {self.host}'
+                          f'{"" if self.alive else " (worker not running)"}')
+        snapshot = dict(zip(self.shared.channels, data[1:].tolist()))
+        snapshot["timestamp"] = float(data[0])
+        if sequence != self._fed:
+            self._fed = sequence
+            for name, predictor in self.settling.items():
+                predictor.update(snapshot["timestamp"], snapshot[name])
+        return snapshot
+
+    def read_channel(self, reference) -> float:
+        """Latest value of a channel (one of SNAPSHOT_CHANNELS or its name) published by the worker"""
+        return self.get_snapshot()[reference if isinstance(reference, str) else reference.__name__]
+
+    def watch_settling(self, channel: str, predictor: SettlingPredictor = None):
+        if predictor is None:
+            predictor = SettlingPredictor()
+        self.settling[channel] = predictor
+        return predictor
+
+    def _stop_worker(self):
+        if self.process is not None:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(self.timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.connection.close()
+            self.process = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    def close(self):
+        """Stop the worker, which closes the connection to the generator"""
+        self._stop_worker()
+        self.init = False
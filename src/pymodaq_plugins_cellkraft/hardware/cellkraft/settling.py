@@ -0,0 +1,141 @@
+from collections import deque
+import math
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft.hardware.tracing import traced
+
+
+class SettlingPredictor:
+    """Streaming first-order fit of a readback to predict its final value before it actually settles
+
+    The last samples are fitted by y(t) = y_inf + a exp(-t / tau): for a fixed tau the fit is a linear least squares
+    solved in closed form, so a geometric grid of tau values is evaluated at once, then finer grids around the best
+    one. The point is declared settled once y_inf is known within a fraction of the band (and, with a target, is
+    within band of it including its standard error), without waiting for the readback itself to enter the band,
+    unless lookahead is set: the readback then has to be predicted inside the band within lookahead seconds.
+
+    :param band: half-width of the band around the final value considered as settled, in the readback units
+    :param window: number of most recent samples used for the fit
+    :param min_samples: samples needed before any prediction is made
+    :param confidence: the prediction is trusted when the standard error of y_inf is below confidence * band
+    :param lookahead: accept the point only if the readback is predicted to enter the band within lookahead seconds,
+        0 to wait for it to be inside, inf to decide on the predicted final value alone
+    """
+    def __init__(self, band: float = 1., window: int = 60, min_samples: int = 8, confidence: float = 0.5,
+                 lookahead: float = math.inf):
+        self.band = band
+        self.window = window
+        self.min_samples = max(min_samples, 4)
+        self.confidence = confidence
+        self.lookahead = lookahead
+        self.n_taus = 48
+        self.n_refinements = 2
+        self.target = None
+        self.times = deque(maxlen=window)
+        self.values = deque(maxlen=window)
+        self.final_value = None
+        self.final_value_error = math.inf
+        self.tau = None
+
+    def reset(self, target: float = None):
+        """Forget the samples, to be called when a new setpoint is applied"""
+        self.target = target
+        self.times.clear()
+        self.values.clear()
+        self.final_value = None
+        self.final_value_error = math.inf
+        self.tau = None
+
+    def update(self, timestamp: float, value: float):
+        """Add a readback sample and refresh the prediction
+
+        :param timestamp: time of the sample in seconds
+        :param value: the readback
+        """
+        if self.times and timestamp <= self.times[-1]:
+            return
+        self.times.append(timestamp)
+        self.values.append(value)
+        if len(self.times) >= self.min_samples:
+            self._fit()
+
+    @traced()
+    def _fit(self):
+        times = np.fromiter(self.times, dtype=float)
+        values = np.fromiter(self.values, dtype=float)
+        times = times - times[-1]
+        if np.ptp(values) == 0:  # flat readback: already at its final value
+            self.final_value, self.final_value_error, self.tau = float(values[-1]), 0., 0.
+            return
+        span = -times[0]
+        taus = np.geomspace(span / (4 * times.size), 20 * span, self.n_taus)
+        fits = []
+        for refinement in range(self.n_refinements + 1):
+            if refinement:  # finer grid between the neighbours of the best tau
+                taus = np.geomspace(taus[max(best - 1, 0)], taus[min(best + 1, taus.size - 1)], self.n_taus // 2)
+            fits.append((taus,) + self._solve(times, values, taus))
+            best = int(np.argmin(fits[-1][3]))
+        taus, y_inf, error, residuals = [np.concatenate(arrays) for arrays in zip(*fits[1:] or fits)]
+        best = int(np.argmin(residuals))
+        dof = max(times.size - 3, 1)
+        constant = float(((values - values.mean()) ** 2).sum())
+        if constant <= residuals[best] * (1 + 4 / dof):  # the decay is not significant against the noise: settled
+            self.final_value, self.tau = float(values.mean()), 0.
+            self.final_value_error = float(np.sqrt(constant / (times.size - 1) / times.size))
+            return
+        # the error of y_inf at the best tau ignores the uncertainty of tau: also cover the y_inf of the taus fitting
+        # the samples about as well (residuals within one noise variance of the best, i.e. a one sigma interval)
+        compatible = residuals <= residuals[best] * (1 + 1 / dof)
+        self.final_value = float(y_inf[best])
+        self.final_value_error = float(max(error[best], np.abs(y_inf[compatible] - y_inf[best]).max()))
+        self.tau = float(taus[best])
+
+    @staticmethod
+    def _solve(times: np.ndarray, values: np.ndarray, taus: np.ndarray):
+        """Closed-form least squares of values = y_inf + amplitude * exp(-times / tau) for every tau at once
+
+        :return: y_inf, its standard error and the sum of squared residuals, arrays of shape taus.shape
+        """
+        # (n_taus, n_samples), 1 at the first sample (decaying, so that short taus do not overflow)
+        basis = np.exp((times[0] - times[np.newaxis, :]) / taus[:, np.newaxis])
+        n = times.size
+        sb, sbb = basis.sum(axis=1), (basis ** 2).sum(axis=1)
+        sy, sby = values.sum(), basis @ values
+        det = n * sbb - sb ** 2
+        valid = det > 1e-12 * n * sbb
+        det = np.where(valid, det, 1.)
+        amplitude = (n * sby - sb * sy) / det
+        y_inf = (sy - amplitude * sb) / n
+        residuals = ((values[np.newaxis, :] - y_inf[:, np.newaxis] - amplitude[:, np.newaxis] * basis) ** 2).sum(axis=1)
+        residuals[~valid] = np.inf
+        error = np.sqrt(residuals / max(n - 3, 1) * sbb / det)
+        return y_inf, error, residuals
+
+    @property
+    def confident(self) -> bool:
+        """True if the final value is known well enough"""
+        return self.final_value is not None and self.final_value_error <= self.confidence * self.band
+
+    @property
+    def time_to_band(self) -> float:
+        """Predicted time for the readback to get within band of the final value (inf if unknown)"""
+        if self.final_value is None:
+            return math.inf
+        distance = abs(self.values[-1] - self.final_value)
+        if distance <= self.band or self.tau == 0:
+            return 0.
+        return self.tau * math.log(distance / self.band)
+
+    @property
+    def settled(self) -> bool:
+        """True once the prediction is confident and the readback is predicted within band of it within lookahead
+
+        If a target has been given (see reset), the predicted final value, give or take its standard error, has also
+        to be within band of it.
+        """
+        if not self.confident:
+            return False
+        if self.target is not None and abs(self.final_value - self.target) + self.final_value_error > self.band:
+            return False
+        return self.time_to_band <= self.lookahead
@@ -0,0 +1,192 @@
+from pathlib import Path
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+import numpy as np
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.derived import DerivedChannels, DERIVED_CHANNELS
+
+
+class SnapshotHistory:
+    """Fixed size ring buffer of snapshots, so that its memory does not grow however long it is fed
+
+    :param channels: names of the channels kept, keys of the snapshots
+    :param capacity: number of snapshots kept, the oldest ones being overwritten
+    """
+    def __init__(self, channels, capacity: int = 100_000):
+        self.channels = list(channels)
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, len(self.channels)), dtype=np.float32)
+        self.count = 0  # snapshots appended since the creation
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, snapshot: dict):
+        """Add a snapshot, a dict with a "timestamp" key and one key per channel"""
+        row = [snapshot.get(channel, np.nan) for channel in self.channels]
+        with self._lock:
+            index = self.count % self.capacity
+            self.times[index] = snapshot["timestamp"]
+            self.values[index] = row
+            self.count += 1
+
+    def latest(self, duration: float = None):
+        """Copy of the snapshots of the last duration seconds (all of them if None), oldest first
+
+        :return: (times, values) ndarrays of shape (n,) and (n, number of channels)
+        """
+        with self._lock:
+            if self.count <= self.capacity:
+                times, values = self.times[:self.count].copy(), self.values[:self.count].copy()
+            else:
+                index = self.count % self.capacity
+                times = np.concatenate((self.times[index:], self.times[:index]))
+                values = np.concatenate((self.values[index:], self.values[:index]))
+        if duration is not None and len(times):
+            first = np.searchsorted(times, times[-1] - duration)
+            times, values = times[first:], values[first:]
+        return times, values
+
+
+def minmax_decimate(times: np.ndarray, values: np.ndarray, bins: int):
+    """Reduce a curve to at most 2 * bins points keeping the minimum and the maximum of each bin, in time order
+
+    Unlike plain subsampling, spikes stay visible whatever the decimation.
+
+    :param times: ndarray of shape (n,)
+    :param values: ndarray of shape (n,)
+    :param bins: number of bins
+    :return: (times, values) decimated
+    """
+    n = len(times)
+    if n <= 2 * bins:
+        return times, values
+    size = -(-n // bins)  # points per bin, rounded up
+    full = (n // size) * size
+    blocks = values[:full].reshape(-1, size)
+    offsets = np.arange(0, full, size)
+    lows = offsets + np.argmin(blocks, axis=1)
+    highs = offsets + np.argmax(blocks, axis=1)
+    indices = np.empty(2 * len(offsets), dtype=np.intp)
+    indices[0::2] = np.minimum(lows, highs)
+    indices[1::2] = np.maximum(lows, highs)
+    indices = np.concatenate((indices, np.arange(full, n)))
+    return times[indices], values[indices]
+
+
+class SnapshotStream:
+    """Single poller of a CellKraftE1500Drivers feeding a SnapshotHistory and the subscribed callbacks
+
+    Displays, loggers and other consumers subscribe to the stream instead of reading the generator themselves, so
+    the generator sees one snapshot per interval whatever the number of consumers. Calls submitted to the stream
+    (setpoint writes) are run by the poller thread between two snapshots, those left when it stops are cancelled.
+    Each snapshot is completed with the DERIVED_CHANNELS (dew point, absolute humidity, water dosed) computed by
+    self.derived before being stored and passed to the subscribers, the water dosed not being integrated across a
+    failed snapshot.
+
+    :param driver: CellKraftE1500Drivers, initialized
+    :param interval: seconds between two snapshots
+    :param capacity: snapshots kept in self.history
+    """
+    def __init__(self, driver, interval: float = 1., capacity: int = 100_000):
+        self.driver = driver
+        self.interval = interval
+        self.derived = DerivedChannels()
+        self.history = SnapshotHistory([reference.__name__ for reference in driver.snapshot_channels] +
+                                       list(DERIVED_CHANNELS), capacity)
+        self.failures = 0  # snapshots that failed
+        self.last_error: Exception = None
+        self._subscribers = []
+        self._calls = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def subscribe(self, callback):
+        """Call callback(snapshot) in the poller thread after each snapshot"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        """Run function(*args, **kwargs) in the poller thread as soon as it is idle
+
+        :return: Future of the result
+        """
+        future = Future()
+        self._calls.put((future, function, args, kwargs))
+        return future
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name=f'snapshots {self.driver.host}')
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._calls.put(None)
+            self._thread.join()
+            self._thread = None
+
+    @staticmethod
+    def _run_call(future, function, args, kwargs):
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def poll(self) -> dict:
+        """Take a snapshot, store it and pass it to the subscribers (None if it failed)"""
+        try:
+            snapshot = self.driver.get_snapshot()
+        except Exception as e:
+            self.failures += 1
+            if self.last_error is None:
+                logger.warning(f'snapshot of {self.driver.host} failed: {e!r}')
+            self.last_error = e
+            self.derived.interrupt()
+            return None
+        self.last_error = None
+        snapshot.update(self.derived.update(snapshot))
+        self.history.append(snapshot)
+        for callback in list(self._subscribers):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.exception(f'snapshot subscriber {callback} failed: {e!r}')
+        return snapshot
+
+    def _run(self):
+        due = time.perf_counter()
+        while not self._stop.is_set():
+            wait = due - time.perf_counter()
+            if wait <= 0:
+                self.poll()
+                due = max(due + self.interval, time.perf_counter())  # no burst to catch up after a stall
+                continue
+            try:
+                call = self._calls.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if call is not None:
+                self._run_call(*call)
+        while not self._calls.empty():
+            call = self._calls.get()
+            if call is not None:
+                call[0].cancel()
@@ -0,0 +1,91 @@
+class IntervalValidator:
+    """Constant-time check of a setpoint authorized on an arithmetic progression (a range)
+
+    :param name: name of the setpoint register, for the error messages
+    :param minimum: lowest authorized value
+    :param maximum: highest authorized value
+    :param step: spacing of the authorized values, 1 leaving quantize free at the register resolution (e.g. 0.1 % for
+        RH)
+    :param scaling: raw register value = value * scaling
+    """
+    __slots__ = ('name', 'minimum', 'maximum', 'step', 'scaling', 'raw_min', 'raw_max', 'raw_step')
+
+    def __init__(self, name: str, minimum: int, maximum: int, step: int = 1, scaling: int = 1):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.scaling = scaling
+        self.raw_min = minimum * scaling
+        self.raw_max = maximum * scaling
+        self.raw_step = step * scaling if step > 1 else 1
+
+    def check(self, value) -> int:
+        """Raw register value of an authorized setpoint, raise TypeError or ValueError otherwise"""
+        if not isinstance(value, int):
+            raise TypeError(f"type(value) passed for {self.name} must be an int")
+        if value < self.minimum or value > self.maximum or (value - self.minimum) % self.step:
+            raise ValueError(f"{value} is not an authorized value for {self.name}")
+        return value * self.scaling
+
+    def quantize(self, value: float) -> int:
+        """Raw register value closest to value on the grid of the authorized values (at the register resolution for a
+        unit step), clipped to the authorized range"""
+        raw = self.raw_min + int(round((value * self.scaling - self.raw_min) / self.raw_step)) * self.raw_step
+        return self.raw_min if raw < self.raw_min else self.raw_max if raw > self.raw_max else raw
+
+
+class ModeValidator:
+    """Lookup table of the raw value of each authorized mode, by value or by name
+
+    :param name: name of the setpoint register, for the error messages
+    :param values: authorized values
+    :param names: {mode name: value}
+    :param default: value used for an unknown mode name, an unknown name raises ValueError if None
+    :param scaling: raw register value = value * scaling
+    """
+    __slots__ = ('name', 'table', 'default', 'scaling', 'minimum', 'maximum')
+
+    def __init__(self, name: str, values, names: dict = None, default: int = None, scaling: int = 1):
+        self.name = name
+        self.scaling = scaling
+        self.table = {value: value * scaling for value in values}
+        self.table.update({mode: value * scaling for mode, value in (names or {}).items()})
+        self.default = None if default is None else default * scaling
+        self.minimum = min(values)
+        self.maximum = max(values)
+
+    def check(self, value) -> int:
+        """Raw register value of an authorized mode (value or name), raise TypeError or ValueError otherwise"""
+        if isinstance(value, str):
+            raw = self.table.get(value, self.default)
+        elif isinstance(value, int):
+            raw = self.table.get(value)
+        else:
+            raise TypeError(f"type(value) passed for {self.name} must be an int or a mode name")
+        if raw is None:
+            raise ValueError(f"{value} is not an authorized value for {self.name}")
+        return raw
+
+    def quantize(self, value) -> int:
+        return self.check(value if isinstance(value, str) else int(round(value)))
+
+
+def compile_validator(name: str, authorized, scaling: int = 1, names: dict = None, default: int = None):
+    """Validator of the setpoint register name from its authorized values
+
+    :param authorized: range or list of authorized values (an evenly spaced list is compiled as a range)
+    :param scaling: raw register value = value * scaling
+    :param names: {mode name: value} if the register holds a mode, then checked through a lookup table
+    :param default: value of an unknown mode name
+    :return: IntervalValidator or ModeValidator
+    """
+    if names is None:
+        if isinstance(authorized, range) and len(authorized) > 0:
+            step = abs(authorized.step)
+            return IntervalValidator(name, min(authorized), max(authorized), step, scaling)
+        values = sorted(set(authorized))
+        steps = {second - first for first, second in zip(values, values[1:])}
+        if len(steps) <= 1 and values:
+            return IntervalValidator(name, values[0], values[-1], steps.pop() if steps else 1, scaling)
+    return ModeValidator(name, list(authorized), names, default, scaling)
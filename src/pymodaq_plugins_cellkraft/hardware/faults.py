@@ -0,0 +1,340 @@
+from pathlib import Path
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+DISTRIBUTIONS = ('constant', 'uniform', 'exponential', 'lognormal')
+CORRUPTIONS = ('function_code', 'byte_count', 'transaction_id')
+
+
+class FaultProfile:
+    """Degradations of a link: latency distribution, latency spikes, dropped requests, connection resets and
+    malformed answers, drawn independently for each frame
+
+    :param latency: one-way added latency of the answers in s (the median for 'lognormal')
+    :param jitter: spread of the latency in s ('uniform': half width, 'exponential': mean added to latency,
+     'lognormal': sigma of the log)
+    :param distribution: 'constant', 'uniform', 'exponential' or 'lognormal'
+    :param spike_probability: probability of an answer being delayed by spike_latency more
+    :param spike_latency: duration of a latency spike in s
+    :param drop_probability: probability of a request being lost (never reaching the device)
+    :param reset_probability: probability of a request resetting the connection instead of being forwarded
+    :param malformed_probability: probability of an answer being corrupted (function code, byte count or
+     transaction ID)
+    :param seed: of the random generator, for reproducible scenarios
+    """
+    def __init__(self, latency: float = 0., jitter: float = 0., distribution: str = 'constant',
+                 spike_probability: float = 0., spike_latency: float = 0., drop_probability: float = 0.,
+                 reset_probability: float = 0., malformed_probability: float = 0., seed: int = None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f'unknown latency distribution {distribution}, available: {DISTRIBUTIONS}')
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.spike_probability = spike_probability
+        self.spike_latency = spike_latency
+        self.drop_probability = drop_probability
+        self.reset_probability = reset_probability
+        self.malformed_probability = malformed_probability
+        self.random = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        """Latency added to an answer in s, without the spikes"""
+        if self.distribution == 'uniform':
+            latency = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        elif self.distribution == 'exponential':
+            latency = self.latency + (self.random.expovariate(1 / self.jitter) if self.jitter else 0.)
+        elif self.distribution == 'lognormal':
+            latency = self.latency * self.random.lognormvariate(0., self.jitter)
+        else:
+            latency = self.latency
+        return max(latency, 0.)
+
+    def happens(self, probability: float) -> bool:
+        return bool(probability) and self.random.random() < probability
+
+    def corrupt(self, frame: bytes) -> bytes:
+        """Modbus TCP frame damaged in one of the ways of CORRUPTIONS"""
+        frame = bytearray(frame)
+        kind = self.random.choice(CORRUPTIONS)
+        if kind == 'function_code':
+            frame[7] = 0x2B  # encapsulated interface transport, never requested by the driver
+        elif kind == 'byte_count' and len(frame) > 8:
+            frame[8] = (frame[8] + 3) & 0xFF
+        else:
+            frame[0] ^= 0x80
+        return bytes(frame)
+
+    def __repr__(self):
+        return (f'FaultProfile(latency={self.latency}, jitter={self.jitter}, distribution={self.distribution!r}, '
+                f'spike_probability={self.spike_probability}, spike_latency={self.spike_latency}, '
+                f'drop_probability={self.drop_probability}, reset_probability={self.reset_probability}, '
+                f'malformed_probability={self.malformed_probability})')
+
+
+# scenario name: keyword arguments of FaultProfile
+SCENARIOS = {'clean': dict(),
+             'vpn': dict(latency=0.02, jitter=0.5, distribution='lognormal'),
+             'spikes': dict(latency=0.005, spike_probability=0.02, spike_latency=1.),
+             'lossy': dict(latency=0.005, jitter=0.005, distribution='exponential', drop_probability=0.02),
+             'resets': dict(latency=0.005, reset_probability=0.01),
+             'garbage': dict(latency=0.005, malformed_probability=0.02),
+             }
+
+
+def _frames(connection, buffer: bytearray):
+    """Modbus TCP frames received on connection, until it is closed"""
+    while True:
+        while len(buffer) >= 7:
+            length = struct.unpack_from('>H', buffer, 4)[0]
+            if len(buffer) < 6 + length:
+                break
+            frame = bytes(buffer[:6 + length])
+            del buffer[:6 + length]
+            yield frame
+        chunk = connection.recv(4096)
+        if not chunk:
+            return
+        buffer += chunk
+
+
+class FaultyProxy:
+    """Modbus TCP proxy degrading the link between a client and a device according to a FaultProfile
+
+    The proxy listens on a local port and opens a connection to the device for each client connection, so that any
+    client (pymodbus or the transports) can be benchmarked unchanged. Faults are applied frame by frame: dropped and
+    resetting requests are decided on the way to the device, latency and corruption on the way back. Answers keep
+    their order, as on a TCP link. Counts of the injected faults are kept in self.injected.
+
+    :param upstream_host: hostname or ip address of the device
+    :param upstream_port: its TCP port
+    :param profile: faults to inject
+    :param host: listening address
+    :param port: listening port, 0 for any free port (then read from self.port)
+    """
+    def __init__(self, upstream_host, upstream_port: int = 502, profile: FaultProfile = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.upstream = (upstream_host, upstream_port)
+        self.profile = profile if profile is not None else FaultProfile()
+        self.injected = dict(spikes=0, drops=0, resets=0, malformed=0)
+        self.listener = socket.create_server((host, port))
+        self.host, self.port = self.listener.getsockname()[:2]
+        self.running = True
+        self._connections = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True, name='FaultyProxy').start()
+
+    def close(self):
+        self.running = False
+        self.listener.close()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            self._shutdown(connection)
+
+    @staticmethod
+    def _shutdown(connection):
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        connection.close()
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            try:
+                device = socket.create_connection(self.upstream)
+            except OSError as e:
+                logger.warning(f'cannot reach {self.upstream[0]}:{self.upstream[1]}: {e}')
+                client.close()
+                continue
+            for connection in (client, device):
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self._connections.extend((client, device))
+            answers = queue.Queue()
+            threading.Thread(target=self._forward_requests, args=(client, device), daemon=True).start()
+            threading.Thread(target=self._delay_answers, args=(device, answers), daemon=True).start()
+            threading.Thread(target=self._send_answers, args=(client, device, answers), daemon=True).start()
+
+    def _reset(self, client, device):
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))  # RST instead of FIN
+        client.close()
+        self._shutdown(device)
+
+    def _forward_requests(self, client, device):
+        profile = self.profile
+        try:
+            for frame in _frames(client, bytearray()):
+                if profile.happens(profile.reset_probability):
+                    self.injected['resets'] += 1
+                    self._reset(client, device)
+                    return
+                if profile.happens(profile.drop_probability):
+                    self.injected['drops'] += 1
+                    continue
+                device.sendall(frame)
+        except OSError:
+            pass
+        self._shutdown(device)
+
+    def _delay_answers(self, device, answers):
+        profile = self.profile
+        due = 0.
+        try:
+            for frame in _frames(device, bytearray()):
+                latency = profile.sample_latency()
+                if profile.happens(profile.spike_probability):
+                    self.injected['spikes'] += 1
+                    latency += profile.spike_latency
+                if profile.happens(profile.malformed_probability):
+                    self.injected['malformed'] += 1
+                    frame = profile.corrupt(frame)
+                due = max(due, time.perf_counter() + latency)  # answers keep their order
+                answers.put((due, frame))
+        except OSError:
+            pass
+        answers.put(None)
+
+    def _send_answers(self, client, device, answers):
+        while True:
+            item = answers.get()
+            if item is None:
+                break
+            due, frame = item
+            time.sleep(max(0., due - time.perf_counter()))
+            try:
+                client.sendall(frame)
+            except OSError:
+                break
+        self._shutdown(client)
+        with self._lock:
+            self._connections = [connection for connection in self._connections
+                                 if connection not in (client, device)]
+
+
+def benchmark(driver, duration: float = 10., interval: float = 0.) -> dict:
+    """Poll driver.get_snapshot for duration seconds and measure how the driver copes with the link
+
+    :param driver: CellKraftE1500Drivers, already initialized
+    :param duration: seconds of polling
+    :param interval: seconds between the end of a poll and the next one
+    :return: dict with
+     polls, failures: number of snapshots attempted and failed,
+     poll_rate: successful snapshots per second,
+     stall_time: seconds spent in failed snapshots,
+     max_gap: longest time between two successful snapshots (including the start and the end of the run),
+     outages: number of runs of consecutive failures,
+     recovery_time: mean and max seconds from the first failure of an outage to the next successful snapshot,
+     latency_ms: p50, p99 and max duration of the successful snapshots
+    """
+    polls = failures = 0
+    stall_time = max_gap = 0.
+    recoveries = []
+    latencies = []
+    outage_start = None
+    start = last_success = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        polls += 1
+        poll_start = time.perf_counter()
+        try:
+            driver.get_snapshot()
+        except Exception as e:
+            failures += 1
+            stall_time += time.perf_counter() - poll_start
+            if outage_start is None:
+                outage_start = poll_start
+                logger.debug(f'snapshot failed: {e!r}')
+        else:
+            now = time.perf_counter()
+            latencies.append(now - poll_start)
+            max_gap = max(max_gap, now - last_success)
+            last_success = now
+            if outage_start is not None:
+                recoveries.append(now - outage_start)
+                outage_start = None
+        if interval:
+            time.sleep(interval)
+    end = time.perf_counter()
+    max_gap = max(max_gap, end - last_success)
+    if outage_start is not None:  # still failing at the end: counted as a recovery lasting until the end
+        recoveries.append(end - outage_start)
+    latencies.sort()
+
+    def percentile(percent):
+        return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)] * 1e3 if latencies else 0.
+    return dict(polls=polls, failures=failures, poll_rate=(polls - failures) / (end - start),
+                stall_time=stall_time, max_gap=max_gap, outages=len(recoveries),
+                recovery_time=dict(mean=sum(recoveries) / len(recoveries) if recoveries else 0.,
+                                   max=max(recoveries, default=0.)),
+                latency_ms=dict(p50=percentile(50), p99=percentile(99), max=percentile(100)))
+
+
+def run_scenario(host, port: int = 502, profile: FaultProfile = None, duration: float = 10., timeout: float = None,
+                 pipeline_window: int = 1, interval: float = 0.) -> dict:
+    """Benchmark a driver talking to the device through a FaultyProxy
+
+    :param host: hostname or ip address of the device (or of an emulator)
+    :param port: its TCP port
+    :param profile: faults to inject, a clean link if None
+    :param duration: seconds of polling
+    :param timeout: timeout of the requests in s, None for the default pymodbus client
+    :param pipeline_window: requests in flight (a transport is used instead of pymodbus if > 1)
+    :param interval: seconds between the end of a poll and the next one
+    :return: see benchmark, with the counts of the injected faults under "injected"
+    """
+    from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers
+    proxy = FaultyProxy(host, port, profile)
+    options = {} if timeout is None else dict(timeout=timeout)
+    driver = CellKraftE1500Drivers(proxy.host, port=proxy.port, pipeline_window=pipeline_window, **options)
+    try:
+        driver.init_hardware()
+        result = benchmark(driver, duration, interval)
+    finally:
+        driver.close()
+        proxy.close()
+    result['injected'] = dict(proxy.injected)
+    return result
+
+
+def format_result(name: str, result: dict) -> str:
+    return (f'{name:>20s}: {result["poll_rate"]:6.1f} Hz, {result["failures"]:4d}/{result["polls"]:<5d} failed, '
+            f'stalled {result["stall_time"]:6.2f} s (max gap {result["max_gap"]:5.2f} s), '
+            f'{result["outages"]:3d} outages recovered in {result["recovery_time"]["mean"]:5.2f} s '
+            f'(max {result["recovery_time"]["max"]:5.2f} s), p99 {result["latency_ms"]["p99"]:7.1f} ms')
+
+
+def main():
+    """Benchmark the driver through a degraded link:
+    python -m pymodaq_plugins_cellkraft.hardware.faults host [port] --scenario lossy --timeout 0.2 0.5 1"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('host', help='hostname or ip address of the generator (or of an emulator)')
+    parser.add_argument('port', nargs='?', type=int, default=502, help='Modbus TCP port')
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--timeout', nargs='+', type=float, default=[None], help='request timeouts in s to compare')
+    parser.add_argument('--window', type=int, default=1, help='pipeline window')
+    parser.add_argument('--duration', type=float, default=10., help='seconds of polling per run')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the injected faults')
+    args = parser.parse_args()
+
+    for scenario in args.scenario:
+        for timeout in args.timeout:
+            result = run_scenario(args.host, args.port, FaultProfile(**SCENARIOS[scenario], seed=args.seed),
+                                  duration=args.duration, timeout=timeout, pipeline_window=args.window)
+            print(format_result(f'{scenario} (timeout {timeout or "default"})', result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+from pathlib import Path
+import itertools
+import json
+import queue
+import socket
+import socketserver
+import threading
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+ROLES = ('read', 'write')
+
+
+def _is_unix(address: str) -> bool:
+    return '/' in address or address.startswith('unix:')
+
+
+def _unix_path(address: str) -> str:
+    return address[len('unix:'):] if address.startswith('unix:') else address
+
+
+def _tcp_address(address: str):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class _Session(socketserver.StreamRequestHandler):
+    """One client of the gateway: JSON requests, one per line, answered in order, and pushed snapshots"""
+
+    def setup(self):
+        super().setup()
+        self.gateway: GatewayServer = self.server.gateway
+        self.role = self.gateway.anonymous
+        self.snapshots = None  # queue of the snapshots to push, once subscribed
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message: dict):
+        data = (json.dumps(message) + '\n').encode()
+        with self.send_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def offer(self, snapshot: dict):
+        """Queue a snapshot for this client, the oldest one being dropped if the client does not keep up"""
+        snapshots = self.snapshots
+        while snapshots is not None:
+            try:
+                snapshots.put_nowait(snapshot)
+                return
+            except queue.Full:
+                try:
+                    snapshots.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def push(self, snapshots: queue.Queue):
+        while not self.closed:
+            snapshot = snapshots.get()
+            if snapshot is None:
+                return
+            try:
+                self.send(dict(type='snapshot', snapshot=snapshot))
+            except OSError:
+                return
+
+    def handle(self):
+        self.gateway.sessions.add(self)
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                request = {}
+                try:
+                    request = json.loads(line)
+                    reply = self.gateway.answer(self, request)
+                except Exception as e:
+                    reply = dict(ok=False, error=f'{type(e).__name__}: {e}')
+                reply.update(type='reply', id=request.get('id') if isinstance(request, dict) else None)
+                self.send(reply)
+        except (OSError, ValueError):
+            pass
+
+    def finish(self):
+        self.closed = True
+        self.gateway.sessions.discard(self)
+        self.offer(None)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128  # many clients may connect at once
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+
+class GatewayServer:
+    """Local service sharing one connection to a generator between any number of clients
+
+    The gateway polls the generator through the SnapshotStream of its driver, so the generator sees one session and
+    one snapshot per interval whatever the number of clients. Clients connect on a TCP port or a Unix socket and
+    send JSON requests, one per line, each answered by a line {"type": "reply", "id": id of the request, "ok": ...}:
+
+    * {"op": "hello", "token": "..."}: authenticate, the token giving a role ("read" or "write")
+    * {"op": "snapshot"}: latest snapshot, from the cache (no request to the generator)
+    * {"op": "subscribe"} / {"op": "unsubscribe"}: start or stop pushing {"type": "snapshot", "snapshot": ...} lines
+      after each snapshot, a slow client only missing snapshots
+    * {"op": "write", "setpoints": {register name: value}}: "write" role only, checked then written as a whole by
+      CellKraftE1500Drivers.write_setpoints, the writes of all the clients being serialized by the stream
+    * {"op": "stats"}: request statistics of the driver and number of clients
+
+    :param driver: CellKraftE1500Drivers, initialized
+    :param address: "host:port" for TCP, or path of a Unix socket ("unix:path" or any path containing a "/")
+    :param interval: seconds between two snapshots
+    :param tokens: {token: role}
+    :param anonymous: role of the clients that did not authenticate, None to accept only "hello" from them
+    :param backlog: snapshots queued per subscribed client before dropping the oldest ones
+    """
+    def __init__(self, driver, address: str = '127.0.0.1:5020', interval: float = 1., tokens: dict = None,
+                 anonymous: str = 'read', backlog: int = 16):
+        for role in list((tokens or {}).values()) + ([anonymous] if anonymous is not None else []):
+            if role not in ROLES:
+                raise ValueError(f'unknown role {role}, available: {ROLES}')
+        self.driver = driver
+        self.address = address
+        self.interval = interval
+        self.tokens = dict(tokens or {})
+        self.anonymous = anonymous
+        self.backlog = backlog
+        self.write_timeout = 30.  # seconds to wait for a write to be executed by the stream
+        self.sessions = set()
+        self.stream = None
+        self.latest: dict = None
+        if _is_unix(address):
+            path = Path(_unix_path(address))
+            if path.is_socket():
+                path.unlink()  # left by a previous run
+            self.server = _UnixServer(str(path), _Session)
+        else:
+            self.server = _TcpServer(_tcp_address(address), _Session)
+        self.server.gateway = self
+        self._thread: threading.Thread = None
+
+    @property
+    def port(self) -> int:
+        """TCP port actually listened to (useful with port 0)"""
+        return self.server.server_address[1]
+
+    def start(self):
+        self.stream = self.driver.start_stream(self.interval)
+        self.stream.subscribe(self._publish)
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True,
+                                        name='gateway')
+        self._thread.start()
+        logger.info(f'gateway of {self.driver.host} listening on {self.address}')
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.unsubscribe(self._publish)
+        self.server.shutdown()
+        self.server.server_close()
+        for session in list(self.sessions):
+            try:
+                session.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if _is_unix(self.address):
+            Path(_unix_path(self.address)).unlink(missing_ok=True)
+
+    def _publish(self, snapshot: dict):
+        self.latest = snapshot
+        for session in list(self.sessions):
+            if session.snapshots is not None:
+                session.offer(snapshot)
+
+    def answer(self, session: _Session, request: dict) -> dict:
+        """Reply to a request of a client"""
+        op = request.get('op')
+        if op == 'hello':
+            session.role = self.tokens.get(request.get('token'), self.anonymous)
+            return dict(ok=session.role is not None, role=session.role)
+        if session.role is None:
+            return dict(ok=False, error='authentication required')
+        if op == 'snapshot':
+            if self.latest is None:
+                return dict(ok=False, error='no snapshot yet')
+            return dict(ok=True, snapshot=self.latest)
+        if op == 'subscribe':
+            if session.snapshots is None:
+                session.snapshots = queue.Queue(self.backlog)
+                threading.Thread(target=session.push, args=(session.snapshots,), daemon=True).start()
+            return dict(ok=True)
+        if op == 'unsubscribe':
+            if session.snapshots is not None:
+                session.offer(None)
+                session.snapshots = None
+            return dict(ok=True)
+        if op == 'write':
+            if session.role != 'write':
+                return dict(ok=False, error='write access denied')
+            snapshot = self.stream.submit(self.driver.write_setpoints, request['setpoints']).result(self.write_timeout)
+            return dict(ok=True, snapshot=snapshot)
+        if op == 'stats':
+            return dict(ok=True, stats=self.driver.get_stats(), clients=len(self.sessions))
+        return dict(ok=False, error=f'unknown op {op}')
+
+
+class GatewayClient:
+    """Client of a GatewayServer
+
+    :param address: "host:port" or path of the Unix socket, as given to the server
+    :param token: authentication token, None to stay anonymous
+    :param timeout: seconds to wait for a reply
+    """
+    def __init__(self, address: str = '127.0.0.1:5020', token: str = None, timeout: float = 10.):
+        if _is_unix(address):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(_unix_path(address))
+        else:
+            self.socket = socket.create_connection(_tcp_address(address), timeout=timeout)
+        self.file = self.socket.makefile('rb')
+        self.pushed = queue.SimpleQueue()  # snapshots received while waiting for a reply
+        self._ids = itertools.count()
+        if token is not None:
+            self.request('hello', token=token)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def _receive(self) -> dict:
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('connection closed by the gateway')
+        return json.loads(line)
+
+    def request(self, op: str, **arguments) -> dict:
+        """Send a request and return its reply, raising IOError if it failed"""
+        request_id = next(self._ids)
+        self.socket.sendall((json.dumps(dict(op=op, id=request_id, **arguments)) + '\n').encode())
+        while True:
+            message = self._receive()
+            if message.get('type') == 'snapshot':
+                self.pushed.put(message['snapshot'])
+            elif message.get('id') == request_id:
+                if not message.get('ok'):
+                    raise IOError(message.get('error', f'{op} failed'))
+                return message
+
+    def snapshot(self) -> dict:
+        return self.request('snapshot')['snapshot']
+
+    def write(self, setpoints: dict) -> dict:
+        """Write setpoints through the gateway, return the snapshot taken after the write"""
+        return self.request('write', setpoints=setpoints)['snapshot']
+
+    def stats(self) -> dict:
+        return self.request('stats')
+
+    def subscribe(self):
+        """Subscribe now and return an iterator over the snapshots pushed by the gateway"""
+        self.request('subscribe')
+        return self._pushed_snapshots()
+
+    def _pushed_snapshots(self):
+        while True:
+            while not self.pushed.empty():
+                yield self.pushed.get()
+            message = self._receive()
+            if message.get('type') == 'snapshot':
+                yield message['snapshot']
+
+
+def main():
+    """Share a generator between local clients: python -m pymodaq_plugins_cellkraft.hardware.gateway host
+    --listen 127.0.0.1:5020 --token secret=write"""
+    import argparse
+    import logging
+    import signal
+    from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('host', help='hostname or ip address of the generator')
+    parser.add_argument('--port', type=int, default=502, help='Modbus TCP port of the generator')
+    parser.add_argument('--listen', default='127.0.0.1:5020', help='host:port or path of a Unix socket')
+    parser.add_argument('--interval', type=float, default=1., help='seconds between two snapshots')
+    parser.add_argument('--token', action='append', default=[], help='token=role, role being read or write')
+    parser.add_argument('--anonymous', default='read', help='role without token: read, write or none')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    driver = CellKraftE1500Drivers(args.host, port=args.port)
+    driver.init_hardware()
+    gateway = GatewayServer(driver, args.listen, interval=args.interval,
+                            tokens=dict(token.split('=', 1) for token in args.token),
+                            anonymous=None if args.anonymous == 'none' else args.anonymous)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    gateway.start()
+    try:
+        stop_event.wait()
+    finally:
+        gateway.stop()
+        driver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.stats import FUNCTION_CODES
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def prometheus_text(driver) -> str:
+    """Metrics of a CellKraftE1500Drivers in the Prometheus text exposition format
+
+    Only the in-memory state of the driver is used (latest readbacks, request statistics, connection flag): building
+    the text never sends a Modbus request.
+    """
+    host = str(driver.host)
+    stats = driver.instr.stats
+    names = stats.register_names
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{_labels(host=host, **labels)} {value!r}' for labels, value in samples)
+
+    last_values = list(driver.last_values.items())
+    metric('cellkraft_process_value', 'gauge', 'Latest value read back from the generator, in physical units',
+           [(dict(channel=channel), float(value)) for channel, (_, value) in last_values])
+    metric('cellkraft_process_value_timestamp_seconds', 'gauge', 'Unix time of the latest readback',
+           [(dict(channel=channel), float(timestamp)) for channel, (timestamp, _) in last_values])
+    metric('cellkraft_poll_rate_hertz', 'gauge', 'Rate of the latest snapshots', [({}, float(driver.poll_rate))])
+    metric('cellkraft_connected', 'gauge', '1 if the Modbus connection is up',
+           [({}, int(bool(driver.instr.connected)))])
+    metric('cellkraft_suppressed_writes_total', 'counter', 'Setpoint writes skipped as the value was unchanged',
+           [({}, driver.suppressed_writes)])
+
+    registers = [(dict(function=FUNCTION_CODES.get(code, str(code)), register=names.get(register, register)), entry)
+                 for (code, register), entry in sorted(list(stats.registers.items()))]
+    for counter, help_text in (('calls', 'Modbus requests'), ('errors', 'Failed Modbus requests'),
+                               ('timeouts', 'Modbus requests without answer'), ('retries', 'Modbus request retries')):
+        name = 'requests' if counter == 'calls' else counter
+        metric(f'cellkraft_modbus_{name}_total', 'counter', help_text,
+               [(labels, getattr(entry, counter)) for labels, entry in registers])
+
+    name = 'cellkraft_modbus_latency_seconds'
+    lines.append(f'# HELP {name} Modbus request round-trip time')
+    lines.append(f'# TYPE {name} summary')
+    for labels, entry in registers:
+        histogram = entry.latency
+        for quantile in QUANTILES:
+            lines.append(f'{name}{_labels(host=host, **labels, quantile=quantile)} '
+                         f'{histogram.percentile(quantile * 100) / 1e9!r}')
+        lines.append(f'{name}_sum{_labels(host=host, **labels)} {histogram.total / 1e9!r}')
+        lines.append(f'{name}_count{_labels(host=host, **labels)} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP endpoint serving prometheus_text(driver) on /metrics, from a daemon thread
+
+    Bound to localhost by default: meant to be scraped by a Prometheus agent running on the same computer.
+
+    :param driver: a CellKraftE1500Drivers
+    :param port: TCP port, 9464 by default (0 to pick a free one, see self.port once started)
+    :param host: interface to listen on
+    """
+    def __init__(self, driver, port: int = 9464, host: str = '127.0.0.1'):
+        self.driver = driver
+        self.host = host
+        self.port = port
+        self.server: ThreadingHTTPServer = None
+        self.thread: threading.Thread = None
+
+    def start(self):
+        driver = self.driver
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = prometheus_text(driver).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='cellkraft-metrics', daemon=True)
+        self.thread.start()
+        logger.info(f'metrics of {driver.host} served on http://{self.host}:{self.port}/metrics')
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main():
+    """Poll a generator and serve its metrics: python -m pymodaq_plugins_cellkraft.hardware.metrics host [port]"""
+    import argparse
+    from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('host', help='hostname or ip address of the generator')
+    parser.add_argument('port', nargs='?', type=int, default=9464, help='port of the metrics endpoint')
+    parser.add_argument('--interval', type=float, default=1., help='polling interval in s')
+    args = parser.parse_args()
+
+    driver = CellKraftE1500Drivers(args.host)
+    driver.init_hardware()
+    driver.start_metrics_server(args.port)
+    try:
+        while True:
+            try:
+                driver.get_snapshot()
+            except Exception as e:  # pymodbus reconnects on the next request
+                logger.warning(f'snapshot failed: {e}')
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        driver.close()
+
+
+if __name__ == '__main__':
+    main()
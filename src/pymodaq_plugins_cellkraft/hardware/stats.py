@@ -0,0 +1,218 @@
+from pathlib import Path
+import math
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+# Modbus function codes used by SyncModBusInstrument
+FUNCTION_CODES = {4: 'read_input_registers',
+                  6: 'write_register',
+                  16: 'write_registers',
+                  }
+
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) histogram of durations in nanoseconds
+
+    Values below 2**sub_bits ns get their own bucket, above that each power of two is split in 2**(sub_bits - 1)
+    buckets, so that any value is known within a relative error of 2**(1 - sub_bits) (3 % with the default) whatever
+    its magnitude, with a few hundred buckets at most from ns to hours. Recording is a couple of integer operations
+    and a dict increment.
+
+    :param sub_bits: precision of the buckets, see above
+    """
+    def __init__(self, sub_bits: int = 6):
+        self.sub_bits = sub_bits
+        self._half = 1 << (sub_bits - 1)
+        self.counts = {}  # {bucket index: count}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def reset(self):
+        self.counts.clear()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value: int) -> int:
+        """Index of the bucket holding value"""
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return shift * self._half + (value >> shift)
+
+    def bucket_bounds(self, index: int):
+        """(lowest, highest) values held by the bucket index"""
+        if index < 2 * self._half:
+            return index, index
+        shift = index // self._half - 1
+        mantissa = index % self._half + self._half
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int):
+        """Add a duration in ns"""
+        shift = value.bit_length() - self.sub_bits
+        index = value if shift <= 0 else shift * self._half + (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Add the content of another histogram of the same precision"""
+        if other.sub_bits != self.sub_bits:
+            raise ValueError('cannot merge histograms of different precisions')
+        for index, count in list(other.counts.items()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    def percentile(self, percent: float) -> float:
+        """Value below which percent % of the recorded durations are (upper bound of the bucket), in ns"""
+        if not self.count:
+            return math.nan
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        cumulated = 0
+        for index, count in sorted(list(self.counts.items())):  # copied first, may be read from another thread
+            cumulated += count
+            if cumulated >= rank:
+                return min(self.bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)) -> dict:
+        """count, min, mean, percentiles and max, durations in ms"""
+        summary = dict(count=self.count,
+                       min=self.min / 1e6 if self.count else math.nan,
+                       mean=self.mean / 1e6)
+        for percent in percentiles:
+            summary[f'p{percent:g}'] = self.percentile(percent) / 1e6
+        summary['max'] = self.max / 1e6 if self.count else math.nan
+        return summary
+
+
+class RequestStats:
+    """Counters and latency histogram of one kind of request (a function code or a register)"""
+    __slots__ = ('calls', 'errors', 'timeouts', 'retries', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.latency = LatencyHistogram()
+
+    def merge(self, other: 'RequestStats'):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.timeouts += other.timeouts
+        self.retries += other.retries
+        self.latency.merge(other.latency)
+
+    def as_dict(self) -> dict:
+        return dict(calls=self.calls, errors=self.errors, timeouts=self.timeouts, retries=self.retries,
+                    latency_ms=self.latency.summary())
+
+
+class ModbusStats:
+    """Per (function code, register) statistics of the Modbus requests of an instrument
+
+    Only the (function code, register) entries are updated on each request; the per function code figures are
+    merged from them when asked for. If log_interval is set, a summary is logged (through the package logger) at
+    most every log_interval seconds, from the request that happens to cross the deadline: there is no timer.
+
+    :param log_interval: seconds between two summaries in the log, None or 0 to disable
+    :param name: prefix of the log lines, typically the host
+    :param register_names: {register: name} used to label the registers in the summaries
+    """
+    def __init__(self, log_interval: float = 600., name: str = '', register_names: dict = None):
+        self.name = name
+        self.register_names = {} if register_names is None else register_names
+        self.registers = {}  # {(function code, first register): RequestStats}
+        self.started = time.time()
+        self._next_log = None
+        self.log_interval = log_interval
+
+    @property
+    def log_interval(self):
+        return self._log_interval
+
+    @log_interval.setter
+    def log_interval(self, interval: float):
+        self._log_interval = interval
+        self._next_log = time.perf_counter_ns() + int(interval * 1e9) if interval else None
+
+    def reset(self):
+        self.registers = {}
+        self.started = time.time()
+        self.log_interval = self._log_interval
+
+    def record(self, function_code: int, register: int, start: int, end: int, error: bool = False,
+               timeout: bool = False, retries: int = 0):
+        """Account for a request
+
+        :param function_code: Modbus function code of the request
+        :param register: (first) register of the request
+        :param start: time.perf_counter_ns() before sending the request
+        :param end: time.perf_counter_ns() once the answer (or the failure) is received
+        :param error: True if the request failed, or the device answered with an exception response
+        :param timeout: True if the device did not answer
+        :param retries: number of times the request has been resent
+        """
+        stats = self.registers.get((function_code, register))
+        if stats is None:
+            stats = self.registers[(function_code, register)] = RequestStats()
+        stats.calls += 1
+        stats.latency.record(end - start)
+        if error or timeout or retries:
+            stats.errors += error
+            stats.timeouts += timeout
+            stats.retries += retries
+        if self._next_log is not None and end >= self._next_log:
+            self._next_log = end + int(self._log_interval * 1e9)
+            self.log()
+
+    def by_function_code(self) -> dict:
+        """{function code: RequestStats} merged over all the registers"""
+        merged = {}
+        for (function_code, _), stats in list(self.registers.items()):
+            merged.setdefault(function_code, RequestStats()).merge(stats)
+        return merged
+
+    def as_dict(self, register_names: dict = None) -> dict:
+        """Statistics as plain python objects (json serializable), latencies in ms
+
+        :param register_names: {register: name} used to label the registers, defaults to self.register_names
+        :return: dict with the keys "since" (timestamp of the last reset), "function_codes" and "registers"
+        """
+        register_names = self.register_names if register_names is None else register_names
+        return dict(since=self.started,
+                    function_codes={FUNCTION_CODES.get(code, str(code)): stats.as_dict()
+                                    for code, stats in sorted(self.by_function_code().items())},
+                    registers={f'{FUNCTION_CODES.get(code, str(code))}/{register_names.get(register, register)}':
+                               stats.as_dict() for (code, register), stats in sorted(list(self.registers.items()))},
+                    )
+
+    def log(self, register_names: dict = None):
+        """Log a one line summary per function code and per register"""
+        stats = self.as_dict(register_names)
+        prefix = f'{self.name} ' if self.name else ''
+        for group in ('function_codes', 'registers'):
+            for key, entry in stats[group].items():
+                latency = entry['latency_ms']
+                logger.info(f"{prefix}{key}: {entry['calls']} calls, {entry['errors']} errors, "
+                            f"{entry['timeouts']} timeouts, {entry['retries']} retries, latency (ms) "
+                            f"p50 {latency['p50']:.2f} p99 {latency['p99']:.2f} max {latency['max']:.2f}")
@@ -1,54 +1,255 @@
-from pymodbus.client import ModbusTcpClient
-from pymodaq.utils.logger import set_logger, get_module_name
-logger = set_logger(get_module_name(__file__))
+from pathlib import Path
+import threading
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.stats import ModbusStats, FUNCTION_CODES
+from pymodaq_plugins_cellkraft.hardware.tracing import tracer
+from pymodaq_plugins_cellkraft.hardware.transports import Transport, RecordingTransport, make_transport, \
+    READ_INPUT_REGISTERS, WRITE_REGISTER, WRITE_REGISTERS
 
 
 class SyncModBusInstrument:
-    """
+    """Synchronous Modbus instrument
+
+    Every request is timed and accounted for in self.stats (see ModbusStats), per function code and register.
 
+    The device is reached through pymodbus' TCP client by default, or through one of the transports of
+    hardware.transports: 'tcp' with pipeline_window > 1 (the requests of execute_batch are then pipelined, see
+    TcpTransport), 'rtu' (serial line, host being the serial device), 'rtu_over_tcp' (serial gateway) or 'replay'
+    (host being a file recorded with start_recording, see ReplayTransport).
+
+    With heartbeat_interval > 0, a background thread reads heartbeat_register whenever no request has been sent for
+    that long, so that a TCP session silently dropped by a firewall or by the controller during a pause is detected
+    and reopened before the next real request instead of making it time out. The requests are serialized by a lock
+    shared with the heartbeat, which is skipped while a request is in progress. Heartbeats are not accounted
+    for in self.stats but in self.heartbeats and self.reconnects.
+
+    :param host: hostname or ip address, or serial device for the 'rtu' transport
+    :param port: TCP port
+    :param stats_interval: seconds between two statistics summaries in the log
+    :param pipeline_window: requests in flight for the 'tcp' transport
+    :param transport: 'tcp', 'rtu', 'rtu_over_tcp' or 'replay'
+    :param heartbeat_interval: idle seconds before a heartbeat, 0 to disable
+    :param heartbeat_register: input register read by the heartbeat
+    :param transport_options: keyword arguments of the transport (unit, timeout, baudrate, parity...)
     """
-    def __init__(self, host, port = 502):
+    def __init__(self, host, port = 502, stats_interval: float = 600., pipeline_window: int = 1,
+                 transport: str = 'tcp', heartbeat_interval: float = 0., heartbeat_register: int = 0,
+                 **transport_options):
         self.connected = False
         self.host = host
         self.port = port
         self.precision = 1
-        self.modbus = ModbusTcpClient(self.host)
+        self.pipeline_window = pipeline_window
+        if transport == 'tcp' and pipeline_window == 1 and not transport_options:
+            from pymodbus.client import ModbusTcpClient  # imported on first use, see pymodaq_plugins_cellkraft.__init__
+            self.modbus = ModbusTcpClient(self.host, port=self.port)
+        else:
+            self.modbus = make_transport(transport, host, port=port, window=pipeline_window, **transport_options)
+        from pymodbus.exceptions import ModbusIOException
         self.registerdict = {}
+        self.stats = ModbusStats(log_interval=stats_interval, name=str(host))
+        self._timeout_errors = (ModbusIOException, TimeoutError)
+        self._lock = threading.RLock()
+        self._last_activity = time.perf_counter()
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_register = heartbeat_register
+        self.heartbeats = 0  # heartbeat requests sent
+        self.reconnects = 0  # connections reopened after a failed heartbeat
+        self._heartbeat_thread: threading.Thread = None
+        self._heartbeat_stop = threading.Event()
+
+    def _request(self, function_code, register, method, *args, **kwargs):
+        """Send a request through the pymodbus client method and account for it in self.stats (and the tracer)"""
+        if tracer.enabled:
+            with tracer.span(f'modbus.{FUNCTION_CODES[function_code]}', register=register):
+                return self._send(function_code, register, method, *args, **kwargs)
+        return self._send(function_code, register, method, *args, **kwargs)
+
+    def _send(self, function_code, register, method, *args, **kwargs):
+        with self._lock:
+            start = time.perf_counter_ns()
+            try:
+                result = method(*args, **kwargs)
+            except self._timeout_errors:
+                self.stats.record(function_code, register, start, time.perf_counter_ns(), timeout=True)
+                self.connected = False
+                raise
+            except Exception:
+                self.stats.record(function_code, register, start, time.perf_counter_ns(), error=True)
+                self.connected = False
+                raise
+            finally:
+                self._last_activity = time.perf_counter()
+        self.connected = True
+        self.stats.record(function_code, register, start, time.perf_counter_ns(),
+                          error=isinstance(result, Exception) or (result is not None and result.isError()),
+                          retries=getattr(result, 'retries', 0))
+        return result
 
     def close(self):
         """End the connection
         """
-        self.modbus.close()
+        self.stop_heartbeat()
+        with self._lock:
+            self.modbus.close()
         self.connected = False
 
+    def start_heartbeat(self, interval: float = None, register: int = None):
+        """Read a register whenever the connection has been idle for interval seconds, reconnecting if it fails
+
+        :param interval: idle seconds before a heartbeat, self.heartbeat_interval if None
+        :param register: input register to read, self.heartbeat_register if None
+        """
+        self.stop_heartbeat()
+        if interval is not None:
+            self.heartbeat_interval = interval
+        if register is not None:
+            self.heartbeat_register = register
+        if self.heartbeat_interval <= 0:
+            return
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True,
+                                                  name=f'heartbeat {self.host}')
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        if self._heartbeat_thread is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def _heartbeat_loop(self):
+        while not self._heartbeat_stop.wait(max(self._last_activity + self.heartbeat_interval - time.perf_counter(),
+                                                0.)):
+            if time.perf_counter() - self._last_activity < self.heartbeat_interval:
+                continue  # a request has been sent meanwhile
+            if not self._lock.acquire(blocking=False):
+                continue  # a request is in progress, the connection is not idle
+            try:
+                self._heartbeat()
+            finally:
+                self._last_activity = time.perf_counter()
+                self._lock.release()
+
+    def _heartbeat(self):
+        """Read self.heartbeat_register, reopen the connection if no answer comes (called with the lock held)"""
+        self.heartbeats += 1
+        try:
+            result = self.modbus.read_input_registers(self.heartbeat_register, count=1)
+            alive = not isinstance(result, Exception)  # an exception response still comes from a live device
+        except Exception as e:
+            logger.debug(f'heartbeat of {self.host} failed: {e!r}')
+            alive = False
+        if alive:
+            self.connected = True
+            return
+        logger.info(f'connection to {self.host} lost while idle, reconnecting')
+        self.modbus.close()
+        try:
+            self.connected = bool(self.modbus.connect())
+        except Exception as e:
+            logger.warning(f'cannot reconnect to {self.host}: {e!r}')
+            self.connected = False
+        if self.connected:
+            self.reconnects += 1
+
     def write(self, register, value):
         """
 
         :param register:
         :param value:
-        :return:
+        :return: the pymodbus response
+        """
+
+        return self._request(6, register, self.modbus.write_register, register, value)
+
+    def write_registers(self, register, values):
+        """Write contiguous registers in a single request (function code 16)
+
+        :param register: address of the first register
+        :param values: list of int, one per register starting at register
+        :return: the pymodbus response
         """
 
-        self.modbus.write_register(register, value)
+        return self._request(16, register, self.modbus.write_registers, register, list(values))
 
-    def read(self, register):
+    def execute_batch(self, requests):
+        """Send several requests, pipelined if the instrument has been created with pipeline_window > 1 (tcp)
+
+        :param requests: list of (function code, register, argument) with function code 4 (read input registers,
+         argument: count), 6 (write register, argument: value) or 16 (write registers, argument: list of values)
+        :return: list of the responses, in the order of the requests
+        """
+        if not isinstance(self.modbus, Transport):
+            methods = {READ_INPUT_REGISTERS: self.read, WRITE_REGISTER: self.write,
+                       WRITE_REGISTERS: self.write_registers}
+            return [methods[function_code](register, argument) for function_code, register, argument in requests]
+        if tracer.enabled:
+            with tracer.span('modbus.batch', requests=len(requests), window=self.modbus.window):
+                return self._send_batch(requests)
+        return self._send_batch(requests)
+
+    def _send_batch(self, requests):
+        start = time.perf_counter_ns()
+        try:
+            with self._lock:
+                try:
+                    responses = self.modbus.execute(requests)
+                finally:
+                    self._last_activity = time.perf_counter()
+        except Exception as e:
+            end = time.perf_counter_ns()
+            for function_code, register, _ in requests:
+                self.stats.record(function_code, register, start, end, error=not isinstance(e, TimeoutError),
+                                  timeout=isinstance(e, TimeoutError))
+            self.connected = False
+            raise
+        end = time.perf_counter_ns()
+        self.connected = True
+        for (function_code, register, _), response in zip(requests, responses):
+            self.stats.record(function_code, register, getattr(response, 'sent', None) or start,
+                              getattr(response, 'received', None) or end, error=response.isError(),
+                              retries=getattr(response, 'retries', 0))
+        return responses
+
+    def start_recording(self, path):
+        """Record every request, answer and timing to path from now on (see RecordingTransport)"""
+        self.stop_recording()
+        with self._lock:
+            self.modbus = RecordingTransport(self.modbus, path, timeout_errors=self._timeout_errors)
+
+    def stop_recording(self):
+        """Close the recording file, if any, and talk directly to the device again"""
+        with self._lock:
+            if isinstance(self.modbus, RecordingTransport):
+                self.modbus.stop()
+                self.modbus = self.modbus.inner
+
+    def read(self, register, count=1):
         """
 
         :param register:
+        :param count: number of contiguous registers to read
         :return:
         """
-        return self.modbus.read_input_registers(register)
+        return self._request(4, register, self.modbus.read_input_registers, register, count=count)
 
     def ini_hw(self):
         """
 
         """
         try:
-            self.modbus.connect()
-            self.connected = True
-            return True
+            self.connected = bool(self.modbus.connect())
         except:
             return False
+        self._last_activity = time.perf_counter()
+        if self.heartbeat_interval > 0:
+            self.start_heartbeat()
+        return self.connected
 
     def addregister(self, name, address, values, readwrite):
         """
@@ -0,0 +1,95 @@
+from pathlib import Path
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import functools
+import json
+import os
+import threading
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+
+class Tracer:
+    """Collect named spans and save them as a Chrome trace (to be opened in https://ui.perfetto.dev or
+    chrome://tracing)
+
+    Disabled by default: span then returns a shared no-op context manager and the traced decorator costs a single
+    attribute check, so the hooks can stay on the hot paths. Spans are kept in memory (the oldest are dropped beyond
+    max_events) and written when the tracer is stopped or saved. Each span records its thread, so that the time
+    spent in the Qt thread, the plugin thread and the socket can be told apart.
+
+    :param max_events: maximum number of spans kept in memory
+    """
+    def __init__(self, max_events: int = 1_000_000):
+        self.enabled = False
+        self.path: Path = None
+        self.events = deque(maxlen=max_events)
+        self._thread_names = {}
+
+    def start(self, path):
+        """Start recording spans, to be saved in the json file path"""
+        self.path = Path(path)
+        self.events.clear()
+        self._thread_names = {}
+        self.enabled = True
+        logger.info(f'profiling started, trace to be saved in {self.path}')
+
+    def stop(self):
+        """Stop recording and save the trace"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.save()
+
+    def save(self, path=None):
+        """Write the spans recorded so far as a Chrome trace json file"""
+        path = self.path if path is None else Path(path)
+        pid = os.getpid()
+        events = [dict(name='thread_name', ph='M', pid=pid, tid=tid, args=dict(name=name))
+                  for tid, name in list(self._thread_names.items())]
+        events.extend(dict(name=name, cat=name.split('.')[0], ph='X', ts=start / 1000, dur=(end - start) / 1000,
+                           pid=pid, tid=tid, args=args) for name, start, end, tid, args in list(self.events))
+        with open(path, 'w') as file:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), file)
+        logger.info(f'{len(self.events)} profiling spans saved in {path}')
+        return path
+
+    def span(self, name: str, **args):
+        """Context manager timing the enclosed block as the span name, with args shown in the trace viewer"""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name, args):
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.events.append((name, start, time.perf_counter_ns(), tid, args))
+
+
+tracer = Tracer()  # shared by the drivers and the plugins of the package
+
+
+def traced(name: str = None):
+    """Decorator recording each call of the function as a span of the package tracer
+
+    :param name: name of the span, defaults to the qualified name of the function
+    """
+    def decorator(function):
+        label = function.__qualname__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with tracer._span(label, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,34 @@
+from pymodaq_plugins_cellkraft.hardware.transports.base import Transport, ModbusResponse, ModbusFrameError, \
+    encode_request, decode_response, READ_INPUT_REGISTERS, WRITE_REGISTER, WRITE_REGISTERS
+from pymodaq_plugins_cellkraft.hardware.transports.tcp import TcpTransport
+from pymodaq_plugins_cellkraft.hardware.transports.rtu import RtuTransport, SerialRtuTransport, RtuOverTcpTransport
+from pymodaq_plugins_cellkraft.hardware.transports.recording import RecordingTransport, ReplayTransport, \
+    read_recording
+
+# transport name: class, the first argument being the host (tcp, rtu_over_tcp), the serial device (rtu) or the
+# recording file (replay)
+TRANSPORTS = {'tcp': TcpTransport,
+              'rtu': SerialRtuTransport,
+              'rtu_over_tcp': RtuOverTcpTransport,
+              'replay': ReplayTransport,
+              }
+
+
+def make_transport(kind: str, host: str, port: int = 502, window: int = 1, **options) -> Transport:
+    """Create a transport from its name in TRANSPORTS
+
+    :param kind: 'tcp', 'rtu', 'rtu_over_tcp' or 'replay'
+    :param host: hostname or ip address, serial device for 'rtu', recording file for 'replay'
+    :param port: TCP port (ignored for 'rtu' and 'replay')
+    :param window: requests in flight ('tcp' only)
+    :param options: other keyword arguments of the transport class (unit, timeout, baudrate...)
+    """
+    if kind not in TRANSPORTS:
+        raise ValueError(f'unknown transport {kind}, available: {list(TRANSPORTS)}')
+    if kind == 'tcp':
+        return TcpTransport(host, port, window=window, **options)
+    if kind == 'rtu':
+        return SerialRtuTransport(host, **options)
+    if kind == 'replay':
+        return ReplayTransport(host, **options)
+    return RtuOverTcpTransport(host, port, **options)
@@ -0,0 +1,129 @@
+import struct
+import time
+
+READ_INPUT_REGISTERS = 4
+WRITE_REGISTER = 6
+WRITE_REGISTERS = 16
+
+
+class ModbusFrameError(IOError):
+    """Answer that cannot be decoded or does not match its request (the link may have lost the framing)"""
+
+
+class ModbusResponse:
+    """Decoded answer of the device, with the attributes used from pymodbus responses (registers, isError)
+
+    :param function_code: function code of the request
+    :param registers: register values for a read, None for a write
+    :param exception_code: Modbus exception code if the device answered with an exception, else None
+    """
+    def __init__(self, function_code: int, registers: list = None, exception_code: int = None):
+        self.function_code = function_code
+        self.registers = registers
+        self.exception_code = exception_code
+        self.retries = 0
+        self.sent: int = None  # time.perf_counter_ns() when the request was sent
+        self.received: int = None  # and when its answer was received
+
+    def isError(self):
+        return self.exception_code is not None
+
+    def __repr__(self):
+        if self.isError():
+            return f'ModbusResponse(function_code={self.function_code}, exception_code={self.exception_code})'
+        return f'ModbusResponse(function_code={self.function_code}, registers={self.registers})'
+
+
+def encode_request(function_code: int, address: int, argument) -> bytes:
+    """PDU of a request
+
+    :param function_code: READ_INPUT_REGISTERS, WRITE_REGISTER or WRITE_REGISTERS
+    :param address: (first) register
+    :param argument: number of registers to read, value to write or list of values to write
+    """
+    if function_code == READ_INPUT_REGISTERS:
+        return struct.pack('>BHH', function_code, address, argument)
+    if function_code == WRITE_REGISTER:
+        return struct.pack('>BHH', function_code, address, argument)
+    if function_code == WRITE_REGISTERS:
+        return struct.pack(f'>BHHB{len(argument)}H', function_code, address, len(argument), 2 * len(argument),
+                           *argument)
+    raise ValueError(f'unsupported function code {function_code}')
+
+
+def decode_response(pdu: bytes, function_code: int = None) -> ModbusResponse:
+    """ModbusResponse from the PDU of an answer
+
+    :param function_code: function code of the request, checked against the answer if given
+    :raise ModbusFrameError: if the answer is truncated, inconsistent or answers another function code
+    """
+    if len(pdu) < 2:
+        raise ModbusFrameError(f'truncated answer: {pdu.hex()}')
+    answered = pdu[0] & 0x7F
+    if function_code is not None and answered != function_code:
+        raise ModbusFrameError(f'answer of function code {answered} to a request of function code {function_code}')
+    if pdu[0] & 0x80:
+        return ModbusResponse(answered, exception_code=pdu[1])
+    if answered == READ_INPUT_REGISTERS:
+        if pdu[1] % 2 or len(pdu) != 2 + pdu[1]:
+            raise ModbusFrameError(f'inconsistent byte count in the answer: {pdu.hex()}')
+        return ModbusResponse(answered, registers=list(struct.unpack(f'>{pdu[1] // 2}H', pdu[2:])))
+    if answered in (WRITE_REGISTER, WRITE_REGISTERS) and len(pdu) != 5:
+        raise ModbusFrameError(f'wrong length of the answer: {pdu.hex()}')
+    return ModbusResponse(answered)
+
+
+class Transport:
+    """A way to reach a Modbus device: framing, link and timing, below SyncModBusInstrument
+
+    Subclasses implement connect, close, connected and either _transact (one request, one answer, used by the
+    default serial execute) or execute itself. The single request methods mirror the pymodbus client ones, so that a
+    transport can be used wherever the instrument used pymodbus.
+
+    :param unit: Modbus unit identifier (slave address)
+    :param timeout: seconds to wait for an answer
+    """
+    window = 1  # requests kept in flight by execute
+
+    def __init__(self, unit: int = 1, timeout: float = 3.):
+        self.unit = unit
+        self.timeout = timeout
+
+    @property
+    def connected(self) -> bool:
+        raise NotImplementedError
+
+    def connect(self) -> bool:
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def _transact(self, pdu: bytes) -> bytes:
+        """Send the PDU of a request and return the PDU of its answer"""
+        raise NotImplementedError
+
+    def execute(self, requests: list) -> list:
+        """Send requests one after the other
+
+        :param requests: list of (function code, address, argument), see encode_request
+        :return: list of ModbusResponse, in the order of the requests
+        """
+        if not self.connect():
+            raise ConnectionError(f'cannot connect to {self}')
+        responses = []
+        for request in requests:
+            sent = time.perf_counter_ns()
+            response = decode_response(self._transact(encode_request(*request)), request[0])
+            response.sent, response.received = sent, time.perf_counter_ns()
+            responses.append(response)
+        return responses
+
+    def read_input_registers(self, address, count=1):
+        return self.execute([(READ_INPUT_REGISTERS, address, count)])[0]
+
+    def write_register(self, address, value):
+        return self.execute([(WRITE_REGISTER, address, value)])[0]
+
+    def write_registers(self, address, values):
+        return self.execute([(WRITE_REGISTERS, address, list(values))])[0]
@@ -0,0 +1,227 @@
+from pathlib import Path
+from collections import namedtuple
+import struct
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.transports.base import Transport, ModbusResponse, READ_INPUT_REGISTERS, \
+    WRITE_REGISTER, WRITE_REGISTERS
+
+MAGIC = b'CKMR'
+VERSION = 1
+HEADER = struct.Struct('<4sHd')  # magic, version, unix time of the start of the recording
+RECORD = struct.Struct('<ddBBHHH')  # sent, received (s since the start), function code, status, address,
+# number of request values, number of response values; followed by the request then the response values (uint16)
+
+OK, EXCEPTION_RESPONSE, TIMEOUT, ERROR = range(4)
+
+Record = namedtuple('Record', ['sent', 'received', 'function_code', 'status', 'address', 'request', 'response'])
+Record.__doc__ = """A recorded request: times in s since the start of the recording, request and response values
+(registers read, exception code if status is EXCEPTION_RESPONSE)"""
+
+
+def read_recording(path):
+    """Content of a recording file
+
+    :return: (unix time of the start of the recording, list of Record)
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, version, started = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path} is not a Modbus recording (version {VERSION})')
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(data):
+        sent, received, function_code, status, address, n_request, n_response = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        values = struct.unpack_from(f'<{n_request + n_response}H', data, offset)
+        offset += 2 * (n_request + n_response)
+        records.append(Record(sent, received, function_code, status, address, values[:n_request],
+                              values[n_request:]))
+    return started, records
+
+
+def _request_values(function_code, argument) -> tuple:
+    return tuple(argument) if function_code == WRITE_REGISTERS else (argument,)
+
+
+class RecordingTransport(Transport):
+    """Pass the requests to another transport (or pymodbus client) and append them with their answer and timing to
+    a compact binary file
+
+    Each request takes 24 bytes plus 2 bytes per register value. The answers of the wrapped transport are returned
+    untouched, timeouts and errors being recorded and raised again. The file is flushed every flush_interval seconds,
+    so that a crash of the session loses at most that much traffic, and when the recording is stopped.
+
+    :param inner: the transport, or the pymodbus client, actually talking to the device
+    :param path: file to write (overwritten)
+    :param timeout_errors: exceptions of inner recorded as timeouts (the others as errors)
+    :param flush_interval: seconds between two flushes to disk
+    """
+    def __init__(self, inner, path, timeout_errors: tuple = (TimeoutError,), flush_interval: float = 5.):
+        super().__init__(unit=getattr(inner, 'unit', 1), timeout=getattr(inner, 'timeout', 3.))
+        self.inner = inner
+        self.timeout_errors = timeout_errors
+        self.path = Path(path)
+        self.file = open(self.path, 'wb')
+        self.started = time.perf_counter_ns()
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self.count = 0
+        self.flush_interval = flush_interval
+        self._flushed = time.monotonic()
+
+    @property
+    def window(self) -> int:
+        return getattr(self.inner, 'window', 1)
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.inner.connected)
+
+    def connect(self) -> bool:
+        return self.inner.connect()
+
+    def close(self):
+        self.inner.close()
+        self.stop()
+
+    def stop(self):
+        """Close the recording file, the wrapped transport stays connected"""
+        if not self.file.closed:
+            self.file.flush()
+            self.file.close()
+            logger.info(f'{self.count} Modbus requests recorded in {self.path}')
+
+    def _write(self, request, sent, received, status, response_values=()):
+        function_code, address, argument = request
+        request_values = _request_values(function_code, argument)
+        self.file.write(RECORD.pack((sent - self.started) / 1e9, (received - self.started) / 1e9, function_code,
+                                    status, address, len(request_values), len(response_values)))
+        self.file.write(struct.pack(f'<{len(request_values) + len(response_values)}H', *request_values,
+                                    *response_values))
+        self.count += 1
+        now = time.monotonic()
+        if now - self._flushed >= self.flush_interval:
+            self.file.flush()
+            self._flushed = now
+
+    def _record(self, request, response, sent, received):
+        if isinstance(response, Exception):
+            self._write(request, sent, received, ERROR)
+        elif response is not None and response.isError():
+            self._write(request, sent, received, EXCEPTION_RESPONSE,
+                        (getattr(response, 'exception_code', 0) or 0,))
+        else:
+            registers = getattr(response, 'registers', None) if request[0] == READ_INPUT_REGISTERS else None
+            self._write(request, sent, received, OK, registers or ())
+
+    def execute(self, requests: list) -> list:
+        if isinstance(self.inner, Transport):
+            start = time.perf_counter_ns()
+            try:
+                responses = self.inner.execute(requests)
+            except Exception as e:
+                end = time.perf_counter_ns()
+                for request in requests:
+                    self._write(request, start, end, TIMEOUT if isinstance(e, self.timeout_errors) else ERROR)
+                raise
+            for request, response in zip(requests, responses):
+                self._record(request, response, response.sent or start, response.received or start)
+            return responses
+        methods = {READ_INPUT_REGISTERS: lambda address, count: self.inner.read_input_registers(address, count=count),
+                   WRITE_REGISTER: self.inner.write_register,
+                   WRITE_REGISTERS: self.inner.write_registers}
+        responses = []
+        for request in requests:
+            sent = time.perf_counter_ns()
+            try:
+                response = methods[request[0]](request[1], request[2])
+            except Exception as e:
+                self._write(request, sent, time.perf_counter_ns(),
+                            TIMEOUT if isinstance(e, self.timeout_errors) else ERROR)
+                raise
+            self._record(request, response, sent, time.perf_counter_ns())
+            responses.append(response)
+        return responses
+
+
+class ReplayTransport(Transport):
+    """Answer the requests from a recording made by RecordingTransport, without any device
+
+    A request is answered by the next record of the same request (function code, address, values), records of
+    requests no longer sent being skipped, so that the driver and everything downstream run unchanged on recorded
+    traffic. Recorded timeouts and errors are raised again.
+
+    :param path: recording file
+    :param speed: None to answer as fast as possible, else each answer is delayed until its original time divided
+     by speed since the first request (1: original cadence and latency)
+    :param lookahead: number of records searched for a matching request before giving up
+    """
+    def __init__(self, path, speed: float = None, lookahead: int = 1000, unit: int = 1, timeout: float = 3.):
+        super().__init__(unit=unit, timeout=timeout)
+        self.path = Path(path)
+        self.speed = speed
+        self.lookahead = lookahead
+        self.started_at, self.records = read_recording(self.path)
+        self.position = 0
+        self._is_connected = False
+        self._start: float = None
+
+    @property
+    def connected(self) -> bool:
+        return self._is_connected
+
+    def connect(self) -> bool:
+        self._is_connected = True
+        return True
+
+    def close(self):
+        self._is_connected = False
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.records)
+
+    def rewind(self):
+        self.position = 0
+        self._start = None
+
+    def _next_record(self, request) -> Record:
+        function_code, address, argument = request
+        values = _request_values(function_code, argument)
+        for position in range(self.position, min(self.position + self.lookahead, len(self.records))):
+            record = self.records[position]
+            if (record.function_code, record.address, record.request) == (function_code, address, values):
+                self.position = position + 1
+                return record
+        raise IOError(f'request {request} not found in {self.path} after record {self.position}')
+
+    def execute(self, requests: list) -> list:
+        responses = []
+        for request in requests:
+            sent = time.perf_counter_ns()
+            record = self._next_record(request)
+            if self.speed:
+                if self._start is None:
+                    self._start = time.perf_counter() - record.sent / self.speed
+                wait = self._start + record.received / self.speed - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            if record.status == TIMEOUT:
+                raise TimeoutError(f'recorded timeout of {request}')
+            if record.status == ERROR:
+                raise IOError(f'recorded error of {request}')
+            if record.status == EXCEPTION_RESPONSE:
+                response = ModbusResponse(record.function_code, exception_code=record.response[0])
+            else:
+                response = ModbusResponse(record.function_code, registers=list(record.response)
+                                          if record.function_code == READ_INPUT_REGISTERS else None)
+            response.sent, response.received = sent, time.perf_counter_ns()
+            responses.append(response)
+        return responses
+
+    def __str__(self):
+        return str(self.path)
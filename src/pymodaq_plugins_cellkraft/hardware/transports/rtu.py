@@ -0,0 +1,209 @@
+from pathlib import Path
+import socket
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.transports.base import Transport, READ_INPUT_REGISTERS
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(frame: bytes) -> int:
+    """Modbus RTU CRC of frame (polynomial 0xA001, initial value 0xFFFF), sent low byte first"""
+    crc = 0xFFFF
+    for byte in frame:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+class RtuTransport(Transport):
+    """Modbus RTU framing: unit identifier + PDU + CRC, frames being separated by a silence of 3.5 characters
+
+    A single request is in flight at a time (RS-485 is half-duplex). Before each request the transport waits for
+    the inter-frame gap since the end of the previous answer, fixed to 1.75 ms above 19200 bauds as specified. The
+    length of an answer is known from its function code, so it is read without waiting for the gap. Subclasses
+    provide the link through _write, _read and _discard_input.
+
+    :param baudrate: of the serial line, sets the inter-frame gap (for RTU over TCP, the one behind the gateway)
+    :param bytesize: data bits per character
+    :param parity: 'N', 'E' or 'O'
+    :param stopbits: stop bits per character
+    :param unit: Modbus unit identifier (slave address)
+    :param timeout: seconds to wait for an answer
+    """
+    def __init__(self, baudrate: int = 19200, bytesize: int = 8, parity: str = 'E', stopbits: int = 1,
+                 unit: int = 1, timeout: float = 1.):
+        super().__init__(unit=unit, timeout=timeout)
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.character_time = (1 + bytesize + (parity != 'N') + stopbits) / baudrate
+        self.frame_gap = 3.5 * self.character_time if baudrate <= 19200 else 1.75e-3
+        self._last_activity = 0.
+
+    def _write(self, data: bytes):
+        raise NotImplementedError
+
+    def _read(self, size: int) -> bytes:
+        """Exactly size bytes, raising TimeoutError if they do not come within self.timeout"""
+        raise NotImplementedError
+
+    def _discard_input(self):
+        """Drop what is left of a previous answer (after a timeout or a CRC error)"""
+        raise NotImplementedError
+
+    def _transact(self, pdu: bytes) -> bytes:
+        wait = self._last_activity + self.frame_gap - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        self._discard_input()
+        frame = bytes([self.unit]) + pdu
+        try:
+            self._write(frame + crc16(frame).to_bytes(2, 'little'))
+            answer = self._read(2)
+            if answer[1] & 0x80:
+                answer += self._read(3)
+            elif answer[1] == READ_INPUT_REGISTERS:
+                answer += self._read(1)
+                answer += self._read(answer[2] + 2)
+            else:
+                answer += self._read(6)
+        finally:
+            self._last_activity = time.perf_counter()
+        if crc16(answer[:-2]) != int.from_bytes(answer[-2:], 'little'):
+            raise IOError(f'CRC error in the answer of {self}: {answer.hex()}')
+        if answer[0] != self.unit:
+            raise IOError(f'answer of unit {answer[0]} received from {self} instead of unit {self.unit}')
+        return answer[1:-2]
+
+
+class SerialRtuTransport(RtuTransport):
+    """Modbus RTU on a serial line (RS-485 adapter), relying on pyserial
+
+    :param device: serial port, e.g. "COM3" or "/dev/ttyUSB0"
+    """
+    def __init__(self, device: str, baudrate: int = 19200, bytesize: int = 8, parity: str = 'E',
+                 stopbits: int = 1, unit: int = 1, timeout: float = 1.):
+        super().__init__(baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits, unit=unit,
+                         timeout=timeout)
+        self.device = device
+        self.serial = None
+
+    @property
+    def connected(self) -> bool:
+        return self.serial is not None
+
+    def connect(self) -> bool:
+        if self.serial is not None:
+            return True
+        try:
+            import serial
+        except ImportError as e:
+            raise ImportError('the Modbus RTU serial transport needs pyserial: '
+                              'pip install pymodaq_plugins_cellkraft[serial]') from e
+        try:
+            self.serial = serial.Serial(self.device, baudrate=self.baudrate, bytesize=self.bytesize,
+                                        parity=self.parity, stopbits=self.stopbits, timeout=self.timeout)
+        except serial.SerialException as e:
+            logger.warning(f'cannot open {self.device}: {e}')
+            return False
+        return True
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+    def _write(self, data: bytes):
+        self.serial.write(data)
+        self.serial.flush()
+
+    def _read(self, size: int) -> bytes:
+        data = self.serial.read(size)
+        if len(data) < size:
+            raise TimeoutError(f'no answer from {self}')
+        return data
+
+    def _discard_input(self):
+        self.serial.reset_input_buffer()
+
+    def __str__(self):
+        return self.device
+
+
+class RtuOverTcpTransport(RtuTransport):
+    """Modbus RTU frames sent as they are over a TCP connection, to a transparent serial gateway
+
+    :param host: hostname or ip address of the gateway
+    :param port: TCP port of the gateway
+    """
+    def __init__(self, host, port: int = 502, baudrate: int = 19200, bytesize: int = 8, parity: str = 'E',
+                 stopbits: int = 1, unit: int = 1, timeout: float = 1.):
+        super().__init__(baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits, unit=unit,
+                         timeout=timeout)
+        self.host = host
+        self.port = port
+        self.socket: socket.socket = None
+
+    @property
+    def connected(self) -> bool:
+        return self.socket is not None
+
+    def connect(self) -> bool:
+        if self.socket is not None:
+            return True
+        try:
+            self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            logger.warning(f'cannot connect to {self}: {e}')
+            return False
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _write(self, data: bytes):
+        self.socket.sendall(data)
+
+    def _read(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            try:
+                chunk = self.socket.recv(size - len(data))
+            except socket.timeout as e:
+                raise TimeoutError(f'no answer from {self}') from e
+            if not chunk:
+                self.close()
+                raise ConnectionError(f'connection closed by {self}')
+            data += chunk
+        return data
+
+    def _discard_input(self):
+        self.socket.setblocking(False)
+        try:
+            while self.socket.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.socket.settimeout(self.timeout)
+
+    def __str__(self):
+        return f'{self.host}:{self.port}'
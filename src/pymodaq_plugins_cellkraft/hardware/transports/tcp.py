@@ -0,0 +1,123 @@
+from pathlib import Path
+import socket
+import struct
+import time
+
+from pymodaq_plugins_cellkraft import get_logger
+logger = get_logger(Path(__file__).stem)
+
+from pymodaq_plugins_cellkraft.hardware.transports.base import Transport, ModbusFrameError, encode_request, \
+    decode_response
+
+
+class TcpTransport(Transport):
+    """Modbus TCP transport keeping up to window requests in flight, the answers being matched by transaction ID
+
+    Frames are delimited by the MBAP header, so there is no inter-frame timing: Nagle's algorithm is disabled so that
+    each request leaves as soon as it is written.
+
+    On a high latency link (VPN) the throughput of a batch of requests scales with the window instead of being one
+    request per round-trip. Controllers that do not support pipelining either close the connection or drop the
+    extra requests: when a pipelined batch fails that way, the client reconnects, falls back to strict serial mode
+    (window = 1, self.pipelining_rejected set) and resends the requests left unanswered. Writing a setpoint twice
+    being harmless, a write that may have been executed before the failure is simply sent again. A malformed answer
+    closes the connection and raises ModbusFrameError, without any fallback.
+
+    :param host: hostname or ip address
+    :param port: TCP port
+    :param window: maximum number of requests in flight
+    :param timeout: seconds to wait for an answer
+    :param unit: Modbus unit identifier
+    """
+    def __init__(self, host, port: int = 502, window: int = 8, timeout: float = 3., unit: int = 1):
+        super().__init__(unit=unit, timeout=timeout)
+        self.host = host
+        self.port = port
+        self.window = max(int(window), 1)
+        self.pipelining_rejected = False
+        self.socket: socket.socket = None
+        self._buffer = b''
+        self._transaction_id = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.socket is not None
+
+    def connect(self) -> bool:
+        if self.socket is not None:
+            return True
+        try:
+            self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            logger.warning(f'cannot connect to {self.host}:{self.port}: {e}')
+            return False
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b''
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _send(self, pdu: bytes) -> int:
+        self._transaction_id = (self._transaction_id + 1) % 0x10000
+        self.socket.sendall(struct.pack('>HHHB', self._transaction_id, 0, len(pdu) + 1, self.unit) + pdu)
+        return self._transaction_id
+
+    def _receive(self):
+        """(transaction ID, PDU) of the next frame received"""
+        while True:
+            if len(self._buffer) >= 7:
+                transaction_id, _, length, _ = struct.unpack('>HHHB', self._buffer[:7])
+                if len(self._buffer) >= 6 + length:
+                    pdu, self._buffer = self._buffer[7:6 + length], self._buffer[6 + length:]
+                    return transaction_id, pdu
+            chunk = self.socket.recv(4096)
+            if not chunk:
+                raise ConnectionError(f'connection closed by {self.host}:{self.port}')
+            self._buffer += chunk
+
+    def execute(self, requests: list) -> list:
+        """Send requests keeping up to self.window of them in flight
+
+        :param requests: list of (function code, address, argument), see encode_request
+        :return: list of ModbusResponse, in the order of the requests
+        """
+        if not self.connect():
+            raise ConnectionError(f'cannot connect to {self.host}:{self.port}')
+        pdus = [encode_request(*request) for request in requests]
+        responses = [None] * len(pdus)
+        pending = {}  # {transaction ID: (index of the request, time sent)}
+        following = 0
+        try:
+            while following < len(pdus) or pending:
+                while following < len(pdus) and len(pending) < self.window:
+                    sent = time.perf_counter_ns()
+                    pending[self._send(pdus[following])] = (following, sent)
+                    following += 1
+                transaction_id, pdu = self._receive()
+                if transaction_id not in pending:  # late answer of a previous batch
+                    continue
+                index, sent = pending.pop(transaction_id)
+                responses[index] = decode_response(pdu, requests[index][0])
+                responses[index].sent, responses[index].received = sent, time.perf_counter_ns()
+        except ModbusFrameError:  # the following frames cannot be trusted either
+            self.close()
+            raise
+        except OSError as e:  # including timeouts and connections closed by the device
+            self.close()
+            if self.window == 1 or len(pdus) == 1:
+                raise
+            logger.warning(f'{self.host}:{self.port} does not support pipelined requests ({e!r}), '
+                           f'falling back to serial mode')
+            self.window = 1
+            self.pipelining_rejected = True
+            unanswered = [index for index, response in enumerate(responses) if response is None]
+            for index, response in zip(unanswered, self.execute([requests[index] for index in unanswered])):
+                response.retries = 1
+                responses[index] = response
+        return responses
+
+    def __str__(self):
+        return f'{self.host}:{self.port}'
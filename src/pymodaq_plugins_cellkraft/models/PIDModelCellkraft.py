@@ -0,0 +1,140 @@
+from copy import deepcopy
+
+import numpy as np
+
+from pymodaq.extensions.pid.utils import PIDModelGeneric, DataToActuators, main
+from pymodaq.utils.data import DataToExport, DataActuator, DataCalculated
+from typing import List
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Air, Steam, DEVICES, get_validators
+
+# controlled quantity: (setpoint resolution, setpoint register name)
+CONTROLLED = {'RH': (1 / Air.write_scaling, 'RH'),
+              'Steam T': (1 / Steam.write_scaling, 'SP_SteamT'),
+              }
+
+
+class PIDModelCellkraft(PIDModelGeneric):
+    """Close the loop on the RH or the steam temperature of a Cellkraft generator using an external reference detector
+
+    The PID output is the absolute setpoint of the DAQ_Move_CellkraftE1500 actuator (axis RH or Steam T, to be chosen
+    accordingly in its settings). The output is quantized to the register resolution (0.1 % for RH, 1 °C for the
+    steam temperature) and only allowed to change every "Min. write interval"; as the actuator plugin skips writes
+    of an unchanged quantized setpoint, a loop iteration costs one Modbus read (the actuator readback) plus at most
+    one Modbus write, whatever the PID sample time.
+
+    Loop rate: the model itself only does a few numpy operations per iteration (tens of µs), so the sustained rate is
+    about 1 / (detector grab time + 2 Modbus round-trips + sample time). With LAN round-trips of a few ms the
+    generator is never the bottleneck; its thermal time constants being of tens of seconds, a sample time of 0.5 to
+    1 s is enough and keeps the controller load negligible.
+    """
+    limits = dict(max=dict(state=True, value=100),
+                  min=dict(state=True, value=0),)
+    konstants = dict(kp=0.5, ki=0.01, kd=0.0)
+
+    Nsetpoints = 1  # number of setpoints
+    setpoint_ini = [50.]  # number and values of initial setpoints
+    setpoints_names = ['RH']  # number and names of setpoints
+
+    actuators_name = ["Cellkraft"]  # names of actuator's control modules involved in the PID
+    detectors_name = ['Reference']  # names of detector's control modules involved in the PID
+
+    params = [
+        {'title': 'Device:', 'name': 'device', 'type': 'list', 'limits': list(DEVICES.keys()),
+         'value': 'Cellkraft E1500 Series', 'tip': 'as in the settings of the actuator, for its authorized setpoints'},
+        {'title': 'Controlled quantity:', 'name': 'controlled', 'type': 'list', 'limits': list(CONTROLLED.keys()),
+         'value': 'RH'},
+        {'title': 'Min. write interval (s):', 'name': 'write_interval', 'type': 'float', 'value': 1., 'min': 0.},
+    ]
+
+    def __init__(self, pid_controller):
+        self.limits = deepcopy(self.limits)
+        super().__init__(pid_controller)
+        self.last_output: float = None
+        self.since_last_output = 0.
+        self.update_setpoint_name()
+
+    @property
+    def resolution(self) -> float:
+        return CONTROLLED[self.settings['controlled']][0]
+
+    @property
+    def output_bounds(self):
+        validator = get_validators(DEVICES[self.settings['device']])[CONTROLLED[self.settings['controlled']][1]]
+        return validator.minimum, validator.maximum
+
+    def update_settings(self, param):
+        """
+        Get a parameter instance whose value has been modified by a user on the UI
+        Parameters
+        ----------
+        param: (Parameter) instance of Parameter object
+        """
+        if param.name() in ('controlled', 'device'):
+            self.last_output = None
+            self.update_setpoint_name()
+            self.limits['min']['value'], self.limits['max']['value'] = self.output_bounds
+            self.apply_limits()
+
+    def update_setpoint_name(self):
+        """Name the setpoint after the controlled quantity, also in the PID window if its setpoint is displayed"""
+        self.setpoints_names = [self.settings['controlled']]
+        layout = getattr(self.pid_controller, 'toolbar_layout', None)
+        item = layout.itemAtPosition(2, 2) if layout is not None else None  # see PIDController.set_setpoints_buttons
+        if item is not None and item.widget() is not None:
+            item.widget().setText(self.setpoints_names[0])
+
+    def ini_model(self):
+        super().ini_model()
+        self.last_output = None
+        self.since_last_output = 0.
+
+    def convert_input(self, measurements: DataToExport):
+        """
+        Convert the measurements in the units to be fed to the PID (same dimensionality as the setpoint)
+        Parameters
+        ----------
+        measurements: DataToExport
+            Data from the declared detectors from which the model extract a value of the same units as the setpoint
+
+        Returns
+        -------
+        DataToExport: the reference RH (%) or steam temperature (°C)
+
+        """
+        if self.data_names:
+            data = measurements.get_data_from_full_name('/'.join(self.data_names[0]))
+        else:
+            data = measurements.get_data_from_dim('Data0D')[0]
+        return DataToExport('inputs', data=[DataCalculated('pid_calculated', data=[np.array([float(data[0][0])])])])
+
+    def convert_output(self, outputs: List[float], dt: float, stab=True):
+        """
+        Convert the output of the PID in units to be fed into the actuator
+        Parameters
+        ----------
+        outputs: List of float
+            output value from the PID from which the model extract a value of the same units as the actuator
+        dt: float
+            Ellapsed time since the last call to this function
+        stab: bool
+
+        Returns
+        -------
+        DataToActuators: the absolute setpoint, quantized to the register resolution
+
+        """
+        self.curr_output = outputs
+        self.since_last_output += dt
+        low, high = self.output_bounds
+        output = float(np.clip(np.round(outputs[0] / self.resolution) * self.resolution, low, high))
+        if self.last_output is None or self.since_last_output >= self.settings['write_interval']:
+            if output != self.last_output:
+                self.since_last_output = 0.
+            self.last_output = output
+        return DataToActuators('pid', mode='abs',
+                               data=[DataActuator(self.actuators_name[0], data=self.last_output)])
+
+
+if __name__ == '__main__':
+    main("CellkraftPID.xml")  # some preset configured with the right actuators and detectors
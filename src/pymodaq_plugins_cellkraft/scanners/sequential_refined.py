@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive refinement of a coarse sequential grid driven by the measured detector response
+
+DAQ_Scan (v4) has no working feedback path from the detectors to the scanner, so the refinement is done pass by pass:
+the first pass is the coarse Sequential grid, each following pass loads the positions and responses measured so far
+(text file, one column per actuator then one column for the response) and only visits the newly inserted points.
+The AdaptiveRefiner itself is Qt free and can be driven in a closed loop (ask/tell) from a script.
+"""
+from typing import List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from pymodaq.utils.data import Axis, DataDistribution
+from pymodaq.utils.logger import set_logger, get_module_name
+from pymodaq.utils.scanner.scan_factory import ScannerFactory
+from pymodaq.utils.scanner.scanners.sequential import SequentialScanner
+
+if TYPE_CHECKING:
+    from pymodaq.control_modules.daq_move import DAQ_Move
+
+logger = set_logger(get_module_name(__file__))
+
+
+def neighbour_pairs(points: np.ndarray) -> np.ndarray:
+    """Pairs of neighbouring points (indexes), from the sorted order in 1D and a Delaunay triangulation otherwise
+
+    :param points: ndarray (n_points, n_axes) already normalized to comparable scales
+    :return: ndarray (n_pairs, 2) of int
+    """
+    n_points, n_axes = points.shape
+    if n_points < 2:
+        return np.zeros((0, 2), dtype=int)
+    if n_axes == 1 or n_points <= n_axes + 1:
+        order = np.argsort(points[:, 0], kind='stable')
+        return np.stack((order[:-1], order[1:]), axis=1)
+    from scipy.spatial import Delaunay
+    simplices = Delaunay(points, qhull_options='QJ').simplices
+    pairs = np.concatenate([simplices[:, [i, j]] for i in range(n_axes + 1) for j in range(i + 1, n_axes + 1)])
+    return np.unique(np.sort(pairs, axis=1), axis=0)
+
+
+class AdaptiveRefiner:
+    """Insert points between neighbours whose response differs the most
+
+    The loss of a pair of neighbours is the absolute change of the response normalized by the response range. New
+    points are the midpoints of the pairs with the largest loss, as long as the loss is above tolerance, the pair is
+    wider than the minimal spacing and the budget is not exhausted.
+
+    :param starts: sequence of the lower bounds of each axis
+    :param stops: sequence of the upper bounds of each axis
+    :param min_spacing: sequence of the smallest distance between two points along each axis
+    :param budget: max total number of points (measured + asked)
+    :param tolerance: normalized response change below which a pair is not refined
+    """
+    def __init__(self, starts, stops, min_spacing, budget: int = 100, tolerance: float = 0.05):
+        self.starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        self.stops = np.atleast_1d(np.asarray(stops, dtype=float))
+        self.min_spacing = np.abs(np.atleast_1d(np.asarray(min_spacing, dtype=float)))
+        self.spans = np.abs(self.stops - self.starts)
+        self.spans[self.spans == 0] = 1.
+        self.budget = budget
+        self.tolerance = tolerance
+        self.points = np.zeros((0, self.starts.size))
+        self.values = np.zeros((0,))
+        self.pending = np.zeros((0, self.starts.size))
+
+    @property
+    def n_points(self) -> int:
+        return self.points.shape[0] + self.pending.shape[0]
+
+    def tell(self, positions, values):
+        """Store measured responses
+
+        :param positions: ndarray (n, n_axes)
+        :param values: ndarray (n,) of the detector response at positions
+        """
+        positions = np.asarray(positions, dtype=float).reshape((-1, self.starts.size))
+        values = np.asarray(values, dtype=float).ravel()
+        self.points = np.concatenate((self.points, positions))
+        self.values = np.concatenate((self.values, values))
+        if self.pending.shape[0]:
+            measured = (np.abs(self.pending[:, np.newaxis, :] - positions[np.newaxis, :, :]) < 1e-12).all(axis=2)
+            self.pending = self.pending[~measured.any(axis=1)]
+
+    def losses(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Pairs of neighbours that can still be split and their loss, sorted by decreasing loss"""
+        normalized = (self.points - self.starts) / self.spans
+        pairs = neighbour_pairs(normalized)
+        if pairs.shape[0] == 0:
+            return pairs, np.zeros((0,))
+        value_span = np.ptp(self.values) if self.values.size else 0.
+        if value_span == 0:
+            value_span = 1.
+        losses = np.abs(self.values[pairs[:, 0]] - self.values[pairs[:, 1]]) / value_span
+        widths = np.abs(self.points[pairs[:, 0]] - self.points[pairs[:, 1]])
+        splittable = ((widths >= 2 * self.min_spacing) & (widths > 0)).any(axis=1)
+        pairs, losses = pairs[splittable], losses[splittable]
+        order = np.argsort(-losses, kind='stable')
+        return pairs[order], losses[order]
+
+    def ask(self, n: int = 1) -> np.ndarray:
+        """Next points to measure, empty once done
+
+        :param n: max number of points to return
+        :return: ndarray (<= n, n_axes)
+        """
+        n = min(n, self.budget - self.n_points)
+        if n <= 0 or self.points.shape[0] < 2:
+            return np.zeros((0, self.starts.size))
+        pairs, losses = self.losses()
+        pairs = pairs[losses > self.tolerance]
+        new_points = []
+        for ind0, ind1 in pairs:
+            midpoint = (self.points[ind0] + self.points[ind1]) / 2
+            if np.all(self.min_spacing > 0):
+                midpoint = self.starts + np.round((midpoint - self.starts) / self.min_spacing) * self.min_spacing
+            known = np.concatenate([self.points, self.pending] + [np.atleast_2d(p) for p in new_points])
+            if np.any(np.all(np.abs(known - midpoint) < np.maximum(self.min_spacing, 1e-12) / 2, axis=1)):
+                continue
+            new_points.append(midpoint)
+            if len(new_points) >= n:
+                break
+        new_points = np.array(new_points).reshape((-1, self.starts.size))
+        self.pending = np.concatenate((self.pending, new_points))
+        return new_points
+
+    @property
+    def done(self) -> bool:
+        """True when the budget is exhausted or no pair of neighbours is above tolerance"""
+        if self.n_points >= self.budget:
+            return True
+        pairs, losses = self.losses()
+        return not np.any(losses > self.tolerance)
+
+
+@ScannerFactory.register()
+class SequentialRefinedScanner(SequentialScanner):
+    """Coarse sequential grid refined pass after pass where the response changes the most
+
+    Without a previous pass file, the positions are the coarse grid of the table. With one, the positions are the
+    points inserted by the AdaptiveRefiner (at most "Points per pass"), the minimal spacing along each axis being the
+    grid step divided by 2 ** "Max. level". Once the refinement converged (or the budget is spent) the scan is
+    empty, and a previous passes file that cannot be loaded raises a ValueError instead of scanning the coarse grid.
+    """
+    scan_subtype = 'Refined'
+    params = SequentialScanner.params + [
+        {'title': 'Previous passes:', 'name': 'previous_file', 'type': 'browsepath', 'value': '', 'filetype': True,
+         'tip': 'text file with one column per actuator then the measured response, empty for the coarse pass'},
+        {'title': 'Points per pass:', 'name': 'n_new', 'type': 'int', 'value': 20, 'min': 1},
+        {'title': 'Budget:', 'name': 'budget', 'type': 'int', 'value': 200, 'min': 1},
+        {'title': 'Tolerance:', 'name': 'tolerance', 'type': 'float', 'value': 0.05, 'min': 0.,
+         'tip': 'response change (normalized by its range) below which neighbours are not refined'},
+        {'title': 'Max. level:', 'name': 'max_level', 'type': 'int', 'value': 3, 'min': 0},
+    ]
+
+    def __init__(self, actuators: List['DAQ_Move']):
+        self.distribution = DataDistribution['uniform']
+        self.refiner: AdaptiveRefiner = None
+        super().__init__(actuators)
+
+    def get_refiner(self) -> AdaptiveRefiner:
+        starts, stops, steps = self.get_pos()
+        return AdaptiveRefiner(starts, stops, np.abs(steps) / 2 ** self.settings['max_level'],
+                               budget=self.settings['budget'], tolerance=self.settings['tolerance'])
+
+    def refined_positions(self) -> np.ndarray:
+        """Points inserted by a new AdaptiveRefiner told the previous passes, empty once the refinement converged
+
+        :raise ValueError: if the previous passes file cannot be loaded
+        """
+        try:
+            measured = np.atleast_2d(np.loadtxt(self.settings['previous_file']))
+            if measured.shape[1] != len(self.actuators) + 1:
+                raise ValueError(f'{measured.shape[1]} columns instead of {len(self.actuators) + 1} (one per '
+                                 f'actuator then the response)')
+        except (OSError, ValueError) as e:
+            logger.error(f'Could not load the previous passes {self.settings["previous_file"]}: {e}')
+            raise ValueError(f'Could not load the previous passes {self.settings["previous_file"]}: {e}') from e
+        self.refiner = self.get_refiner()
+        self.refiner.tell(measured[:, :-1], measured[:, -1])
+        return self.refiner.ask(self.settings['n_new'])
+
+    def set_scan(self):
+        """Coarse grid without previous passes file, else the refined points (none once converged: empty scan)"""
+        if self.settings['previous_file'] == '':
+            self.distribution = DataDistribution['uniform']
+            super().set_scan()
+            return
+        positions = self.refined_positions()
+        if positions.shape[0] == 0:
+            logger.info('Refinement converged: no more points above tolerance or budget exhausted, empty scan')
+        self.distribution = DataDistribution['spread']
+        self.get_info_from_positions(positions)
+
+    def evaluate_steps(self) -> int:
+        if self.settings['previous_file'] != '':
+            return self.refined_positions().shape[0]
+        return super().evaluate_steps()
+
+    def get_nav_axes(self) -> List[Axis]:
+        if self.distribution == DataDistribution['spread']:
+            return [Axis(label=f'{act.title}', units=act.units, data=self.positions[:, ind], index=0,
+                         spread_order=ind)
+                    for ind, act in enumerate(self.actuators)]
+        return super().get_nav_axes()
+
+    def get_indexes_from_scan_index(self, scan_index: int) -> Tuple[int]:
+        if self.distribution == DataDistribution['spread']:
+            return scan_index,
+        return super().get_indexes_from_scan_index(scan_index)
+
+    def get_scan_shape(self) -> Tuple[int]:
+        if self.distribution == DataDistribution['spread']:
+            return self.n_steps,
+        return super().get_scan_shape()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Sequential scanner visiting the grid points in the order minimizing the thermal transitions of the generator
+
+Steam and tube temperatures (and to a lesser extent RH and flow) need minutes to ramp and settle, so visiting a grid
+in its natural order (with a full swing back at the end of each line) wastes most of the scan time. The positions
+are the same as the ones of the Sequential/Linear scanner, only their order is changed.
+"""
+from typing import List, TYPE_CHECKING
+
+import numpy as np
+
+from pymodaq.utils.logger import set_logger, get_module_name
+from pymodaq.utils.scanner.scan_factory import ScannerFactory
+from pymodaq.utils.scanner.scanners.sequential import SequentialScanner, TableModelSequential
+from pymodaq.utils.parameter import utils as putils
+from pymodaq.utils.parameter.pymodaq_ptypes import TableViewCustom
+
+if TYPE_CHECKING:
+    from pymodaq.control_modules.daq_move import DAQ_Move
+
+logger = set_logger(get_module_name(__file__))
+
+MAX_POINTS_FOR_2OPT = 1500  # above this, the cost matrix gets too large and only the greedy path is used
+
+
+def transition_costs(positions: np.ndarray, rates_up: np.ndarray, rates_down: np.ndarray,
+                     settle_time: float = 0.) -> np.ndarray:
+    """Estimated time to go from each point to each other point
+
+    Axes are ramped simultaneously so the transition lasts as long as the slowest axis, plus a settling time
+    whenever something moved.
+
+    :param positions: ndarray (n_points, n_axes)
+    :param rates_up: ndarray (n_axes,) ramp rates for increasing values in units per second
+    :param rates_down: ndarray (n_axes,) ramp rates for decreasing values in units per second
+    :param settle_time: time to wait after each transition in seconds
+    :return: ndarray (n_points, n_points), cost[i, j] being the time to go from point i to point j
+    """
+    delta = positions[np.newaxis, :, :] - positions[:, np.newaxis, :]
+    times = np.where(delta > 0, delta / rates_up, -delta / rates_down)
+    costs = times.max(axis=2)
+    return costs + settle_time * (costs > 0)
+
+
+def transition_costs_from(position: np.ndarray, positions: np.ndarray, rates_up: np.ndarray,
+                          rates_down: np.ndarray, settle_time: float = 0.) -> np.ndarray:
+    """Estimated time to go from a single position to each of positions, see transition_costs"""
+    delta = positions - position
+    costs = np.where(delta > 0, delta / rates_up, -delta / rates_down).max(axis=1)
+    return costs + settle_time * (costs > 0)
+
+
+def path_cost(costs: np.ndarray, order: np.ndarray) -> float:
+    """Total time of a path visiting the points in order"""
+    return float(costs[order[:-1], order[1:]].sum())
+
+
+def greedy_path(costs: np.ndarray, start: int = 0) -> np.ndarray:
+    """Nearest neighbour construction of an open path starting at start"""
+    n_points = costs.shape[0]
+    visited = np.zeros(n_points, dtype=bool)
+    order = np.empty(n_points, dtype=int)
+    order[0] = start
+    visited[start] = True
+    for ind in range(1, n_points):
+        row = np.where(visited, np.inf, costs[order[ind - 1]])
+        order[ind] = int(np.argmin(row))
+        visited[order[ind]] = True
+    return order
+
+
+def two_opt(costs: np.ndarray, order: np.ndarray, max_passes: int = 50) -> np.ndarray:
+    """Improve an open path (first point fixed) by segment reversals
+
+    Costs may be asymmetric (heating and cooling rates differ) so the cost of the reversed segment is computed from
+    cumulative sums of the backward costs rather than assumed equal to the forward one.
+    """
+    order = order.copy()
+    n_points = order.size
+    if n_points < 3:
+        return order
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n_points - 1):
+            fwd = np.concatenate(([0.], np.cumsum(costs[order[:-1], order[1:]])))
+            rev = np.concatenate(([0.], np.cumsum(costs[order[1:], order[:-1]])))
+            j = np.arange(i + 1, n_points)
+            old = costs[order[i - 1], order[i]] + fwd[j] - fwd[i]
+            new = costs[order[i - 1], order[j]] + rev[j] - rev[i]
+            inner = j < n_points - 1
+            old[inner] += costs[order[j[inner]], order[j[inner] + 1]]
+            new[inner] += costs[order[i], order[j[inner] + 1]]
+            gains = old - new
+            best = int(np.argmax(gains))
+            if gains[best] > 1e-9:
+                order[i:j[best] + 1] = order[i:j[best] + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def order_points(positions: np.ndarray, rates_up, rates_down, settle_time: float = 0., start: int = 0):
+    """Reorder positions to minimize the total estimated transition and settling time
+
+    :param positions: ndarray (n_points, n_axes)
+    :param rates_up: sequence of ramp rates (units per second) for increasing values, one per axis
+    :param rates_down: sequence of ramp rates (units per second) for decreasing values, one per axis
+    :param settle_time: time to wait after each transition in seconds
+    :param start: index of the point the path has to start from
+    :return: ndarray of indexes, the order in which positions should be visited
+    """
+    positions = np.atleast_2d(np.asarray(positions, dtype=float))
+    rates_up = np.asarray(rates_up, dtype=float)
+    rates_down = np.asarray(rates_down, dtype=float)
+    n_points = positions.shape[0]
+    if n_points > MAX_POINTS_FOR_2OPT:
+        # greedy only, computing the cost rows on the fly
+        visited = np.zeros(n_points, dtype=bool)
+        order = np.empty(n_points, dtype=int)
+        order[0] = start
+        visited[start] = True
+        for ind in range(1, n_points):
+            row = transition_costs_from(positions[order[ind - 1]], positions, rates_up, rates_down, settle_time)
+            row[visited] = np.inf
+            order[ind] = int(np.argmin(row))
+            visited[order[ind]] = True
+        return order
+    costs = transition_costs(positions, rates_up, rates_down, settle_time)
+    return two_opt(costs, greedy_path(costs, start))
+
+
+@ScannerFactory.register()
+class SequentialThermalScanner(SequentialScanner):
+    """Sequential grid whose points are visited in the order minimizing the generator transition times
+
+    Each actuator row gets two extra columns: the ramp rates (units per minute) when increasing and decreasing the
+    value. Cooling being passive on the E1500, the down rate of temperatures is usually the smallest one.
+    """
+    scan_subtype = 'ThermalOrdered'
+    params = SequentialScanner.params + [
+        {'title': 'Settling time (s):', 'name': 'settle_time', 'type': 'float', 'value': 60., 'min': 0.},
+        {'title': 'Estimated time (s):', 'name': 'estimated_time', 'type': 'float', 'value': 0., 'readonly': True},
+        {'title': 'Grid order time (s):', 'name': 'grid_time', 'type': 'float', 'value': 0., 'readonly': True},
+    ]
+
+    def __init__(self, actuators: List['DAQ_Move']):
+        super().__init__(actuators)
+
+    def update_model(self, init_data=None):
+        if init_data is None:
+            if self.table_model is not None:
+                init_data = []
+                names = [row[0] for row in self.table_model.get_data_all()]
+                for act in self._actuators:
+                    if act.title in names:
+                        ind_row = names.index(act.title)
+                        init_data.append(self.table_model.get_data_all()[ind_row])
+                    else:
+                        init_data.append([act.title, 0., 1., 0.1, 1., 1.])
+            else:
+                init_data = [[act.title, 0., 1., 0.1, 1., 1.] for act in self._actuators]
+        self.table_model = TableModelSequential(init_data,
+                                                header=['Actuator', 'Start', 'Stop', 'Step',
+                                                        'Rate up (/min)', 'Rate down (/min)'],
+                                                editable=[False, True, True, True, True, True])
+        self.table_view = putils.get_widget_from_tree(self.settings_tree, TableViewCustom)[0]
+        self.settings.child('seq_table').setValue(self.table_model)
+        self.n_axes = len(self._actuators)
+        self.update_table_view()
+
+    def get_rates(self):
+        """Ramp rates in units per second, for increasing and decreasing values"""
+        rows = range(self.table_model.rowCount(None))
+        rates_up = np.array([self.table_model.get_data(ind, 4) for ind in rows], dtype=float) / 60
+        rates_down = np.array([self.table_model.get_data(ind, 5) for ind in rows], dtype=float) / 60
+        return np.clip(rates_up, 1e-9, None), np.clip(rates_down, 1e-9, None)
+
+    def set_scan(self):
+        super().set_scan()
+        if self.positions is None or self.positions.shape[0] < 2:
+            return
+        rates_up, rates_down = self.get_rates()
+        settle_time = self.settings['settle_time']
+        order = order_points(self.positions, rates_up, rates_down, settle_time)
+        if self.positions.shape[0] <= MAX_POINTS_FOR_2OPT:
+            costs = transition_costs(self.positions, rates_up, rates_down, settle_time)
+            self.settings.child('grid_time').setValue(path_cost(costs, np.arange(self.positions.shape[0])))
+            self.settings.child('estimated_time').setValue(path_cost(costs, order))
+        self.get_info_from_positions(self.positions[order])
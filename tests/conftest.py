@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests of the drivers, running without a generator
+"""
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers
+
+from fakes import FakeClient
+
+
+@pytest.fixture
+def driver():
+    driver = CellKraftE1500Drivers('localhost')
+    driver.instr.modbus = FakeClient()
+    return driver
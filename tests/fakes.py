@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory fake of the pymodbus client, for the tests of the drivers running without a generator
+"""
+from pymodbus.exceptions import ModbusIOException
+
+
+class FakeResponse:
+    def __init__(self, registers=None, error=False, retries=0):
+        self.registers = registers
+        self.error = error
+        self.retries = retries
+
+    def isError(self):
+        return self.error
+
+
+class FakeClient:
+    """Answers like a pymodbus ModbusTcpClient, from a dict of registers"""
+    def __init__(self):
+        self.memory = {}
+        self.fail = None  # None, 'error' or 'timeout'
+
+    def _answer(self, response):
+        if self.fail == 'timeout':
+            raise ModbusIOException('No response received')
+        if self.fail == 'error':
+            return FakeResponse(error=True)
+        return response
+
+    def read_input_registers(self, address, count=1):
+        return self._answer(FakeResponse([self.memory.get(address + ind, 0) for ind in range(count)]))
+
+    def write_register(self, address, value):
+        self.memory[address] = value
+        return self._answer(FakeResponse())
+
+    def write_registers(self, address, values):
+        self.memory.update(zip(range(address, address + len(values)), values))
+        return self._answer(FakeResponse())
+
+    def close(self):
+        pass
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal Modbus TCP server emulating a generator behind a high latency link, for the tests of the transports
+"""
+import queue
+import socket
+import struct
+import threading
+import time
+
+
+def answer(memory: dict, pdu: bytes) -> bytes:
+    """PDU answering the request pdu, registers being read from and written to memory"""
+    function_code = pdu[0]
+    if function_code == 4:
+        address, count = struct.unpack('>HH', pdu[1:5])
+        return struct.pack(f'>BB{count}H', 4, 2 * count, *[memory.get(address + ind, 0) for ind in range(count)])
+    if function_code == 6:
+        address, value = struct.unpack('>HH', pdu[1:5])
+        memory[address] = value
+        return pdu[:5]
+    if function_code == 16:
+        address, count = struct.unpack('>HH', pdu[1:5])
+        memory.update(zip(range(address, address + count), struct.unpack(f'>{count}H', pdu[6:6 + 2 * count])))
+        return pdu[:5]
+    return struct.pack('>BB', function_code | 0x80, 1)  # illegal function
+
+
+class ModbusTcpTestServer:
+    """Answer each request after latency seconds, requests in flight being answered concurrently
+
+    :param latency: seconds between a request and its answer
+    :param pipelining: if False, requests received while another one is in flight are dropped, as done by some
+     controllers
+
+    silence_connections makes the connections opened so far swallow their requests without any answer, as a session
+    silently dropped by a firewall, new connections being answered.
+    """
+    def __init__(self, latency: float = 0., pipelining: bool = True):
+        self.latency = latency
+        self.pipelining = pipelining
+        self.memory = {}
+        self.received = 0
+        self.connections = 0
+        self.silenced = 0  # connections with a lower index are not answered
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.running = False
+        self.listener.close()
+
+    def silence_connections(self):
+        self.silenced = self.connections
+
+    def _accept(self):
+        while self.running:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            answers = queue.Queue()
+            in_flight = [0]
+            self.connections += 1
+            threading.Thread(target=self._read, args=(connection, answers, in_flight, self.connections - 1),
+                             daemon=True).start()
+            threading.Thread(target=self._write, args=(connection, answers, in_flight), daemon=True).start()
+
+    def _read(self, connection, answers, in_flight, index):
+        buffer = b''
+        while self.running:
+            try:
+                chunk = connection.recv(4096)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            while len(buffer) >= 7:
+                transaction_id, _, length, unit = struct.unpack('>HHHB', buffer[:7])
+                if len(buffer) < 6 + length:
+                    break
+                pdu, buffer = buffer[7:6 + length], buffer[6 + length:]
+                self.received += 1
+                if index < self.silenced or (not self.pipelining and in_flight[0]):
+                    continue
+                in_flight[0] += 1
+                response = answer(self.memory, pdu)
+                answers.put((time.perf_counter() + self.latency,
+                             struct.pack('>HHHB', transaction_id, 0, len(response) + 1, unit) + response))
+        answers.put(None)
+
+    def _write(self, connection, answers, in_flight):
+        while True:
+            item = answers.get()
+            if item is None:
+                break
+            due, frame = item
+            time.sleep(max(0., due - time.perf_counter()))
+            in_flight[0] -= 1
+            try:
+                connection.sendall(frame)
+            except OSError:
+                break
+        connection.close()
+
+
+class RtuTestDevice:
+    """Modbus RTU slave answering on a pseudo-terminal (as a serial line) or on a TCP socket (as a serial gateway)
+
+    The silences between the end of an answer and the next request are kept in self.gaps.
+
+    :param unit: Modbus unit identifier of the device
+    """
+    def __init__(self, unit: int = 1):
+        from pymodaq_plugins_cellkraft.hardware.transports.rtu import crc16
+        self.crc16 = crc16
+        self.unit = unit
+        self.memory = {}
+        self.gaps = []
+        self.corrupt_next = False
+        self.running = True
+        self._read = self._write = None
+        self._closing = []
+
+    def serve_pty(self) -> str:
+        """Serve on a new pseudo-terminal, return the path of its serial side"""
+        import os
+        import tty
+        controller, line = os.openpty()
+        tty.setraw(line)
+        self._closing = [lambda: os.close(controller), lambda: os.close(line)]
+
+        def read(size):
+            data = b''
+            while len(data) < size:
+                data += os.read(controller, size - len(data))
+            return data
+        self._read, self._write = read, lambda data: os.write(controller, data)
+        threading.Thread(target=self._serve, daemon=True).start()
+        return os.ttyname(line)
+
+    def serve_tcp(self) -> int:
+        """Serve the first connection to a local TCP port, returned"""
+        listener = socket.create_server(('127.0.0.1', 0))
+        self._closing = [listener.close]
+
+        def serve():
+            connection, _ = listener.accept()
+            self._closing.append(connection.close)
+
+            def read(size):
+                data = b''
+                while len(data) < size:
+                    chunk = connection.recv(size - len(data))
+                    if not chunk:
+                        raise OSError('closed')
+                    data += chunk
+                return data
+            self._read, self._write = read, connection.sendall
+            self._serve()
+        threading.Thread(target=serve, daemon=True).start()
+        return listener.getsockname()[1]
+
+    def close(self):
+        self.running = False
+        for close in self._closing:
+            try:
+                close()
+            except OSError:
+                pass
+
+    def _serve(self):
+        answered = None
+        while self.running:
+            try:
+                frame = self._read(2)
+                if answered is not None:
+                    self.gaps.append(time.perf_counter() - answered)
+                frame += self._read(5 if frame[1] == 16 else 6)
+                if frame[1] == 16:
+                    frame += self._read(frame[6] + 2)
+            except OSError:
+                return
+            if self.crc16(frame[:-2]) != int.from_bytes(frame[-2:], 'little') or frame[0] != self.unit:
+                continue
+            response = bytes([self.unit]) + answer(self.memory, frame[1:-2])
+            crc = self.crc16(response) ^ (0xFFFF if self.corrupt_next else 0)
+            self.corrupt_next = False
+            self._write(response + crc.to_bytes(2, 'little'))
+            answered = time.perf_counter()
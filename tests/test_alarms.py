@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized alarm and interlock engine
+"""
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.alarms import AlarmEngine
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Flow, Tube
+
+from modbus_server import ModbusTcpTestServer
+
+CHANNELS = ['Steam', 'Air', 'Flow', 'Pressure', 'Tube', 'Pump']
+
+
+def snapshot(timestamp, **values):
+    return dict(dict.fromkeys(CHANNELS, 0.), timestamp=timestamp, **values)
+
+
+def test_threshold_with_hysteresis():
+    engine = AlarmEngine(CHANNELS)
+    engine.add_rule('tube hot', 'Tube', 'high', 250., hysteresis=5.)
+    engine.add_rule('pressure low', 'Pressure', 'low', 1., hysteresis=0.2)
+    assert engine.evaluate(snapshot(0., Tube=240., Pressure=1.5)) == []
+    assert engine.evaluate(snapshot(1., Tube=251., Pressure=0.9)) == ['tube hot', 'pressure low']
+    assert engine.evaluate(snapshot(2., Tube=247., Pressure=1.1)) == []
+    assert engine.alarms == ['tube hot', 'pressure low']  # within the hysteresis
+    engine.evaluate(snapshot(3., Tube=244., Pressure=1.3))
+    assert engine.alarms == []
+    assert [event[1:] for event in engine.events] == [('tube hot', 'raised'), ('pressure low', 'raised'),
+                                                     ('tube hot', 'cleared'), ('pressure low', 'cleared')]
+
+
+def test_rate_and_stuck():
+    engine = AlarmEngine(CHANNELS)
+    engine.add_rule('tube ramp', 'Tube', 'rate', 2.)
+    engine.add_rule('flow stalled', 'Flow', 'stuck', 10., tolerance=0.05)
+    engine.evaluate(snapshot(0., Tube=100., Flow=5.))
+    assert engine.evaluate(snapshot(1., Tube=101.5, Flow=5.02)) == []
+    assert engine.evaluate(snapshot(2., Tube=98., Flow=5.01)) == ['tube ramp']  # -3.5 °C/s
+    assert engine.evaluate(snapshot(11., Tube=98., Flow=5.04)) == ['flow stalled']
+    assert engine.alarms == ['flow stalled']
+    engine.evaluate(snapshot(12., Tube=98., Flow=6.))
+    assert engine.alarms == []
+
+
+def test_latching_and_acknowledge():
+    engine = AlarmEngine(CHANNELS)
+    engine.add_rule('tube hot', 'Tube', 'high', 250., latching=True)
+    engine.evaluate(snapshot(0., Tube=260.))
+    engine.evaluate(snapshot(1., Tube=200.))
+    assert engine.alarms == ['tube hot']  # latched
+    assert engine.acknowledge('tube hot') == ['tube hot']
+    assert engine.alarms == []
+    assert engine.events[-1][1:] == ('tube hot', 'cleared')
+    engine.evaluate(snapshot(2., Tube=260.))
+    assert engine.acknowledge() == []  # acknowledged while the condition is still on
+    assert engine.alarms == ['tube hot']
+    engine.evaluate(snapshot(3., Tube=200.))
+    assert engine.alarms == []
+
+
+def test_rule_validation():
+    engine = AlarmEngine(CHANNELS)
+    engine.add_rule('tube hot', 'Tube', 'high', 250.)
+    with pytest.raises(ValueError):
+        engine.add_rule('tube hot', 'Tube', 'high', 260.)
+    with pytest.raises(ValueError):
+        engine.add_rule('other', 'Unknown', 'high', 1.)
+    with pytest.raises(ValueError):
+        engine.add_rule('other', 'Tube', 'above', 1.)
+
+
+def test_many_rules_single_pass():
+    engine = AlarmEngine(CHANNELS)
+    for index in range(5000):
+        engine.add_rule(f'rule {index}', CHANNELS[index % len(CHANNELS)], 'high', 1000. + index)
+    engine.evaluate(snapshot(0.))
+    start = time.perf_counter()
+    for index in range(100):
+        engine.evaluate(snapshot(index + 1.))
+    assert (time.perf_counter() - start) / 100 < 0.01
+    assert engine.evaluate(snapshot(200., Tube=1004.5)) == ['rule 4']
+
+
+def test_interlock_stops_the_generator():
+    server = ModbusTcpTestServer()
+    server.memory[Flow.write_address.value] = 50
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port)
+    driver.init_hardware()
+    try:
+        engine = AlarmEngine([reference.__name__ for reference in driver.snapshot_channels], driver)
+        engine.add_rule('tube hot', 'Tube', 'high', 250., latching=True, interlock=True)
+        raised = []
+        engine.subscribe(lambda timestamp, names, cleared: raised.extend(names))
+        engine.attach(driver.start_stream(0.02))
+        time.sleep(0.1)
+        assert engine.stops == 0 and server.memory[Flow.write_address.value] == 50
+        server.memory[Tube.read_address.value] = 2600
+        deadline = time.perf_counter() + 5
+        while engine.stops == 0 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert raised == ['tube hot'] and engine.stops == 1
+        assert server.memory[Flow.write_address.value] == 0
+    finally:
+        driver.close()
+        server.close()
+
+
+class FailingDriver:
+    """Driver whose first stops fail, as on a write timeout"""
+    host = 'stub'
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def stop(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise TimeoutError('no answer to the flow write')
+
+
+def test_interlock_stop_retried():
+    driver = FailingDriver(failures=2)
+    engine = AlarmEngine(CHANNELS, driver)
+    engine.add_rule('tube hot', 'Tube', 'high', 250., interlock=True)
+    engine.add_rule('steam hot', 'Steam', 'high', 250.)
+    assert engine.evaluate(snapshot(0., Tube=260.)) == ['tube hot']
+    assert driver.calls == 1 and engine.stops == 0  # failed, not counted
+    engine.evaluate(snapshot(1., Tube=100.))  # retried even once the alarm cleared
+    assert driver.calls == 2 and engine.stops == 0
+    engine.evaluate(snapshot(2., Tube=100., Steam=300.))
+    assert driver.calls == 3 and engine.stops == 1
+    engine.evaluate(snapshot(3., Tube=100.))
+    assert driver.calls == 3 and engine.stops == 1  # done, no more stops
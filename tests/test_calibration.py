@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Per-channel calibration of the readbacks, compiled into lookup tables over the raw registers
+"""
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.calibration import Calibration, LUT_SIZE
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Air, Steam
+
+from modbus_server import ModbusTcpTestServer
+
+CHANNELS = ['Steam', 'Air', 'Flow', 'Pressure', 'Tube', 'Pump']
+SCALINGS = [10, 10, 10, 100, 10, 1]
+
+
+def test_table_and_polynomial():
+    calibration = Calibration({'Air': dict(readings=[90., 10., 50.], references=[92., 11., 51.]),
+                               'Steam': dict(coefficients=[0.5, 1.01, 0.001])})
+    assert calibration.correct('Air', [10., 30., 70., 0., 100.]).tolist() == pytest.approx([11., 31., 71.5, 1.,
+                                                                                             102.25])
+    assert calibration.correct('Steam', [100.]).tolist() == pytest.approx([0.5 + 101. + 10.])
+    assert calibration.correct('Flow', [3.]).tolist() == [3.]
+    for channel, reading, expected in (('Air', 30., 31.), ('Steam', 100., 111.5), ('Flow', 3., 3.)):  # single values
+        corrected = calibration.correct(channel, reading)
+        assert isinstance(corrected, float) and corrected == pytest.approx(expected)
+    assert calibration.correct('Air', np.float64(0.)) == pytest.approx(1.)
+    with pytest.raises(ValueError):
+        calibration.add('Tube', readings=[1., 1.], references=[2., 3.])
+    with pytest.raises(ValueError):
+        calibration.add('Tube', readings=[1.], references=[2.])
+
+
+def test_fit_and_file(tmp_path):
+    rng = np.random.default_rng(0)
+    readings = rng.uniform(10, 90, 200)
+    references = 0.8 + 1.02 * readings - 0.0004 * readings ** 2 + rng.normal(0, 0.01, 200)
+    readings[:3] = np.nan
+    calibration = Calibration.fit({'Air': readings}, {'Air': references}, degree=2)
+    assert calibration.corrections['Air']['coefficients'] == pytest.approx([0.8, 1.02, -0.0004], rel=0.02)
+    calibration.save(tmp_path.joinpath('calibration.toml'))
+    loaded = Calibration.load(tmp_path.joinpath('calibration.toml'))
+    assert loaded.correct('Air', [50.]) == pytest.approx(calibration.correct('Air', [50.]))
+
+
+def test_lookup_table():
+    calibration = Calibration({'Air': dict(readings=[0., 100.], references=[0., 110.])})
+    table = calibration.compile(CHANNELS, SCALINGS)
+    raw = np.arange(LUT_SIZE)
+    assert table.shape == (LUT_SIZE, len(CHANNELS))
+    assert np.array_equal(table[:, 0], raw / 10) and np.array_equal(table[:, 3], raw / 100)
+    assert table[500, 1] == pytest.approx(55.)
+
+
+def test_driver_readbacks(tmp_path):
+    server = ModbusTcpTestServer()
+    server.memory[Air.read_address.value] = 500
+    server.memory[Steam.read_address.value] = 1200
+    path = tmp_path.joinpath('calibration.toml')
+    Calibration({'Air': dict(readings=[0., 100.], references=[0., 110.])}).save(path)
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port, calibration=Calibration.load(path))
+    driver.init_hardware()
+    try:
+        snapshot = driver.get_snapshot()
+        assert snapshot['Air'] == pytest.approx(55.) and snapshot['Steam'] == 120.
+        assert driver.read_channel('Air') == pytest.approx(55.)
+        raw = np.random.default_rng(0).integers(0, LUT_SIZE, (1000, len(CHANNELS))).astype(np.uint16)
+        decoded = driver.decode_snapshot(raw)
+        assert np.allclose(decoded[:, 1], raw[:, 1] * 1.1 / 10) and np.array_equal(decoded[:, 0], raw[:, 0] / 10)
+        driver.set_calibration(None)
+        assert driver.get_snapshot()['Air'] == 50. and driver.read_channel(Air) == 50.
+    finally:
+        driver.close()
+        server.close()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Derived channels computed incrementally from the snapshots
+"""
+import math
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.derived import DerivedChannels, DERIVED_CHANNELS, \
+    absolute_humidity, dew_point, saturation_pressure, water_dosed
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Air, Flow, Steam
+
+
+def test_humidity_formulas():
+    assert dew_point(50., 20.) == pytest.approx(9.26, abs=0.02)
+    assert dew_point(100., 80.) == pytest.approx(80.)
+    assert dew_point(100., 150.) == pytest.approx(150.)  # steam above the boiling point
+    assert absolute_humidity(50., 20.) == pytest.approx(8.64, abs=0.02)
+    assert saturation_pressure(100.) == pytest.approx(101418., rel=1e-4)
+    assert absolute_humidity(100., 100.) == pytest.approx(589., rel=0.01)
+    assert dew_point(np.array([50., 100.]), np.array([20., 80.])) == pytest.approx([9.26, 80.], abs=0.02)
+
+
+def test_water_trapezoid_on_sample_times():
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.uniform(0.1, 3., 1000))  # irregular polling
+    flows = 10. + times / 60.  # linear ramp: the trapezoidal rule is exact
+    derived = DerivedChannels()
+    water = [derived.update(dict(timestamp=t, Flow=f, Air=50., Steam=20.))['Water'] for t, f in zip(times, flows)]
+    assert np.allclose(water, water_dosed(times, flows))
+    duration = times[-1] - times[0]
+    assert water[-1] == pytest.approx((10. * duration + (times[-1] ** 2 - times[0] ** 2) / 120.) / 60.)
+    derived.reset()
+    assert derived.update(dict(timestamp=0., Flow=10.))['Water'] == 0.
+
+
+def test_gaps_and_missing_values():
+    derived = DerivedChannels(max_gap=5.)
+    derived.update(dict(timestamp=0., Flow=6.))
+    assert derived.update(dict(timestamp=60., Flow=6.))['Water'] == 0.  # too long a gap, flow unknown meanwhile
+    assert derived.update(dict(timestamp=61., Flow=math.nan))['Water'] == 0.
+    values = derived.update(dict(timestamp=62., Flow=6.))
+    assert values['Water'] == pytest.approx(0.2)
+    assert math.isnan(values['DewPoint']) and math.isnan(values['AbsHumidity'])
+
+
+def test_stream_adds_derived_channels(driver):
+    memory = driver.instr.modbus.memory
+    memory[Air.read_address.value], memory[Steam.read_address.value], memory[Flow.read_address.value] = 500, 200, 60
+    received = []
+    stream = driver.start_stream(interval=0.02)
+    stream.subscribe(received.append)
+    time.sleep(0.2)
+    driver.stop_stream()
+    assert stream.history.channels[-len(DERIVED_CHANNELS):] == list(DERIVED_CHANNELS)
+    assert received[-1]['DewPoint'] == pytest.approx(9.26, abs=0.02)
+    duration = received[-1]['timestamp'] - received[0]['timestamp']
+    assert received[-1]['Water'] == pytest.approx(6. * duration / 60.)
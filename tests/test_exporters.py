@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked export of Cellkraft time series to CSV and Parquet
+"""
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pymodaq.utils.data import DataRaw, DataToExport
+from pymodaq.utils.h5modules.backends import H5Backend
+from pymodaq.utils.h5modules.data_saving import DataToExportTimedSaver
+from pymodaq.utils.h5modules.exporter import ExporterFactory
+from pymodaq.utils.h5modules.saving import H5SaverLowLevel
+
+from pymodaq_plugins_cellkraft.exporters.cellkraft_tables import TimeSeries, export_series, main, parse_time
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogWriter
+
+ROWS = 50
+T0 = 1.7e9
+
+
+@pytest.fixture
+def h5_path(tmp_path):
+    path = tmp_path.joinpath('scan.h5')
+    h5saver = H5SaverLowLevel()
+    h5saver.init_file(file_name=path, new_file=True)
+    saver = DataToExportTimedSaver(h5saver)
+    detector = h5saver.get_set_group(h5saver.raw_group, 'Cellkraft')
+    for index in range(ROWS):
+        data = DataToExport('cellkraft', data=[DataRaw('Cellkraft', data=[np.array([100. + index]),
+                                                                          np.array([50. - index])],
+                                                       labels=['Steam', 'Air'])])
+        data.timestamp = T0 + index
+        saver.add_data(detector, data)
+    h5saver.close_file()
+    yield path
+
+
+@pytest.fixture
+def series(h5_path):
+    h5file = H5Backend('tables')
+    h5file.open_file(str(h5_path), 'r')
+    yield TimeSeries.from_h5(h5file.get_node('/RawData/Cellkraft'), chunk_rows=16)
+    h5file.close_file()
+
+
+def read_csv(path):
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt') as file:
+        header = file.readline().strip().split(',')
+        return header, np.loadtxt(file, delimiter=',', ndmin=2)
+
+
+def test_h5_chunks(series):
+    assert series.columns == ['Steam', 'Air']
+    chunks = list(series.chunks())
+    assert [len(times) for times, _ in chunks] == [16, 16, 16, 2]
+    assert chunks[1][0][0] == T0 + 16 and chunks[1][1][0].tolist() == [116., 34.]
+
+
+@pytest.mark.parametrize('name', ['out.csv', 'out.csv.gz'])
+def test_csv(tmp_path, series, name):
+    rows = export_series(series, tmp_path.joinpath(name), channels=['Air'], start=T0 + 10, stop=T0 + 40.5,
+                         workers=3)
+    header, table = read_csv(tmp_path.joinpath(name))
+    assert rows == 31 and header == ['timestamp', 'Air']
+    assert table[:, 0].tolist() == [T0 + index for index in range(10, 41)]
+    assert table[:, 1].tolist() == [50. - index for index in range(10, 41)]
+
+
+def test_parquet(tmp_path, series):
+    pq = pytest.importorskip('pyarrow.parquet')
+    assert export_series(series, tmp_path.joinpath('out.parquet')) == ROWS
+    parquet = pq.ParquetFile(tmp_path.joinpath('out.parquet'))
+    assert parquet.metadata.num_row_groups == 4
+    table = parquet.read()
+    assert table.column_names == ['timestamp', 'Steam', 'Air']
+    assert table.column('Steam').to_pylist() == [100. + index for index in range(ROWS)]
+
+
+def test_rawlog(tmp_path):
+    writer = RawLogWriter(tmp_path.joinpath('log.ckr'), ['Steam', 'Flow'], [10, 10], block_size=7)
+    for index in range(20):
+        writer.write({'timestamp': T0 + index, 'Steam': 120.5, 'Flow': index / 10})
+    writer.close()
+    main([str(writer.path), str(tmp_path.joinpath('out.csv')), '--start', str(T0 + 5)])
+    header, table = read_csv(tmp_path.joinpath('out.csv'))
+    assert header == ['timestamp', 'Steam', 'Flow'] and len(table) == 15
+    assert np.allclose(table[:, 2], np.arange(5, 20) / 10)
+
+
+def test_pymodaq_exporter(tmp_path, h5_path):
+    exporter = ExporterFactory.create_exporter('csv', 'Time series table (chunked)')
+    h5file = H5Backend('tables')
+    h5file.open_file(str(h5_path), 'r')
+    try:
+        exporter.export_data(h5file.get_node('/RawData/Cellkraft/Data0D/CH00/EnlData01'),
+                             str(tmp_path.joinpath('air.csv')))
+    finally:
+        h5file.close_file()
+    header, table = read_csv(tmp_path.joinpath('air.csv'))
+    assert header == ['timestamp', 'Air'] and table[0].tolist() == [T0, 50.]
+
+
+def test_parse_time():
+    assert parse_time(None) is None and parse_time('12.5') == 12.5
+    assert parse_time('2024-05-01T08:00:00+00:00') == 1714550400.
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour of the driver through a link degraded by FaultyProxy, against a local server emulating the generator
+
+Run this file as a script to print the benchmark of every scenario for several request timeouts.
+"""
+import statistics
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.faults import FaultProfile, FaultyProxy, SCENARIOS, run_scenario, \
+    format_result
+from pymodaq_plugins_cellkraft.hardware.transports import TcpTransport, ModbusFrameError, READ_INPUT_REGISTERS, \
+    decode_response
+
+from modbus_server import ModbusTcpTestServer
+
+
+@pytest.fixture
+def server():
+    server = ModbusTcpTestServer()
+    server.memory.update({4148: 1200})
+    yield server
+    server.close()
+
+
+def test_latency_distributions():
+    assert FaultProfile(latency=0.01).sample_latency() == 0.01
+    uniform = [FaultProfile(0.01, 0.005, 'uniform', seed=1).sample_latency() for _ in range(100)]
+    assert all(0.005 <= latency <= 0.015 for latency in uniform)
+    profile = FaultProfile(0.01, 0.5, 'lognormal', seed=1)
+    assert statistics.median(profile.sample_latency() for _ in range(2001)) == pytest.approx(0.01, rel=0.1)
+    with pytest.raises(ValueError):
+        FaultProfile(distribution='pareto')
+
+
+def test_decode_malformed():
+    assert decode_response(bytes([4, 2, 0, 7]), READ_INPUT_REGISTERS).registers == [7]
+    for pdu, function_code in ((bytes([4, 5, 0, 7]), 4), (bytes([0x2B, 2, 0, 7]), 4), (bytes([6, 0]), 6),
+                               (bytes([4]), None)):
+        with pytest.raises(ModbusFrameError):
+            decode_response(pdu, function_code)
+
+
+def test_transparent(server):
+    proxy = FaultyProxy('127.0.0.1', server.port, FaultProfile(latency=0.01))
+    client = TcpTransport('127.0.0.1', proxy.port, window=4)
+    responses = client.execute([(READ_INPUT_REGISTERS, 4148, 1)] * 8)
+    assert [response.registers for response in responses] == [[1200]] * 8
+    assert all((response.received - response.sent) / 1e9 >= 0.01 for response in responses)
+    client.close()
+    proxy.close()
+
+
+@pytest.mark.parametrize('fault, error', [('drop', TimeoutError), ('reset', ConnectionError),
+                                          ('malformed', ModbusFrameError)])
+def test_recovery(server, fault, error):
+    profile = FaultProfile()
+    proxy = FaultyProxy('127.0.0.1', server.port, profile)
+    client = TcpTransport('127.0.0.1', proxy.port, window=1, timeout=0.2)
+    assert client.read_input_registers(4148).registers == [1200]
+    setattr(profile, f'{fault}_probability', 1.)
+    if fault == 'malformed':
+        profile.random.choice = lambda kinds: 'function_code'
+    with pytest.raises(error):
+        client.read_input_registers(4148)
+    assert not client.connected
+    setattr(profile, f'{fault}_probability', 0.)
+    assert client.read_input_registers(4148).registers == [1200]
+    assert proxy.injected[{'drop': 'drops', 'reset': 'resets', 'malformed': 'malformed'}[fault]] == 1
+    client.close()
+    proxy.close()
+
+
+def test_benchmark(server):
+    clean = run_scenario('127.0.0.1', server.port, duration=0.3, timeout=0.2)
+    assert clean['failures'] == 0 and clean['outages'] == 0 and clean['poll_rate'] > 10
+    lossy = run_scenario('127.0.0.1', server.port, FaultProfile(drop_probability=0.05, seed=0), duration=1.,
+                         timeout=0.05)
+    assert lossy['injected']['drops'] > 0
+    assert lossy['failures'] > 0 and lossy['outages'] > 0
+    assert lossy['stall_time'] >= 0.05 * lossy['failures']
+    assert 0 < lossy['recovery_time']['mean'] <= lossy['recovery_time']['max'] <= lossy['max_gap']
+    assert lossy['poll_rate'] < clean['poll_rate']
+
+
+if __name__ == '__main__':
+    server = ModbusTcpTestServer(latency=0.01)
+    for scenario, profile in SCENARIOS.items():
+        for timeout in (0.1, 0.3, 1.):
+            print(format_result(f'{scenario} ({timeout:.1f} s)',
+                                run_scenario('127.0.0.1', server.port, FaultProfile(**profile, seed=0), duration=5.,
+                                             timeout=timeout)))
+    server.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Gateway sharing one generator session between many clients, against a local server emulating the generator
+"""
+import itertools
+import sys
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Steam
+from pymodaq_plugins_cellkraft.hardware.gateway import GatewayServer, GatewayClient
+
+from modbus_server import ModbusTcpTestServer
+
+INTERVAL = 0.02
+
+
+@pytest.fixture
+def server():
+    server = ModbusTcpTestServer()
+    server.memory[Steam.read_address.value] = 1205
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def gateway(server):
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port)
+    driver.init_hardware()
+    gateway = GatewayServer(driver, '127.0.0.1:0', interval=INTERVAL, tokens={'secret': 'write'})
+    gateway.start()
+    time.sleep(3 * INTERVAL)
+    yield gateway
+    gateway.stop()
+    driver.close()
+
+
+def device_rate(server, duration=0.3):
+    start = server.received
+    time.sleep(duration)
+    return (server.received - start) / duration
+
+
+def test_fan_out(server, gateway):
+    address = f'127.0.0.1:{gateway.port}'
+    alone = device_rate(server)
+    clients = [GatewayClient(address) for _ in range(20)]
+    streams = [client.subscribe() for client in clients]
+    received = [list(itertools.islice(stream, 3)) for stream in streams]
+    assert all(snapshots[-1]['Steam'] == 120.5 for snapshots in received)
+    assert clients[0].snapshot()['Steam'] == 120.5
+    assert device_rate(server) < 1.5 * alone  # the device load does not depend on the clients
+    assert clients[1].stats()['clients'] == 20
+    for client in clients:
+        client.close()
+
+
+def test_access_control(server, gateway):
+    address = f'127.0.0.1:{gateway.port}'
+    reader = GatewayClient(address)
+    with pytest.raises(IOError, match='denied'):
+        reader.write({'RH': 30})
+    writer = GatewayClient(address, token='secret')
+    assert writer.write({'RH': 30})['Steam'] == 120.5
+    assert server.memory[gateway.driver.registers['RH']['register']] == 300
+    with pytest.raises(IOError, match='authorized'):
+        writer.write({'RH': 1000})
+    gateway.anonymous = None
+    stranger = GatewayClient(address)
+    with pytest.raises(IOError, match='authentication'):
+        stranger.snapshot()
+    for client in (reader, writer, stranger):
+        client.close()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='no Unix sockets')
+def test_unix_socket(server, tmp_path):
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port)
+    driver.init_hardware()
+    path = str(tmp_path.joinpath('cellkraft.sock'))
+    gateway = GatewayServer(driver, path, interval=INTERVAL)
+    gateway.start()
+    client = GatewayClient(path)
+    assert next(client.subscribe())['Steam'] == 120.5
+    client.close()
+    gateway.stop()
+    driver.close()
+    assert not tmp_path.joinpath('cellkraft.sock').exists()
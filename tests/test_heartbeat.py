@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Keep-alive heartbeat of SyncModBusInstrument, against a local server whose sessions can be silently dropped
+"""
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Steam
+
+from modbus_server import ModbusTcpTestServer
+
+TIMEOUT = 0.2
+
+
+@pytest.fixture
+def server():
+    server = ModbusTcpTestServer()
+    server.memory.update({Steam.read_address.value: 1205})
+    yield server
+    server.close()
+
+
+def make_driver(server, heartbeat_interval):
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port, heartbeat_interval=heartbeat_interval,
+                                   timeout=TIMEOUT)
+    driver.init_hardware()
+    assert driver.init
+    return driver
+
+
+def test_without_heartbeat(server):
+    driver = make_driver(server, 0.)
+    assert driver.read_channel(Steam) == 120.5
+    server.silence_connections()
+    with pytest.raises(TimeoutError):
+        driver.read_channel(Steam)
+    driver.close()
+
+
+def test_reconnect_while_idle(server):
+    driver = make_driver(server, 0.1)
+    assert driver.read_channel(Steam) == 120.5
+    server.silence_connections()
+    deadline = time.perf_counter() + 3.
+    while driver.instr.reconnects == 0 and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    assert driver.instr.reconnects == 1
+    start = time.perf_counter()
+    assert driver.read_channel(Steam) == 120.5
+    assert time.perf_counter() - start < TIMEOUT / 2
+    stats = driver.get_stats()
+    assert stats['heartbeats'] >= 1 and stats['reconnects'] == 1
+    assert stats['registers']['read_input_registers/Steam']['calls'] == 2  # heartbeats are not accounted for
+    assert stats['registers']['read_input_registers/Steam']['timeouts'] == 0
+    driver.close()
+    assert driver.instr._heartbeat_thread is None
+
+
+def test_no_heartbeat_while_busy(server):
+    driver = make_driver(server, 0.1)
+    end = time.perf_counter() + 0.4
+    while time.perf_counter() < end:
+        driver.read_channel(Steam)
+        time.sleep(0.02)
+    assert driver.instr.heartbeats == 0
+    time.sleep(0.25)
+    assert driver.instr.heartbeats >= 1 and driver.instr.reconnects == 0
+    driver.instr.start_heartbeat(0.)
+    assert driver.instr._heartbeat_thread is None
+    driver.close()
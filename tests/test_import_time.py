@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Import time budget of the plugin package
+
+PyMoDAQ imports every installed plugin package when building the dashboard, so importing this package must stay
+cheap: pymodaq, Qt, pymodbus and the TOML configuration are only loaded on first use, which is what the tests check.
+The import times are measured in fresh interpreters, each one first importing BASELINE (numpy, loaded by pymodaq
+anyway): the budgets are fractions of that baseline import, timed in the same interpreter, so that a slow or loaded
+machine slows both down alike. Run this file as a script to print them.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+PKG_NAME = 'pymodaq_plugins_cellkraft'
+
+BASELINE = 'numpy'  # imported first in each interpreter, the import times being compared to its own
+
+# (module to import, budget as a fraction of the BASELINE import time)
+BUDGETS = [
+    (PKG_NAME, 0.1),
+    (f'{PKG_NAME}.hardware.cellkraft.Eseries', 0.5),
+]
+
+LAZY_DEPENDENCIES = ['pymodaq', 'pymodbus', 'qtpy', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6', 'toml']
+
+
+def measure_import(module: str, repeat: int = 3):
+    """Best import time of module relative to the BASELINE import over repeat fresh interpreters
+
+    :return: (ratio of the import times, import time of module in s, modules loaded by module)
+    """
+    code = (f"import sys, time, json\n"
+            f"start = time.perf_counter()\n"
+            f"import {BASELINE}\n"
+            f"baseline = time.perf_counter() - start\n"
+            f"before = set(sys.modules)\n"
+            f"start = time.perf_counter()\n"
+            f"import {module}\n"
+            f"duration = time.perf_counter() - start\n"
+            f"print(json.dumps([duration, baseline, sorted(set(sys.modules) - before)]))\n")
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True)
+        duration, baseline, loaded = json.loads(output.stdout.strip().splitlines()[-1])
+        if best is None or duration / baseline < best[0]:
+            best = (duration / baseline, duration)
+    return best + (loaded,)
+
+
+@pytest.mark.parametrize('module, budget', BUDGETS)
+def test_import_budget(module, budget):
+    ratio, duration, _ = measure_import(module)
+    assert ratio < budget, f'importing {module} took {duration * 1000:.1f} ms, {ratio:.2f} times the {BASELINE} ' \
+                           f'import (budget {budget:.2f})'
+
+
+@pytest.mark.parametrize('module', [PKG_NAME, f'{PKG_NAME}.hardware.cellkraft.Eseries'])
+def test_heavy_dependencies_are_lazy(module):
+    *_, loaded = measure_import(module, repeat=1)
+    for dependency in LAZY_DEPENDENCIES:
+        assert dependency not in loaded, f'importing {module} loads {dependency}'
+
+
+if __name__ == '__main__':
+    for module, budget in BUDGETS:
+        ratio, duration, loaded = measure_import(module)
+        print(f'{module}: {duration * 1000:.1f} ms, {ratio:.2f} times the {BASELINE} import (budget {budget:.2f}), '
+              f'{len(loaded)} modules loaded')
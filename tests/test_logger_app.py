@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Headless logger app, against local servers emulating generators
+"""
+import csv
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.app.cellkraft_logger import CellkraftLogger, RotatingCsvWriter, parse_host, load_alarms
+from pymodaq_plugins_cellkraft.hardware.cellkraft.calibration import Calibration
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Steam
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogReader
+
+from modbus_server import ModbusTcpTestServer
+
+
+@pytest.fixture
+def servers():
+    servers = [ModbusTcpTestServer(), ModbusTcpTestServer()]
+    for ind, server in enumerate(servers):
+        server.memory[Steam.read_address.value] = 1000 + ind
+    yield servers
+    for server in servers:
+        server.close()
+
+
+def read_rows(paths):
+    rows = []
+    for path in sorted(paths):
+        with open(path, newline='') as file:
+            rows.extend(csv.DictReader(file))
+    return rows
+
+
+def test_parse_host():
+    assert parse_host('gen01') == ('gen01', 502)
+    assert parse_host('gen01:5020', 502) == ('gen01', 5020)
+
+
+def test_rotation(tmp_path):
+    writer = RotatingCsvWriter(tmp_path, 'gen', ['Steam'], max_bytes=100, flush_interval=0.)
+    for ind in range(20):
+        writer.write({'timestamp': 1e9 + ind, 'Steam': 100. + ind})
+    writer.rotate()
+    writer.write({'timestamp': 1e9 + 20, 'Steam': 120.})
+    writer.close()
+    paths = list(tmp_path.glob('gen_*.csv'))
+    assert len(paths) > 3
+    assert all(path.stat().st_size < 100 + 30 for path in paths)
+    assert [float(row['Steam']) for row in read_rows(paths)] == [100. + ind for ind in range(21)]
+
+
+def test_logger(tmp_path, servers):
+    app = CellkraftLogger([f'127.0.0.1:{server.port}' for server in servers], tmp_path, interval=0.02,
+                          flush_interval=0.)
+    start = time.monotonic()
+    app.start()
+    time.sleep(0.3)
+    app.stop()
+    elapsed = time.monotonic() - start
+    for ind, (server, writer) in enumerate(zip(servers, app.writers)):
+        rows = read_rows(tmp_path.glob(f'127.0.0.1_{server.port}_*.csv'))
+        assert 0 < len(rows) == writer.rows <= elapsed / 0.02 + 1  # all the snapshots, paced by the interval
+        assert {float(row['Steam']) for row in rows} == {100. + ind / 10}
+        assert list(rows[0]) == ['timestamp', 'Steam', 'Air', 'Flow', 'Pressure', 'Tube', 'Pump', 'DewPoint',
+                                 'AbsHumidity', 'Water']
+
+
+def test_raw_logs(tmp_path, servers):
+    app = CellkraftLogger([f'127.0.0.1:{servers[0].port}'], tmp_path, interval=0.02, raw=True, flush_interval=0.05)
+    start = time.monotonic()
+    app.start()
+    time.sleep(0.3)
+    app.stop()
+    elapsed = time.monotonic() - start
+    reader = RawLogReader(next(tmp_path.glob('*.ckr')))
+    times, values = reader.read()
+    assert reader.channels == ['Steam', 'Air', 'Flow', 'Pressure', 'Tube', 'Pump']
+    assert 0 < len(times) == app.writers[0].rows <= elapsed / 0.02 + 1 and len(reader.blocks) > 1
+    assert np.all(values[:, 0] == 100.) and np.all(np.diff(times) > 0)
+
+
+def test_raw_logs_calibrated(tmp_path, servers):
+    calibration = Calibration({'Steam': dict(readings=[0., 1000.], references=[0., 1003.33])})
+    for raw in (True, False):
+        directory = tmp_path.joinpath('raw' if raw else 'csv')
+        app = CellkraftLogger([f'127.0.0.1:{servers[0].port}'], directory, interval=0.02, raw=raw, flush_interval=0.,
+                              calibration=calibration)
+        app.start()
+        time.sleep(0.1)
+        app.stop()
+    _, values = RawLogReader(next(tmp_path.joinpath('raw').glob('*.ckr'))).read()
+    assert len(values) and np.all(values[:, 0] == 100.)  # registers as read, to be corrected when reading
+    assert calibration.correct('Steam', values[0, 0]) == pytest.approx(100.333)
+    rows = read_rows(tmp_path.joinpath('csv').glob('*.csv'))
+    assert rows and [float(row['Steam']) for row in rows] == pytest.approx([100.333] * len(rows))
+
+
+def test_alarms(tmp_path, servers):
+    rules = tmp_path.joinpath('rules.toml')
+    rules.write_text('[[alarm]]\nname = "steam hot"\nchannel = "Steam"\nkind = "high"\nlimit = 100.05\n')
+    assert load_alarms(None) == []
+    app = CellkraftLogger([f'127.0.0.1:{server.port}' for server in servers], tmp_path, interval=0.02,
+                          alarms=load_alarms(rules))
+    app.start()
+    time.sleep(0.2)
+    app.stop()
+    assert [engine.alarms for engine in app.alarms] == [[], ['steam hot']]
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='SIGTERM cannot be caught on Windows')
+def test_sigterm(tmp_path, servers):
+    process = subprocess.Popen([sys.executable, '-m', 'pymodaq_plugins_cellkraft.app.cellkraft_logger',
+                                f'127.0.0.1:{servers[0].port}', '--interval', '0.05', '--directory', str(tmp_path),
+                                '--flush', '1000'], stderr=subprocess.PIPE, text=True)
+    deadline = time.perf_counter() + 20
+    while not list(tmp_path.glob('*.csv')) and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)
+    process.send_signal(signal.SIGTERM)
+    _, errors = process.communicate(timeout=20)
+    assert process.returncode == 0, errors
+    assert 'SIGTERM received' in errors
+    rows = read_rows(tmp_path.glob('*.csv'))
+    assert len(rows) >= 3 and float(rows[-1]['Steam']) == 100.
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampled time range queries over the raw register logs
+"""
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.logquery import LogQuery
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogReader, RawLogWriter, MISSING, summarize, \
+    summary_path
+
+T0 = 1.7e9
+CHANNELS = ['Steam', 'Air', 'Flow']
+
+
+def write_log(path, rows, start=T0, summary_rows=64, block_size=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    raw = 1000 + np.cumsum(rng.integers(-3, 4, (rows, len(CHANNELS))), axis=0)
+    raw[rng.uniform(size=rows) < 0.01, 2] = MISSING
+    writer = RawLogWriter(path, CHANNELS, [10, 10, 100], block_size=block_size, summary_rows=summary_rows)
+    for index, row in enumerate(raw):
+        writer.write_raw(start + index, row)
+    writer.close()
+    return writer.path
+
+
+def test_summary_file(tmp_path):
+    path = write_log(tmp_path.joinpath('log.ckr'), 5000)
+    reader = RawLogReader(path)
+    records = reader.summaries()
+    times, values = reader.read()
+    assert np.array_equal(records, summarize(times, values, 64))
+    assert records[:, 0].sum() == 5000 and records[-1, 0] == 5000 % 64
+    assert records[:, 3:6].sum(axis=0).tolist() == (~np.isnan(values)).sum(axis=0).tolist()
+    # a log written without summary gets one at its first read
+    bare = write_log(tmp_path.joinpath('bare.ckr'), 5000, summary_rows=0)
+    assert not summary_path(bare).exists()
+    assert np.array_equal(RawLogReader(bare).summaries(), summarize(times, values))
+    assert summary_path(bare).exists()
+
+
+def test_query_uses_summaries(tmp_path, monkeypatch):
+    path = write_log(tmp_path.joinpath('log.ckr'), 50_000)
+    times, values = RawLogReader(path).read()
+    query = LogQuery(path)
+    decoded = []
+    decode_block = RawLogReader.decode_block
+    monkeypatch.setattr(RawLogReader, 'decode_block',
+                        lambda self, index, data=None: decoded.append(index) or decode_block(self, index, data))
+    start, stop = T0 + 1234.5, T0 + 45_678.2
+    points = query.query(['Flow', 'Steam'], start, stop, points=200)
+    assert len(decoded) <= 4  # only the blocks of the first and last summary records
+    inside = (times >= start) & (times <= stop)
+    expected = values[inside][:, [2, 0]]
+    assert len(points.times) == 200 and np.all(np.diff(points.times) > 0)
+    assert points.count.sum(axis=0).tolist() == (~np.isnan(expected)).sum(axis=0).tolist()
+    assert np.nanmin(points.min, axis=0).tolist() == np.nanmin(expected, axis=0).tolist()
+    assert np.nanmax(points.max, axis=0).tolist() == np.nanmax(expected, axis=0).tolist()
+    assert np.allclose(np.nansum(points.mean * points.count, axis=0), np.nansum(expected, axis=0))
+    assert np.all((points.min <= points.mean) & (points.mean <= points.max))
+
+
+def test_zoomed_in(tmp_path):
+    path = write_log(tmp_path.joinpath('log.ckr'), 20_000)
+    times, values = RawLogReader(path).read()
+    query = LogQuery(path)
+    points = query.query(start=T0 + 5000, stop=T0 + 5099, points=1000)  # the snapshots themselves
+    assert points.times.tolist() == times[5000:5100].tolist()
+    assert np.array_equal(points.mean, values[5000:5100], equal_nan=True)
+    points = query.query(start=T0 + 5000, stop=T0 + 5999.999, points=100)  # binned from the snapshots
+    assert points.times[0] == pytest.approx(T0 + 5005, abs=0.001) and points.count[:, 0].tolist() == [10] * 100
+    assert points.max[0, 0] == values[5000:5010, 0].max() and points.mean[1, 1] == values[5010:5020, 1].mean()
+
+
+def test_several_logs(tmp_path):
+    write_log(tmp_path.joinpath('gen_2.ckr'), 3000, start=T0 + 10_000, seed=2)
+    write_log(tmp_path.joinpath('gen_1.ckr'), 3000, seed=1)
+    query = LogQuery(tmp_path)
+    assert len(query) == 6000 and query.start == T0 and query.stop == T0 + 12_999
+    points = query.query(['Air'], points=50)
+    assert points.count.sum() == 6000
+    assert np.all((points.times < T0 + 3000) | (points.times > T0 + 10_000))  # no point in the gap
+    writer = RawLogWriter(tmp_path.joinpath('other.ckr'), ['Steam'], [10])
+    writer.close()
+    with pytest.raises(ValueError):
+        LogQuery(tmp_path)
+
+
+def test_log_being_written(tmp_path):
+    writer = RawLogWriter(tmp_path.joinpath('live.ckr'), CHANNELS, [10, 10, 100], block_size=100, summary_rows=64)
+    for index in range(1000):
+        writer.write({'timestamp': T0 + index, 'Steam': 120., 'Air': 50., 'Flow': index / 100})
+    writer.flush()  # the summary file covers 960 snapshots, the log 1000
+    query = LogQuery(writer.path)
+    assert len(query) == 1000 and query.stop == T0 + 999
+    for index in range(1000, 1050):
+        writer.write({'timestamp': T0 + index, 'Steam': 120., 'Air': 50., 'Flow': 10.})
+    query.refresh()
+    assert len(query) == 1000  # the last 50 snapshots are not yet in a block
+    writer.close()
+    query.refresh()
+    assert len(query) == 1050 and query.query(['Flow'], points=10).max[-1, 0] == 10.
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus endpoint of the E-series driver
+"""
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+
+def test_metrics_endpoint(driver):
+    driver.instr.modbus.memory[4148] = 1205  # Steam, 120.5 °C
+    driver.get_snapshot()
+    driver.get_snapshot()
+    driver.set_setpoint('RH', 30)
+    driver.instr.modbus.fail = 'timeout'
+    with pytest.raises(Exception):
+        driver.read_channel('Air')
+    driver.instr.modbus.fail = None
+
+    server = driver.start_metrics_server(port=0)
+    try:
+        calls = sum(entry.calls for entry in driver.instr.stats.registers.values())
+        with urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            text = response.read().decode()
+        assert sum(entry.calls for entry in driver.instr.stats.registers.values()) == calls  # no Modbus traffic
+        with pytest.raises(HTTPError):
+            urlopen(f'http://127.0.0.1:{server.port}/other')
+    finally:
+        driver.close()
+    assert driver.metrics_server is None
+
+    samples = dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+    assert float(samples['cellkraft_process_value{host="localhost",channel="Steam"}']) == 120.5
+    assert samples['cellkraft_connected{host="localhost"}'] == '0'
+    assert samples['cellkraft_modbus_requests_total{host="localhost",function="read_input_registers",'
+                   'register="Steam"}'] == '2'
+    assert samples['cellkraft_modbus_timeouts_total{host="localhost",function="read_input_registers",'
+                   'register="Air"}'] == '1'
+    assert samples['cellkraft_modbus_latency_seconds_count{host="localhost",function="write_register",'
+                   'register="RH"}'] == '1'
+    assert 'cellkraft_modbus_latency_seconds{host="localhost",function="write_register",register="RH",' \
+           'quantile="0.99"}' in samples
+    assert float(samples['cellkraft_poll_rate_hertz{host="localhost"}']) > 0
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Request statistics of the Modbus instrument and of the E-series driver
+
+The instrument talks to an in-memory fake of the pymodbus client (see fakes.py), so that the tests and the
+overhead benchmark run without a generator. Run this file as a script to print the benchmark.
+"""
+import time
+
+import numpy as np
+import pytest
+
+from pymodbus.exceptions import ModbusIOException
+
+from pymodaq_plugins_cellkraft.hardware.stats import LatencyHistogram
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Air, Steam
+
+from fakes import FakeClient
+
+# max time added by the statistics to a single request, in bare calls of the fake client timed alongside (about 1 µs,
+# a LAN round-trip with the generator being of a few ms): relative, so that a loaded machine (pytest -n) slows both
+OVERHEAD_BUDGET = 5
+
+
+def test_histogram_precision():
+    values = np.random.default_rng(0).lognormal(15, 1, 20000).astype(int)
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(int(value))
+    assert histogram.count == values.size
+    assert histogram.max == values.max() and histogram.min == values.min()
+    for percent in (50, 90, 99):
+        assert histogram.percentile(percent) == pytest.approx(np.percentile(values, percent), rel=0.04)
+    for value in [0, 1, 63, 64, 1000, 123456789]:
+        low, high = histogram.bucket_bounds(histogram.bucket(value))
+        assert low <= value <= high
+
+
+def test_counters(driver):
+    driver.read_channel(Air)
+    driver.set_setpoint('RH', 50)
+    driver.set_setpoint('RH', 50)
+    driver.instr.modbus.fail = 'error'
+    with pytest.raises(IOError):
+        driver.read_channel(Steam)
+    driver.instr.modbus.fail = 'timeout'
+    with pytest.raises(ModbusIOException):
+        driver.read_channel(Steam)
+
+    stats = driver.get_stats()
+    assert stats['suppressed_writes'] == 1
+    assert stats['registers']['read_input_registers/Air']['calls'] == 1
+    assert stats['registers']['write_register/RH']['calls'] == 1
+    steam = stats['registers']['read_input_registers/Steam']
+    assert (steam['calls'], steam['errors'], steam['timeouts']) == (2, 1, 1)
+    assert stats['function_codes']['read_input_registers']['calls'] == 3
+    assert stats['function_codes']['read_input_registers']['latency_ms']['count'] == 3
+
+    driver.reset_stats()
+    assert driver.get_stats()['registers'] == {}
+
+
+def test_stop_then_same_setpoint(driver):
+    memory = driver.instr.modbus.memory
+    flow = driver.registers['SP_Flow']['register']
+    assert driver.set_setpoint('SP_Flow', 10)
+    driver.stop()
+    assert memory[flow] == 0 and driver.get_setpoint('SP_Flow') == 0
+    assert driver.set_setpoint('SP_Flow', 10) and memory[flow] == 100
+    driver.SP_Flow(0)  # direct writers bypass the suppression, so their register is forgotten
+    assert driver.get_setpoint('SP_Flow') is None
+    assert driver.set_setpoint('SP_Flow', 10) and memory[flow] == 100
+    driver.stop()
+    driver.stop()  # always sent
+    assert driver.get_stats()['registers']['write_register/SP_Flow']['calls'] == 7
+
+
+def test_periodic_log(driver, caplog):
+    driver.instr.stats.log_interval = 1e-9
+    with caplog.at_level('INFO', logger='pymodaq'):
+        driver.read_channel(Air)
+    assert 'read_input_registers/Air: 1 calls' in caplog.text
+
+
+def measure_overhead(repeat: int = 20000):
+    """Time added by the statistics to a request and time of the bare request to the fake client, in s
+
+    The bare and instrumented requests are timed in alternate rounds, keeping the best round of each.
+    """
+    driver = CellKraftE1500Drivers('localhost')
+    client = driver.instr.modbus = FakeClient()
+    methods = (lambda: client.read_input_registers(Air.read_address.value, count=1),
+               lambda: driver.instr.read(Air.read_address.value))
+    durations = [np.inf, np.inf]
+    for _ in range(5):
+        for index, method in enumerate(methods):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                method()
+            durations[index] = min(durations[index], (time.perf_counter() - start) / repeat)
+    return durations[1] - durations[0], durations[0]
+
+
+def test_overhead():
+    overhead, baseline = measure_overhead()
+    assert overhead < OVERHEAD_BUDGET * baseline, f'statistics add {overhead * 1e6:.2f} µs per request, ' \
+                                                  f'{overhead / baseline:.1f} bare calls'
+
+
+if __name__ == '__main__':
+    overhead, baseline = measure_overhead()
+    print(f'statistics overhead: {overhead * 1e6:.2f} µs per request, {overhead / baseline:.1f} bare calls of '
+          f'{baseline * 1e6:.2f} µs (budget {OVERHEAD_BUDGET} bare calls)')
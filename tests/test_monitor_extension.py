@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Cellkraft monitor dashboard extension, fed by a driver answering from memory
+"""
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Steam
+
+
+@pytest.fixture
+def monitor(qtbot, driver):
+    from pymodaq.utils.gui_utils import DockArea
+    from pymodaq_plugins_cellkraft.extensions.cellkraft_monitor import CellkraftMonitor
+    from qtpy import QtWidgets
+    window = QtWidgets.QMainWindow()
+    area = DockArea()
+    window.setCentralWidget(area)
+    monitor = CellkraftMonitor(area, None)
+    monitor.shared_driver = lambda: driver
+    yield monitor
+    monitor.quit()
+
+
+def test_monitor(monitor, driver):
+    driver.instr.modbus.memory[Steam.read_address.value] = 1205
+    monitor.settings.child('connection', 'poll_interval').setValue(0.005)
+    monitor.settings.child('display', 'points').setValue(100)
+    monitor.connect_generator(True)
+    assert driver.stream is not None and not monitor.own_driver
+    time.sleep(0.5)
+    monitor.refresh()
+    x, y = monitor.curves['Steam'].getData()
+    assert 0 < len(y) <= 100 and y[-1] == pytest.approx(120.5)
+    assert len(monitor.curves['Water'].getData()[1]) == len(y)
+    assert monitor.settings['stats', 'requests'] >= len(driver.stream.history)
+    monitor.settings.child('setpoints', 'RH').setValue(30)
+    monitor.apply_setpoints()
+    for _, future in monitor.pending:
+        future.result(timeout=1.)
+    assert driver.instr.modbus.memory[driver.registers['RH']['register']] == 300
+    monitor.refresh()
+    assert not monitor.pending
+    monitor.connect_generator(False)
+    assert monitor.driver is None and driver.stream is None
+
+
+def test_apply_only_edited_setpoints(monitor, driver):
+    memory = driver.instr.modbus.memory
+    driver.set_setpoint('SP_SteamT', 150)
+    driver.set_setpoint('PumpSetMode', 'manual')
+    monitor.settings.child('connection', 'poll_interval').setValue(0.005)
+    monitor.connect_generator(True)
+    assert monitor.settings['setpoints', 'SP_SteamT'] == 150
+    assert monitor.settings['setpoints', 'PumpSetMode'] == 'manual' and not monitor.edited
+    memory.clear()
+    monitor.settings.child('setpoints', 'RH').setValue(30)
+    monitor.apply_setpoints()
+    for _, future in monitor.pending:
+        future.result(timeout=1.)
+    assert memory == {driver.registers['RH']['register']: 300}
+    assert not monitor.edited and driver.get_setpoint('SP_SteamT') == 150
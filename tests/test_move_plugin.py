@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Actuator plugin of the generator setpoints, as a slave of a driver answering from a dict of registers
+"""
+import pytest
+
+from pymodaq.utils.data import DataActuator
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Air, Steam
+
+
+@pytest.fixture
+def plugin(qtbot, driver):
+    from pymodaq_plugins_cellkraft.daq_move_plugins.daq_move_CellkraftE1500 import DAQ_Move_CellkraftE1500
+    plugin = DAQ_Move_CellkraftE1500()
+    plugin.settings.child('multiaxes', 'multi_status').setValue('Slave')
+    plugin.ini_stage(driver)
+    return plugin
+
+
+def test_actuator_value(plugin, driver):
+    driver.instr.modbus.memory[Air.read_address.value] = 523
+    assert plugin.get_actuator_value().value() == pytest.approx(52.3)
+    plugin.settings.child('multiaxes', 'axis').setValue('Steam T')
+    driver.instr.modbus.memory[Steam.read_address.value] = 1187
+    assert plugin.get_actuator_value().value() == pytest.approx(118.7)
+
+
+def test_move_abs(plugin, driver):
+    memory = driver.instr.modbus.memory
+    plugin.move_abs(DataActuator(data=42.))
+    assert memory[Air.write_address.value] == 420
+    memory.clear()
+    plugin.move_abs(DataActuator(data=42.04))  # same quantized setpoint: no write
+    assert Air.write_address.value not in memory
+    plugin.settings.child('multiaxes', 'axis').setValue('Steam T')
+    plugin.move_abs(DataActuator(data=120.))
+    assert memory[Steam.write_address.value] == 120
+    assert driver.settling['Steam'] is plugin.predictor and 'Air' not in driver.settling
+
+
+def test_commit_settings(plugin):
+    plugin.settings.child('settling', 'band').setValue(1.5)
+    plugin.commit_settings(plugin.settings.child('settling', 'band'))
+    plugin.settings.child('settling', 'lookahead').setValue(30.)
+    plugin.commit_settings(plugin.settings.child('settling', 'lookahead'))
+    plugin.settings.child('settling', 'window').setValue(12)
+    plugin.commit_settings(plugin.settings.child('settling', 'window'))
+    assert (plugin.predictor.band, plugin.predictor.window, plugin.predictor.lookahead) == (1.5, 12, 30.)
+    assert plugin.user_condition_to_reach_target()  # without prediction
+    plugin.settings.child('settling', 'use_prediction').setValue(True)
+    plugin.move_abs(DataActuator(data=60.))
+    assert not plugin.user_condition_to_reach_target()  # no readback yet
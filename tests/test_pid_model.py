@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+PID model closing the loop on the RH or the steam temperature, without a PID window
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymodaq.utils.data import DataToExport, DataRaw
+from pymodaq.utils.parameter import Parameter
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft import Eseries
+from pymodaq_plugins_cellkraft.models import PIDModelCellkraft as pid_module
+from pymodaq_plugins_cellkraft.models.PIDModelCellkraft import PIDModelCellkraft
+
+
+def group(name, children):
+    return {'name': name, 'type': 'group', 'children': children}
+
+
+@pytest.fixture
+def model(qtbot):
+    from qtpy import QtWidgets
+    limits = [{'name': f'output_limit_{limit}', 'type': 'float', 'value': 0.} for limit in ('min', 'max')] + \
+             [{'name': f'output_limit_{limit}_enabled', 'type': 'bool', 'value': False} for limit in ('min', 'max')]
+    constants = [{'name': name, 'type': 'float', 'value': 0.} for name in ('kp', 'ki', 'kd')]
+    settings = Parameter.create(name='settings', type='group', children=[
+        group('models', [group('model_params', PIDModelCellkraft.params)]),
+        group('main_settings', [group('pid_controls', [group('output_limits', limits),
+                                                       group('pid_constants', constants)])])])
+    toolbar_layout = QtWidgets.QGridLayout()
+    toolbar_layout.addWidget(QtWidgets.QLabel('RH'), 2, 2, 1, 1)  # as PIDController.set_setpoints_buttons
+    pid_controller = SimpleNamespace(settings=settings, setpoints=None, toolbar_layout=toolbar_layout,
+                                     modules_manager=SimpleNamespace(actuators_name=['Cellkraft'],
+                                                                     detectors_name=['Reference']))
+    model = PIDModelCellkraft(pid_controller)
+    settings.child('models', 'model_params').sigTreeStateChanged.connect(
+        lambda param, changes: [model.update_settings(child) for child, change, data in changes if change == 'value'])
+    model.ini_model()
+    return model
+
+
+def output_limits(model):
+    return tuple(model.pid_controller.settings['main_settings', 'pid_controls', 'output_limits',
+                                               f'output_limit_{limit}'] for limit in ('min', 'max'))
+
+
+def test_ini_model(model):
+    assert model.pid_controller.setpoints == [50.]
+    assert model.pid_controller.settings['main_settings', 'pid_controls', 'pid_constants', 'kp'] == 0.5
+    assert output_limits(model) == (0., 100.)
+
+
+def test_convert_output(model):
+    setpoint = model.convert_output([42.37], dt=0.5)
+    assert setpoint.mode == 'abs' and setpoint[0].value() == pytest.approx(42.4)  # 0.1 % resolution
+    assert model.convert_output([45.], dt=0.5)[0].value() == pytest.approx(42.4)  # within the write interval
+    assert model.convert_output([45.], dt=0.5)[0].value() == 45.
+    assert model.convert_output([130.], dt=1.)[0].value() == 104.  # clipped to the authorized range
+
+
+def test_controlled_steam_temperature(model):
+    model.settings.child('controlled').setValue('Steam T')
+    assert model.setpoints_names == ['Steam T']
+    assert model.pid_controller.toolbar_layout.itemAtPosition(2, 2).widget().text() == 'Steam T'
+    assert output_limits(model) == (0., 199.)
+    assert model.convert_output([120.4], dt=0.1)[0].value() == 120.  # 1 °C resolution, written at once
+    model.settings.child('controlled').setValue('RH')
+    assert model.setpoints_names == ['RH'] and output_limits(model) == (0., 104.)
+
+
+def test_convert_input(model):
+    measurements = DataToExport('measurements', data=[DataRaw('Reference', data=[np.array([47.5])])])
+    inputs = model.convert_input(measurements)
+    assert inputs[0].data[0][0] == 47.5
+
+
+def test_device_model(model, monkeypatch):
+    config = {**Eseries.Eseries_Config, 3000: {**Eseries.Eseries_Config[1500], 'Air': {
+        **Eseries.Eseries_Config[1500]['Air'], 'authorized_write_value': range(0, 91)}}}
+    monkeypatch.setattr(Eseries, 'Eseries_Config', config)
+    monkeypatch.setattr(pid_module, 'DEVICES', {'Cellkraft E1500 Series': 3000})
+    try:
+        model.update_settings(model.settings.child('device'))
+        assert model.output_bounds == (0, 90) and output_limits(model) == (0., 90.)
+        assert model.convert_output([95.], dt=1.)[0].value() == 90.
+    finally:
+        Eseries.get_validators.cache_clear()
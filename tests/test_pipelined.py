@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Pipelined Modbus TCP requests against a local server emulating a remote generator
+
+Run this file as a script to print the throughput against the window size.
+"""
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Steam, Air
+from pymodaq_plugins_cellkraft.hardware.transports import TcpTransport, READ_INPUT_REGISTERS, \
+    WRITE_REGISTER, WRITE_REGISTERS
+
+from modbus_server import ModbusTcpTestServer
+
+LATENCY = 0.02
+
+
+@pytest.fixture
+def server():
+    server = ModbusTcpTestServer(latency=LATENCY)
+    yield server
+    server.close()
+
+
+def measure_throughput(port: int, window: int, n_requests: int = 32) -> float:
+    """Requests per second of a batch of reads"""
+    client = TcpTransport('127.0.0.1', port, window=window)
+    start = time.perf_counter()
+    client.execute([(READ_INPUT_REGISTERS, 4148, 1)] * n_requests)
+    duration = time.perf_counter() - start
+    client.close()
+    return n_requests / duration
+
+
+def test_batch(server):
+    client = TcpTransport('127.0.0.1', server.port, window=4)
+    server.memory.update({100: 7, 101: 8})
+    responses = client.execute([(READ_INPUT_REGISTERS, 100, 2), (WRITE_REGISTER, 200, 5),
+                                (WRITE_REGISTERS, 300, [1, 2, 3]), (READ_INPUT_REGISTERS, 101, 1),
+                                (READ_INPUT_REGISTERS, 300, 3)])
+    assert responses[0].registers == [7, 8]
+    assert not responses[1].isError() and server.memory[200] == 5
+    assert responses[3].registers == [8]
+    assert responses[4].registers == [1, 2, 3]
+    assert client.read_input_registers(200).registers == [5]
+    client.close()
+
+
+def test_throughput_scales_with_window(server):
+    serial = measure_throughput(server.port, 1, 8)
+    pipelined = measure_throughput(server.port, 8, 8)
+    assert serial < 1 / LATENCY
+    assert pipelined > 4 * serial
+
+
+def test_serial_fallback():
+    server = ModbusTcpTestServer(pipelining=False)
+    try:
+        server.memory.update({4148: 1200, 4628: 500})
+        client = TcpTransport('127.0.0.1', server.port, window=4, timeout=0.2)
+        responses = client.execute([(READ_INPUT_REGISTERS, 4148, 1), (READ_INPUT_REGISTERS, 4628, 1)] * 2)
+        assert [response.registers[0] for response in responses] == [1200, 500] * 2
+        assert client.pipelining_rejected and client.window == 1
+        assert client.execute([(READ_INPUT_REGISTERS, 4628, 1)] * 2)[1].registers == [500]
+        client.close()
+    finally:
+        server.close()
+
+
+def test_driver_snapshot(server):
+    server.memory.update({Steam.read_address.value: 1205, Air.read_address.value: 456})
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port, pipeline_window=8)
+    driver.init_hardware()
+    assert driver.init
+    start = time.perf_counter()
+    snapshot = driver.get_snapshot()
+    assert time.perf_counter() - start < 3 * LATENCY
+    assert (snapshot['Steam'], snapshot['Air']) == (120.5, 45.6)
+    driver.write_setpoints({'RH': 30, 'SP_SteamT': 150})
+    assert server.memory[driver.registers['RH']['register']] == 300
+    stats = driver.get_stats()['registers']
+    assert stats['read_input_registers/Steam']['calls'] == 2
+    assert stats['read_input_registers/Steam']['latency_ms']['min'] >= LATENCY * 1e3
+    driver.close()
+
+
+if __name__ == '__main__':
+    server = ModbusTcpTestServer(latency=LATENCY)
+    for window in (1, 2, 4, 8, 16):
+        print(f'window {window:2d}: {measure_throughput(server.port, window, 64):6.1f} requests/s '
+              f'({LATENCY * 1e3:.0f} ms latency)')
+    server.close()
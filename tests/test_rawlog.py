@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Delta/zigzag/varint codec of the raw register logs
+"""
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.rawlog import RawLogReader, RawLogWriter, MISSING, unzigzag, \
+    varint_decode, varint_encode, zigzag
+
+
+def random_walk(rows, channels=6, seed=0):
+    rng = np.random.default_rng(seed)
+    return 1000 + np.cumsum(rng.integers(-2, 3, (rows, channels)), axis=0)
+
+
+def test_varint_zigzag():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 40, 2 ** 64 - 1], dtype=np.uint64)
+    assert varint_encode(values[:5]) == bytes([0, 1, 127, 0x80, 1, 0xac, 2])
+    assert varint_decode(varint_encode(values)).tolist() == values.tolist()
+    signed = np.array([0, -1, 1, -2, 2 ** 62, -2 ** 62, MISSING], dtype=np.int64)
+    assert zigzag(signed[:4]).tolist() == [0, 1, 2, 3]
+    assert unzigzag(zigzag(signed)).tolist() == signed.tolist()
+    with pytest.raises(ValueError):
+        varint_decode(bytes([0x80]))
+
+
+def test_roundtrip(tmp_path):
+    raw = random_walk(10_000)
+    times = 1.7e9 + np.arange(10_000) + np.random.default_rng(1).uniform(0, 0.01, 10_000)
+    writer = RawLogWriter(tmp_path.joinpath('log.ckr'), list('abcdef'), [10, 10, 10, 100, 10, 1], block_size=4096)
+    for timestamp, row in zip(times, raw):
+        writer.write_raw(timestamp, row)
+    writer.write({'timestamp': times[-1] + 1, 'a': 12.3, 'b': float('nan')})
+    writer.close()
+    reader = RawLogReader(writer.path)
+    assert reader.channels == list('abcdef') and len(reader) == 10_001
+    assert [rows for _, rows, _ in reader.blocks] == [4096, 4096, 1809]
+    read_times, values = reader.read(physical=False)
+    assert np.array_equal(values[:-1], raw)
+    assert np.allclose(read_times[:-1], times, atol=5e-4)
+    physical = reader.read()[1]
+    assert physical[0] == pytest.approx(raw[0] / [10, 10, 10, 100, 10, 1])
+    assert physical[-1, 0] == pytest.approx(12.3) and np.isnan(physical[-1, 1:]).all()
+    assert values[-1, 1] == MISSING
+
+
+def test_truncated_file(tmp_path):
+    writer = RawLogWriter(tmp_path.joinpath('log.ckr'), ['a'], [10], block_size=100)
+    for index in range(250):
+        writer.write_raw(index, [index])
+    writer.close()
+    with open(writer.path, 'r+b') as file:
+        file.truncate(writer.path.stat().st_size - 3)  # crash in the middle of the last block
+    reader = RawLogReader(writer.path)
+    assert len(reader) == 200 and reader.read(physical=False)[1][-1, 0] == 199
+
+
+def test_size_and_decoding_speed(tmp_path):
+    rows = 100_000
+    raw = random_walk(rows)
+    times = 1.7e9 + np.arange(rows)
+    writer = RawLogWriter(tmp_path.joinpath('log.ckr'), list('abcdef'), [10] * 6)
+    for timestamp, row in zip(times, raw):
+        writer.write_raw(timestamp, row)
+    writer.close()
+    csv = tmp_path.joinpath('log.csv')
+    np.savetxt(csv, np.column_stack([times, raw / 10]), delimiter=',', fmt='%.3f')
+    assert writer.path.stat().st_size * 5 < csv.stat().st_size
+    assert writer.path.stat().st_size * 5 < (rows * 7 * 8)  # float64
+
+    start = time.perf_counter()
+    RawLogReader(writer.path).read()
+    decoding = time.perf_counter() - start
+    start = time.perf_counter()
+    np.loadtxt(csv, delimiter=',')
+    assert decoding < time.perf_counter() - start
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Recording the Modbus traffic of a driver and replaying it offline
+"""
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Steam, Air
+from pymodaq_plugins_cellkraft.hardware.transports import RecordingTransport, ReplayTransport, read_recording, \
+    READ_INPUT_REGISTERS
+
+from fakes import FakeClient
+from modbus_server import ModbusTcpTestServer
+
+LATENCY = 0.005
+
+
+@pytest.fixture(params=[1, 4])
+def recording(request, tmp_path):
+    """Record a short session of a driver (pymodbus client or pipelined transport), return its path and snapshots"""
+    server = ModbusTcpTestServer(latency=LATENCY)
+    path = tmp_path.joinpath('session.ckmr')
+    driver = CellKraftE1500Drivers('127.0.0.1', port=server.port, pipeline_window=request.param)
+    driver.init_hardware()
+    driver.instr.start_recording(path)
+    snapshots = []
+    for ind in range(5):
+        server.memory[Steam.read_address.value] = 1000 + ind
+        snapshots.append(driver.get_snapshot())
+        time.sleep(0.01)
+    driver.write_setpoints({'RH': 40})
+    driver.read_channel(Air)
+    driver.close()
+    server.close()
+    yield path, snapshots
+
+
+def test_recording_file(recording):
+    path, snapshots = recording
+    started, records = read_recording(path)
+    assert abs(started - snapshots[0]['timestamp']) < 1
+    assert len(records) == 5 * 6 + 1 + 6 + 1  # snapshots, write_setpoints and its snapshot, read_channel
+    steam = [record for record in records if record.address == Steam.read_address.value]
+    assert [record.response[0] for record in steam] == [1000, 1001, 1002, 1003, 1004, 1004]
+    assert all(record.received - record.sent >= LATENCY for record in records)
+    assert path.stat().st_size < 32 * len(records)
+
+
+def test_flushed_while_recording(tmp_path):
+    path = tmp_path.joinpath('session.ckmr')
+    transport = RecordingTransport(FakeClient(), path, flush_interval=0.)
+    transport.execute([(READ_INPUT_REGISTERS, Steam.read_address.value, 1)] * 3)
+    assert len(read_recording(path)[1]) == 3  # readable by another process while the session goes on
+    transport.flush_interval = 3600.
+    transport.execute([(READ_INPUT_REGISTERS, Air.read_address.value, 1)] * 2)
+    transport.stop()
+    assert len(read_recording(path)[1]) == 5
+
+
+def test_replay_fast(recording):
+    path, snapshots = recording
+    driver = CellKraftE1500Drivers(str(path), transport='replay')
+    driver.init_hardware()
+    start = time.perf_counter()
+    replayed = [driver.get_snapshot() for _ in range(5)]
+    assert time.perf_counter() - start < 0.02
+    for original, snapshot in zip(snapshots, replayed):
+        assert {key: value for key, value in original.items() if key != 'timestamp'} == \
+               {key: value for key, value in snapshot.items() if key != 'timestamp'}
+    driver.write_setpoints({'RH': 40})
+    assert driver.read_channel(Air) == 0.
+    assert driver.instr.modbus.finished
+    with pytest.raises(IOError):
+        driver.get_snapshot()
+
+
+def test_replay_cadence(recording):
+    path, _ = recording
+    _, records = read_recording(path)
+    transport = ReplayTransport(path, speed=1.)
+    start = time.perf_counter()
+    for record in records[:18]:
+        transport.execute([(record.function_code, record.address, record.request[0])])
+    assert time.perf_counter() - start >= records[17].received - records[0].sent - 0.002
+
+
+def test_replay_skips_requests_no_longer_sent(recording):
+    path, _ = recording
+    transport = ReplayTransport(path)
+    assert transport.execute([(READ_INPUT_REGISTERS, Air.read_address.value, 1)])[0].registers == [0]
+    assert transport.position == 2  # Steam read of the first snapshot skipped
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Driver running in a worker process, against a local server emulating the generator
+"""
+import time
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Steam
+from pymodaq_plugins_cellkraft.hardware.cellkraft.remote import RemoteDriver, SharedSnapshot, CHANNELS
+
+from modbus_server import ModbusTcpTestServer
+
+INTERVAL = 0.02
+
+
+@pytest.fixture
+def server():
+    server = ModbusTcpTestServer()
+    server.memory[Steam.read_address.value] = 1205
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def driver(server):
+    driver = RemoteDriver('127.0.0.1', interval=INTERVAL, timeout=20., port=server.port)
+    driver.init_hardware()
+    yield driver
+    driver.close()
+
+
+def test_shared_snapshot_seqlock():
+    writer = SharedSnapshot()
+    reader = SharedSnapshot(writer.name)
+    try:
+        assert reader.read()[0] == 0
+        writer.publish(dict(timestamp=1., **{channel: index for index, channel in enumerate(CHANNELS)}))
+        sequence, data = reader.read()
+        assert sequence == 1 and data[0] == 1. and list(data[1:]) == list(range(len(CHANNELS)))
+        writer.header[0] += 1  # a write in progress
+        assert writer.sequence == 1
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_snapshots_from_shared_memory(server, driver):
+    assert driver.init and driver.alive
+    assert driver.read_channel(Steam) == pytest.approx(120.5)
+    first = driver.get_snapshot()
+    time.sleep(5 * INTERVAL)
+    received = server.received
+    later = driver.get_snapshot()
+    assert server.received == received  # read from the shared memory, not from the generator
+    assert later["timestamp"] > first["timestamp"]
+    server.memory[Steam.read_address.value] = 1300
+    time.sleep(5 * INTERVAL)
+    assert driver.read_channel('Steam') == pytest.approx(130.)
+
+
+def test_commands_through_the_pipe(server, driver):
+    assert driver.set_setpoint('SP_SteamT', 150)
+    assert not driver.set_setpoint('SP_SteamT', 150)  # suppressed by the driver in the worker
+    assert server.memory[Steam.write_address.value] == 150
+    assert driver.get_setpoint('SP_SteamT') == 150
+    assert driver.get_stats()["suppressed_writes"] == 1
+    assert driver.instr.connected
+    with pytest.raises(KeyError):
+        driver.set_setpoint('unknown', 1)
+
+
+def test_settling_predictor_fed_locally(driver):
+    predictor = driver.watch_settling('Steam')
+    driver.get_snapshot()
+    time.sleep(3 * INTERVAL)
+    driver.get_snapshot()
+    assert len(predictor.times) == 2 and list(predictor.values) == [120.5, 120.5]
+
+
+def test_worker_crash(server, driver):
+    driver.process.kill()
+    driver.process.join()
+    with pytest.raises(IOError):
+        driver.get_snapshot()
+    with pytest.raises(ConnectionError):
+        driver.set_setpoint('SP_SteamT', 120)
+    driver.init_hardware()
+    assert driver.alive
+    assert driver.read_channel(Steam) == pytest.approx(120.5)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Scanners ordering and refining the grids of the generator setpoints
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.scanners.sequential_refined import AdaptiveRefiner, neighbour_pairs
+from pymodaq_plugins_cellkraft.scanners.sequential_thermal import greedy_path, order_points, path_cost, \
+    transition_costs, two_opt
+
+RATES_UP = np.array([5., 4.]) / 60
+RATES_DOWN = np.array([1., 1.]) / 60
+
+
+def grid(steps=5):
+    steam, tube = np.meshgrid(np.linspace(20., 100., steps), np.linspace(100., 180., steps), indexing='ij')
+    return np.column_stack((steam.ravel(), tube.ravel()))
+
+
+def test_transition_costs_asymmetric():
+    costs = transition_costs(np.array([[20., 100.], [40., 100.]]), RATES_UP, RATES_DOWN, settle_time=60.)
+    assert costs[0, 1] == pytest.approx(20. / 5 * 60 + 60.) and costs[1, 0] == pytest.approx(20. * 60 + 60.)
+    assert costs[0, 0] == 0.
+
+
+def test_order_points_is_a_permutation():
+    positions = grid()
+    order = order_points(positions, RATES_UP, RATES_DOWN, settle_time=60.)
+    assert order[0] == 0 and sorted(order.tolist()) == list(range(len(positions)))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_two_opt_never_increases_the_cost(seed):
+    positions = np.random.default_rng(seed).uniform(0., 100., (30, 2))
+    costs = transition_costs(positions, RATES_UP, RATES_DOWN, settle_time=30.)
+    for order in (np.arange(len(positions)), greedy_path(costs)):
+        improved = two_opt(costs, order)
+        assert sorted(improved.tolist()) == list(range(len(positions))) and improved[0] == order[0]
+        assert path_cost(costs, improved) <= path_cost(costs, order) + 1e-9
+
+
+def test_thermal_scanner(qtbot):
+    from pymodaq_plugins_cellkraft.scanners.sequential_thermal import SequentialThermalScanner
+    scanner = SequentialThermalScanner([SimpleNamespace(title='Steam T'), SimpleNamespace(title='Tube T')])
+    scanner.update_model([['Steam T', 20., 60., 20., 5., 1.], ['Tube T', 100., 140., 20., 4., 1.]])
+    scanner.set_scan()
+    assert scanner.n_steps == 9
+    assert sorted(map(tuple, scanner.positions.tolist())) == [(steam, tube) for steam in (20., 40., 60.)
+                                                              for tube in (100., 120., 140.)]
+    assert 0 < scanner.settings['estimated_time'] <= scanner.settings['grid_time']
+
+
+def test_neighbour_pairs():
+    assert neighbour_pairs(np.array([[3.], [1.], [2.]])).tolist() == [[1, 2], [2, 0]]
+    assert neighbour_pairs(np.zeros((1, 2))).shape == (0, 2)
+    square = np.array([[0., 0.], [1., 0.], [0., 1.], [1., 1.]])
+    pairs = neighbour_pairs(square)
+    assert len(pairs) == 5  # the 4 sides and one diagonal
+    assert {(0, 1), (0, 2), (1, 3), (2, 3)} <= set(map(tuple, pairs.tolist()))
+
+
+def step_response(points):
+    return np.where(np.asarray(points)[:, 0] > 0.63, 1., 0.)
+
+
+def test_refiner_ask_tell():
+    refiner = AdaptiveRefiner([0.], [1.], [1 / 64], budget=100, tolerance=0.05)
+    grid_points = np.linspace(0., 1., 5)[:, np.newaxis]
+    refiner.tell(grid_points, step_response(grid_points))
+    asked = refiner.ask(3)
+    assert asked.tolist() == [[0.625]]  # only the pair around the step changes
+    assert refiner.n_points == 6 and not refiner.done
+    refiner.tell(asked, step_response(asked))
+    while not refiner.done:
+        asked = refiner.ask(5)
+        assert len(asked)
+        refiner.tell(asked, step_response(asked))
+    assert refiner.ask(5).shape == (0, 1)
+    # converged around the step, to the minimal spacing
+    assert np.diff(np.sort(refiner.points[:, 0])).min() == 1 / 64
+    assert refiner.n_points < 20
+
+
+def test_refiner_budget():
+    refiner = AdaptiveRefiner([0., 0.], [1., 1.], [0.001, 0.001], budget=12, tolerance=0.)
+    points = np.array([[x, y] for x in (0., 0.5, 1.) for y in (0., 0.5, 1.)])
+    refiner.tell(points, points.sum(axis=1))
+    assert len(refiner.ask(10)) == 3 and refiner.done and len(refiner.ask(10)) == 0
+
+
+@pytest.fixture
+def refined_scanner(qtbot, tmp_path):
+    from pymodaq_plugins_cellkraft.scanners.sequential_refined import SequentialRefinedScanner
+    scanner = SequentialRefinedScanner([SimpleNamespace(title='Steam T', units='°C')])
+    scanner.update_model([['Steam T', 0., 1., 0.25]])
+    scanner.settings.child('n_new').setValue(20)
+    scanner.settings.child('max_level').setValue(2)
+    return scanner
+
+
+def test_refined_scanner(refined_scanner, tmp_path):
+    refined_scanner.set_scan()
+    assert refined_scanner.n_steps == refined_scanner.evaluate_steps() == 5
+    path = tmp_path.joinpath('passes.txt')
+    grid_points = refined_scanner.positions
+    np.savetxt(path, np.column_stack((grid_points, step_response(grid_points))))
+    refined_scanner.settings.child('previous_file').setValue(str(path))
+    assert refined_scanner.evaluate_steps() == 1
+    refined_scanner.set_scan()
+    assert refined_scanner.n_steps == 1 and refined_scanner.positions.tolist() == [[0.625]]
+    assert refined_scanner.get_scan_shape() == (1,)
+
+
+def test_refined_scanner_converged(refined_scanner, tmp_path):
+    path = tmp_path.joinpath('passes.txt')
+    points = np.linspace(0., 1., 17)[:, np.newaxis]  # already at the minimal spacing
+    np.savetxt(path, np.column_stack((points, step_response(points))))
+    refined_scanner.settings.child('previous_file').setValue(str(path))
+    refined_scanner.set_scan()
+    assert refined_scanner.n_steps == refined_scanner.evaluate_steps() == 0
+    assert refined_scanner.positions.shape == (0, 1)
+
+
+def test_refined_scanner_load_error(refined_scanner, tmp_path):
+    refined_scanner.settings.child('previous_file').setValue(str(tmp_path.joinpath('missing.txt')))
+    with pytest.raises(ValueError):
+        refined_scanner.set_scan()
+    path = tmp_path.joinpath('passes.txt')
+    np.savetxt(path, np.zeros((4, 3)))  # one column too many
+    refined_scanner.settings.child('previous_file').setValue(str(path))
+    with pytest.raises(ValueError):
+        refined_scanner.evaluate_steps()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming first-order fit predicting the final value of a readback before it settles
+"""
+import math
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.settling import SettlingPredictor
+
+TAU = 120.
+
+
+def step(times, start=20., final=100.):
+    return final + (start - final) * np.exp(-np.asarray(times) / TAU)
+
+
+def feed(predictor, times, values):
+    """Time at which the predictor first declared the point settled, None if never"""
+    settled = None
+    for time, value in zip(times, values):
+        predictor.update(time, value)
+        if settled is None and predictor.settled:
+            settled = time
+    return settled
+
+
+def test_final_value_and_time_to_band():
+    predictor = SettlingPredictor(band=0.5)
+    times = np.arange(0., 60., 2.)
+    feed(predictor, times, step(times))
+    assert predictor.final_value == pytest.approx(100., abs=0.01)  # refined tau, not the nearest grid value
+    assert predictor.tau == pytest.approx(TAU, rel=0.001)
+    assert predictor.time_to_band == pytest.approx(TAU * math.log(80. / 0.5) - times[-1], rel=0.01)
+
+
+def test_settled_before_the_band():
+    times = np.arange(0., 1000., 2.)
+    predicted = SettlingPredictor(band=0.5)
+    predicted.reset(100.)
+    in_band = SettlingPredictor(band=0.5, lookahead=0.)
+    in_band.reset(100.)
+    early, late = feed(predicted, times, step(times)), feed(in_band, times, step(times))
+    entered = TAU * math.log(80. / 0.5)  # the readback enters the band after about 609 s
+    assert early < 60. and entered <= late < entered + 30.
+    with_lookahead = SettlingPredictor(band=0.5, lookahead=300.)
+    with_lookahead.reset(100.)
+    assert entered - 300. <= feed(with_lookahead, times, step(times)) < entered - 250.
+
+
+def test_noisy_readback():
+    times = np.arange(0., 1000., 2.)
+    values = step(times) + np.random.default_rng(0).normal(0., 0.05, times.size)
+    predictor = SettlingPredictor(band=0.5)
+    predictor.reset(100.)
+    for time, value in zip(times, values):
+        predictor.update(time, value)
+        if predictor.settled:
+            break
+    assert time < 200. and abs(predictor.final_value - 100.) <= 0.5
+    wrong_target = SettlingPredictor(band=0.5)
+    wrong_target.reset(102.)
+    assert feed(wrong_target, times, values) is None
+
+
+def test_flat_readback():
+    predictor = SettlingPredictor(band=0.5)
+    assert not predictor.settled and predictor.time_to_band == math.inf
+    feed(predictor, np.arange(10.), np.full(10, 50.))
+    assert predictor.settled and predictor.final_value == 50. and predictor.time_to_band == 0.
+    noisy = SettlingPredictor(band=0.5)
+    feed(noisy, np.arange(60.), 50. + np.random.default_rng(1).normal(0., 0.1, 60))
+    assert noisy.settled and noisy.tau == 0. and noisy.final_value == pytest.approx(50., abs=0.05)
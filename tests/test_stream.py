@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Shared snapshot stream, its bounded history and the decimation of the monitor plots
+"""
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Steam, Flow
+from pymodaq_plugins_cellkraft.hardware.cellkraft.stream import SnapshotHistory, SnapshotStream, minmax_decimate
+
+
+def test_history_ring():
+    history = SnapshotHistory(['a', 'b'], capacity=4)
+    for ind in range(6):
+        history.append({'timestamp': float(ind), 'a': ind, 'b': -ind})
+    times, values = history.latest()
+    assert len(history) == 4 and history.count == 6
+    assert times.tolist() == [2., 3., 4., 5.]
+    assert values[:, 1].tolist() == [-2, -3, -4, -5]
+    assert history.latest(1.5)[0].tolist() == [4., 5.]
+
+
+def test_minmax_decimate():
+    times = np.arange(10_000.)
+    values = np.sin(times / 500)
+    values[1234] = 10.
+    decimated_times, decimated = minmax_decimate(times, values, 100)
+    assert len(decimated) <= 200
+    assert decimated.max() == 10. and decimated.min() == values.min()
+    assert np.all(np.diff(decimated_times) > 0)
+    assert len(minmax_decimate(times[:50], values[:50], 100)[1]) == 50
+
+
+def test_stream_shared(driver):
+    driver.instr.modbus.memory[Steam.read_address.value] = 1205
+    received = []
+    start = time.monotonic()
+    stream = driver.start_stream(interval=0.02, capacity=1000)
+    assert driver.start_stream(interval=0.02) is stream
+    stream.subscribe(received.append)
+    time.sleep(0.2)
+    assert stream.submit(driver.set_setpoint, 'RH', 30).result(timeout=1.)
+    assert driver.instr.modbus.memory[driver.registers['RH']['register']] == 300
+    driver.stop_stream()
+    elapsed = time.monotonic() - start
+    assert driver.stream is None
+    calls = driver.get_stats()['registers']['read_input_registers/Steam']['calls']
+    # every poll is in the history, and the polls are paced by the interval however slow the machine
+    assert 0 < len(stream.history) == calls <= elapsed / 0.02 + 1
+    assert received and received[-1]['Steam'] == 120.5
+    assert stream.history.latest()[1][-1, 0] == pytest.approx(120.5)
+
+
+def test_stream_failures(driver):
+    driver.instr.modbus.fail = 'timeout'
+    stream = driver.start_stream(interval=0.01)
+    time.sleep(0.1)
+    driver.instr.modbus.fail = None
+    time.sleep(0.05)
+    driver.close()
+    assert stream.failures > 0 and len(stream.history) > 0 and stream.last_error is None
+
+
+def test_water_not_integrated_over_failures(driver):
+    driver.instr.modbus.memory[Flow.read_address.value] = 600  # 60 g/min, 1 g/s
+    stream = driver.start_stream(interval=0.02)
+    time.sleep(0.1)
+    driver.instr.modbus.fail = 'timeout'
+    time.sleep(0.2)
+    driver.instr.modbus.fail = None
+    time.sleep(0.1)
+    driver.stop_stream()
+    times, values = stream.history.latest()
+    water = values[:, stream.history.channels.index('Water')]
+    gaps = np.diff(times)
+    assert stream.failures > 0 and gaps.max() > 0.15
+    # the flow is integrated over the polled intervals only, not over the failure window
+    assert water[-1] == pytest.approx(gaps.sum() - gaps.max(), rel=1e-3)
+
+
+def test_water_integrated_over_slow_polls(driver):
+    driver.instr.modbus.memory[Flow.read_address.value] = 600  # 1 g/s
+    stream = SnapshotStream(driver, interval=0.01)
+    first = stream.poll()
+    time.sleep(0.1)  # a slow but successful poll, 10 intervals late
+    second = stream.poll()
+    assert second['Water'] == pytest.approx(second['timestamp'] - first['timestamp'])
+    driver.instr.modbus.fail = 'timeout'
+    assert stream.poll() is None
+    driver.instr.modbus.fail = None
+    assert stream.poll()['Water'] == second['Water']
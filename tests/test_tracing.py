@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling spans of the drivers saved as a Chrome trace
+"""
+import json
+
+from pymodaq_plugins_cellkraft.hardware.tracing import tracer
+
+
+def test_trace(driver, tmp_path):
+    recorded = len(tracer.events)  # kept from a previous trace, if any
+    driver.get_snapshot()
+    assert len(tracer.events) == recorded  # disabled by default
+
+    tracer.start(tmp_path.joinpath('trace.json'))
+    try:
+        driver.set_setpoint('RH', 40)
+        driver.get_snapshot()
+    finally:
+        tracer.stop()
+    driver.get_snapshot()
+
+    with open(tmp_path.joinpath('trace.json')) as file:
+        events = json.load(file)['traceEvents']
+    spans = [event for event in events if event['ph'] == 'X']
+    names = [span['name'] for span in spans]
+    assert names.count('modbus.read_input_registers') == len(driver.snapshot_channels)
+    assert names.count('modbus.write_register') == 1
+    assert {'CellKraftE1500Drivers.set_setpoint', 'CellKraftE1500Drivers.get_snapshot',
+            'CellKraftE1500Drivers.read_raw_snapshot', 'CellKraftE1500Drivers.decode_snapshot'} <= set(names)
+    assert any(event['ph'] == 'M' and event['name'] == 'thread_name' for event in events)
+
+    snapshot = spans[names.index('CellKraftE1500Drivers.get_snapshot')]
+    for span in spans:
+        if span['name'] == 'modbus.read_input_registers':
+            assert snapshot['ts'] <= span['ts'] and span['ts'] + span['dur'] <= snapshot['ts'] + snapshot['dur']
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Modbus RTU transports against a device emulated on a pseudo-terminal (serial line) and on a local TCP socket
+(serial gateway), and the driver running unchanged on each transport
+"""
+import json
+import sys
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import CellKraftE1500Drivers, Steam, Air
+from pymodaq_plugins_cellkraft.hardware.transports import make_transport, READ_INPUT_REGISTERS, \
+    WRITE_REGISTERS
+from pymodaq_plugins_cellkraft.hardware.transports.rtu import crc16
+from pymodaq_plugins_cellkraft.hardware.tracing import tracer
+
+from modbus_server import ModbusTcpTestServer, RtuTestDevice
+
+
+def test_crc():
+    # example of the Modbus over serial line specification: read 1 register at 0x0000 from unit 1
+    assert crc16(bytes.fromhex('010300000001')).to_bytes(2, 'little') == bytes.fromhex('840a')
+
+
+@pytest.fixture(params=['tcp', 'rtu', 'rtu_over_tcp'])
+def device(request):
+    """(transport name, host, port, emulated device) for each transport"""
+    if request.param == 'tcp':
+        device = ModbusTcpTestServer()
+        yield request.param, '127.0.0.1', device.port, device
+    elif request.param == 'rtu':
+        if sys.platform == 'win32':
+            pytest.skip('no pseudo-terminal on windows')
+        pytest.importorskip('serial')
+        device = RtuTestDevice()
+        yield request.param, device.serve_pty(), None, device
+    else:
+        device = RtuTestDevice()
+        yield request.param, '127.0.0.1', device.serve_tcp(), device
+    device.close()
+
+
+def test_driver_on_transport(device):
+    kind, host, port, emulated = device
+    emulated.memory.update({Steam.read_address.value: 1205, Air.read_address.value: 456})
+    options = {} if kind == 'tcp' else dict(baudrate=115200, timeout=0.5)
+    driver = CellKraftE1500Drivers(host, port=port or 502, transport=kind, **options)
+    driver.init_hardware()
+    assert driver.init
+    snapshot = driver.get_snapshot()
+    assert (snapshot['Steam'], snapshot['Air']) == (120.5, 45.6)
+    driver.write_setpoints({'RH': 30, 'SP_SteamT': 150})
+    assert emulated.memory[driver.registers['RH']['register']] == 300
+    assert driver.read_channel('Air') == 45.6
+    assert driver.get_stats()['registers']['read_input_registers/Air']['calls'] == 3
+    driver.close()
+
+
+def traced_batches(driver, path):
+    """Windows of the batch spans of a snapshot and a write_setpoints of the driver, traced to path"""
+    tracer.start(path)
+    try:
+        driver.get_snapshot()
+        driver.write_setpoints({'RH': 30})
+    finally:
+        tracer.stop()
+    with open(path) as file:
+        return [event['args']['window'] for event in json.load(file)['traceEvents'] if event['name'] == 'modbus.batch']
+
+
+def test_traced_batch(device, tmp_path):
+    kind, host, port, emulated = device
+    options = {} if kind == 'tcp' else dict(baudrate=115200, timeout=0.5)
+    driver = CellKraftE1500Drivers(host, port=port or 502, transport=kind, pipeline_window=4, **options)
+    driver.init_hardware()
+    window = 4 if kind == 'tcp' else 1
+    assert traced_batches(driver, tmp_path.joinpath('direct.json')) == [window] * 3  # snapshots before and after
+    driver.instr.start_recording(tmp_path.joinpath('session.ckmr'))
+    assert traced_batches(driver, tmp_path.joinpath('recording.json')) == [window] * 3
+    driver.close()
+    replay = CellKraftE1500Drivers(str(tmp_path.joinpath('session.ckmr')), transport='replay')
+    replay.init_hardware()
+    assert traced_batches(replay, tmp_path.joinpath('replay.json')) == [1] * 3
+
+
+@pytest.mark.parametrize('kind', ['rtu', 'rtu_over_tcp'])
+def test_rtu_timing_and_errors(kind):
+    if kind == 'rtu':
+        if sys.platform == 'win32':
+            pytest.skip('no pseudo-terminal on windows')
+        pytest.importorskip('serial')
+    emulated = RtuTestDevice(unit=3)
+    host, port = (emulated.serve_pty(), None) if kind == 'rtu' else ('127.0.0.1', emulated.serve_tcp())
+    try:
+        transport = make_transport(kind, host, port=port or 502, baudrate=1200, unit=3, timeout=0.3)
+        assert transport.frame_gap == pytest.approx(3.5 * 11 / 1200)
+        responses = transport.execute([(WRITE_REGISTERS, 10, [1, 2, 3])] + [(READ_INPUT_REGISTERS, 10, 3)] * 3)
+        assert [response.registers for response in responses[1:]] == [[1, 2, 3]] * 3
+        assert len(emulated.gaps) == 3 and min(emulated.gaps) >= transport.frame_gap
+
+        emulated.corrupt_next = True
+        with pytest.raises(IOError, match='CRC'):
+            transport.read_input_registers(10)
+        assert transport.read_input_registers(11).registers == [2]
+
+        transport.unit = 4  # nobody answers
+        with pytest.raises(TimeoutError):
+            transport.read_input_registers(10)
+        transport.close()
+    finally:
+        emulated.close()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled setpoint validators against the authorized values of the configuration
+"""
+import timeit
+
+import pytest
+
+from pymodaq_plugins_cellkraft.hardware.cellkraft.Eseries import Eseries_Config, SETPOINTS, get_validators, \
+    compile_validators, CellKraftE1500Drivers
+from pymodaq_plugins_cellkraft.hardware.cellkraft.validators import compile_validator, IntervalValidator, \
+    ModeValidator
+
+
+@pytest.mark.parametrize('model', list(Eseries_Config.keys()))
+def test_same_as_authorized_values(model):
+    validators = get_validators(model)
+    assert get_validators(model) is validators  # compiled once
+    for name, (reference, scaling) in SETPOINTS.items():
+        authorized = Eseries_Config[model][reference.__name__]['authorized_write_value']
+        for value in range(-10, 300):
+            if value in authorized:
+                assert validators[name].check(value) == value * scaling
+            else:
+                with pytest.raises(ValueError):
+                    validators[name].check(value)
+        with pytest.raises(TypeError):
+            validators[name].check(1.5)
+
+
+def test_compiled_kinds():
+    validators = get_validators(1500)
+    assert isinstance(validators['SP_Flow'], IntervalValidator)  # list of 250 values compiled as a range
+    assert isinstance(validators['PumpSetMode'], ModeValidator)
+    assert validators['PumpSetMode'].check('prime') == 2
+    assert validators['PumpSetMode'].check('unknown') == 0  # default mode, as PumpSetMode
+    assert (validators['RH'].raw_min, validators['RH'].raw_max) == (0, 1040)
+    assert validators['RH'].quantize(45.64) == 456
+    assert validators['RH'].quantize(150) == 1040
+
+    stepped = compile_validator('stepped', [10, 20, 30, 40])
+    assert isinstance(stepped, IntervalValidator) and stepped.step == 10
+    with pytest.raises(ValueError):
+        stepped.check(25)
+    assert [stepped.quantize(value) for value in (24.9, 25.1, 3., 47.)] == [20, 30, 10, 40]
+    assert stepped.quantize(26) == stepped.check(30)
+    offset = IntervalValidator('offset', 3, 43, step=10, scaling=10)
+    assert [offset.quantize(value) for value in (17.9, 18.1, 50.)] == [130, 230, 430]
+    assert isinstance(compile_validator('sparse', [1, 2, 5]), ModeValidator)
+
+
+def test_other_model_from_data():
+    config = {**Eseries_Config, 3000: {**Eseries_Config[1500], 'Flow': {**Eseries_Config[1500]['Flow'],
+                                                                           'authorized_write_value': range(0, 500)}}}
+    driver = CellKraftE1500Drivers('localhost', config=config, model=3000)
+    assert driver.validate_setpoints({'SP_Flow': 400}) == {driver.registers['SP_Flow']['register']: 4000}
+    assert compile_validators(config, 1500)['SP_Flow'].maximum == 249
+
+
+def test_constant_time():
+    small = compile_validator('small', list(range(10)), names={'a': 0})
+    large = compile_validator('large', list(range(100000)), names={'a': 0})
+    interval_small, interval_large = compile_validator('small', range(10)), compile_validator('large', range(10 ** 6))
+    for first, second, value in ((small, large, 5), (interval_small, interval_large, 5)):
+        durations = [min(timeit.repeat(lambda: validator.check(value), number=20000, repeat=5))
+                     for validator in (first, second)]
+        assert durations[1] < 2 * durations[0]